@@ -0,0 +1,167 @@
+# audio_prefilter.py
+"""
+音频预筛：恐惧震慑出现时伴随固定的音效。先用 FFmpeg 把录像的音轨解码成单声道 PCM，
+与参考音效做归一化互相关，找出候选时间窗口，再只在这些窗口(加前后余量)内做视频模板匹配。
+解码低采样率的音频比解码 1080p 视频便宜得多；没有音轨时退回完整的视频扫描。
+"""
+import subprocess
+import numpy as np
+from governor import get_governor
+
+# 音效的能量主要在几 kHz 以下，8 kHz 采样足够且互相关很快
+AUDIO_SAMPLE_RATE = 8000
+
+
+def decode_audio_mono(path, sample_rate=AUDIO_SAMPLE_RATE):
+    """
+    用 FFmpeg 把 path 的第一条音轨解码为单声道 float32 PCM。
+    没有音轨(或解码失败、结果为空)时返回 None。
+    """
+    cmd = [
+        "ffmpeg", "-v", "error", *get_governor().ffmpeg_args(), "-i", path, "-map", "0:a:0", "-vn", "-ac", "1",
+        "-ar",
+        str(sample_rate), "-f", "f32le", "-"
+    ]
+    result = subprocess.run(cmd, capture_output=True)
+    if result.returncode != 0 or not result.stdout:
+        return None
+    return np.frombuffer(result.stdout, dtype=np.float32)
+
+
+def normalized_xcorr(signal, cue, block=1 << 16, group=16):
+    """
+    cue 在 signal 上滑动的归一化互相关(即一维的 TM_CCOEFF_NORMED)，
+    返回长度 len(signal) - len(cue) + 1 的 float32 数组，取值 [-1, 1]。
+    signal 按 block 个输出点切成有重叠的段，每 group 段堆成二维数组一起做 FFT，
+    内存占用与录像长度无关。
+    """
+    signal = np.asarray(signal, dtype=np.float32)
+    cue = np.asarray(cue, dtype=np.float64)
+    m = len(cue)
+    n_out = len(signal) - m + 1
+    if m == 0 or n_out <= 0:
+        return np.zeros(0, dtype=np.float32)
+
+    cue_centered = cue - cue.mean()
+    cue_norm = np.sqrt((cue_centered**2).sum())
+    if cue_norm == 0:
+        raise ValueError("参考音效是静音")
+    nfft = 1 << (block + m - 2).bit_length()
+    step = nfft - m + 1
+    kernel = np.conj(np.fft.rfft(cue_centered, nfft))
+
+    # 补零使最后一段也有完整的 nfft 个采样
+    n_blocks = -(-n_out // step)
+    padded = np.zeros(n_blocks * step + m - 1, dtype=np.float32)
+    padded[:len(signal)] = signal
+    segments = np.lib.stride_tricks.sliding_window_view(padded, nfft)[::step]
+
+    out = np.empty(n_blocks * step, dtype=np.float32)
+    for g in range(0, n_blocks, group):
+        seg = segments[g:g + group].astype(np.float64)
+        numerator = np.fft.irfft(np.fft.rfft(seg, axis=1) * kernel, nfft,
+                                 axis=1)[:, :step]
+        # 每个窗口的和与平方和，用段内前缀和求得
+        c1 = np.pad(seg.cumsum(axis=1), ((0, 0), (1, 0)))
+        c2 = np.pad((seg * seg).cumsum(axis=1), ((0, 0), (1, 0)))
+        s1 = c1[:, m:m + step] - c1[:, :step]
+        s2 = c2[:, m:m + step] - c2[:, :step]
+        variance = np.maximum(s2 - s1 * s1 / m, 0.0)
+        denominator = np.sqrt(variance) * cue_norm
+        with np.errstate(divide="ignore", invalid="ignore"):
+            scores = np.where(denominator > 1e-6, numerator / denominator, 0.0)
+        out[g * step:(g + len(seg)) * step] = scores.ravel()
+    return out[:n_out]
+
+
+def find_cue_times(scores, sample_rate, threshold=0.5, min_gap=1.0):
+    """
+    在互相关结果中找出 >= threshold 的峰，返回 [(秒, 匹配值)]。
+    相距不足 min_gap 秒的高分点视为同一次音效，只保留其中最高者。
+    """
+    above = np.flatnonzero(scores >= threshold)
+    if above.size == 0:
+        return []
+    gap = int(min_gap * sample_rate)
+    breaks = np.flatnonzero(np.diff(above) > gap) + 1
+    peaks = []
+    for group in np.split(above, breaks):
+        best = group[np.argmax(scores[group])]
+        peaks.append((float(best / sample_rate), float(scores[best])))
+    return peaks
+
+
+def candidate_windows(cue_times, before=2.0, after=6.0, duration=None):
+    """
+    每个音效时间点 t 对应窗口 [t - before, t + after](秒)，重叠的窗口合并，
+    并限制在 [0, duration] 内。返回 [(start_sec, end_sec)]。
+    """
+    windows = []
+    for t, _ in sorted(cue_times):
+        start = max(0.0, t - before)
+        end = t + after if duration is None else min(duration, t + after)
+        if windows and start <= windows[-1][1]:
+            windows[-1] = (windows[-1][0], max(windows[-1][1], end))
+        else:
+            windows.append((start, end))
+    return windows
+
+
+def audio_candidate_windows(video_path,
+                            cue_path,
+                            threshold=0.5,
+                            before=2.0,
+                            after=6.0,
+                            sample_rate=AUDIO_SAMPLE_RATE):
+    """
+    返回 video_path 中可能出现恐惧震慑的时间窗口 [(start_sec, end_sec)]；
+    录像没有音轨时返回 None，调用方应退回完整扫描。
+    """
+    cue = decode_audio_mono(cue_path, sample_rate)
+    if cue is None:
+        raise ValueError(f"无法读取参考音效: {cue_path}")
+    audio = decode_audio_mono(video_path, sample_rate)
+    if audio is None:
+        return None
+
+    scores = normalized_xcorr(audio, cue)
+    cue_times = find_cue_times(scores, sample_rate, threshold=threshold,
+                               min_gap=len(cue) / sample_rate)
+    duration = len(audio) / sample_rate
+    windows = candidate_windows(cue_times, before=before, after=after,
+                                duration=duration)
+    covered = sum(e - s for s, e in windows)
+    print(f"[INFO] 音频预筛: {len(cue_times)} 个音效命中, {len(windows)} 个窗口, "
+          f"覆盖 {covered:.1f}s / {duration:.1f}s ({covered / max(duration, 1e-9):.1%})")
+    for t, val in cue_times:
+        print(f"[AUDIO] t={t:.2f}s, val={val:.3f}")
+    return windows
+
+
+def prefilter_and_extract_clips(video_path,
+                                template_path,
+                                output_dir,
+                                cue_path,
+                                audio_threshold=0.5,
+                                before=2.0,
+                                after=6.0,
+                                **kwargs):
+    """
+    先做音频预筛，再只在候选窗口内调用 find_template_and_extract_clips；
+    kwargs 中的 start/end 仍然生效，只扫描窗口落在该范围内的部分。
+    录像没有音轨时对整个视频(或 start/end 范围)做完整扫描。
+    其余参数原样传给 find_template_and_extract_clips。
+    """
+    from creat_video_cut import find_template_and_extract_clips
+    windows = audio_candidate_windows(video_path,
+                                      cue_path,
+                                      threshold=audio_threshold,
+                                      before=before,
+                                      after=after)
+    if windows is None:
+        print(f"⚠️ {video_path} 没有音轨，退回完整视频扫描")
+    return find_template_and_extract_clips(video_path,
+                                           template_path,
+                                           output_dir,
+                                           windows=windows,
+                                           **kwargs)
@@ -0,0 +1,416 @@
+# autotune.py
+"""
+自动调参：在少量带标注的录像(恐惧震慑出现的时间点)上搜索 stride / ROI / downscale / 匹配模式，
+测量每种组合的吞吐量与召回率，选出满足召回目标(如 >= 99%)的最快配置，
+按分辨率写成可直接用 --config 加载的 DetectorConfig 文件(profiles/1920x1080.json)。
+
+标注文件(JSON)：
+    {"videos": [{"path": "clips/clip_001.mp4", "events": ["0:05", 612, 31.5]},
+                {"path": "...", "events": [...], "scale_factor": 0.42738}]}
+events 的写法同 lib.parse_position：int 为帧号，float 为秒数，字符串可为时间戳。
+path 为相对路径时相对于标注文件所在目录；scale_factor 省略时按分辨率查询 scale_factors.json。
+
+做法：
+1. 在事件窗口内逐帧做一次整帧匹配，由各事件的最佳位置得到候选 ROI(外扩 roi_margin 像素)
+2. 每个视频只解码一遍，对每个采样帧用全部 (ROI, downscale, 模式) 组合各匹配一次，记录匹配值与耗时；
+   匹配值只取决于帧本身，stride 为 s 时的结果就是 frame_idx % s == 0 的那部分
+3. 对每个 (组合, stride)：按事件窗口内的最高匹配值选阈值，统计误报；召回率按事件交叉验证
+   (每份事件用其余事件选出的阈值判断)，不用选阈值的同一批事件报告召回；
+   吞吐量 = 1 / (该 stride 下每帧的解码耗时 + 单次匹配耗时 / stride)，两项都是实测值，
+   解码耗时在每个视频中段实测后按帧数加权
+"""
+import os
+import sys
+import json
+import math
+import time
+from collections import namedtuple
+from itertools import product
+import cv2
+import numpy as np
+from config import DetectorConfig, MATCH_MODES
+from lib import iter_video_frames, lookup_scale_factor, parse_position
+from matcher import TemplateMatcher, clip_roi, load_template, scale_template
+
+DEFAULT_STRIDES = (1, 2, 3, 5, 8, 10, 13, 15, 20, 30)
+DEFAULT_DOWNSCALES = (1.0, 0.75, 0.5)
+PROFILE_DIR = "./profiles"
+
+# 一种匹配方式；roi 为 None 表示整帧
+Candidate = namedtuple("Candidate", ["roi", "downscale", "match_mode"])
+# 一个 (Candidate, stride) 的评估结果；fps 为每秒推进的视频帧数
+TuneResult = namedtuple(
+    "TuneResult",
+    ["candidate", "stride", "threshold", "recall", "false_positives", "fps"])
+
+
+def load_labels(path):
+    """ 读取标注文件，返回 [{"path", "events", "scale_factor"}]，path 已转为绝对路径 """
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    base = os.path.dirname(os.path.abspath(path))
+    videos = []
+    for item in data.get("videos", []):
+        video_path = item["path"]
+        if not os.path.isabs(video_path):
+            video_path = os.path.join(base, video_path)
+        if not item.get("events"):
+            raise ValueError(f"{video_path} 没有标注事件")
+        videos.append({
+            "path": video_path,
+            "events": list(item["events"]),
+            "scale_factor": item.get("scale_factor"),
+        })
+    if not videos:
+        raise ValueError(f"标注文件中没有视频: {path}")
+    return videos
+
+
+def _open(path):
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise IOError(f"无法打开视频: {path}")
+    return cap
+
+
+def group_by_resolution(videos):
+    """ 按分辨率分组，并补上每个视频的 fps / 总帧数 / 事件帧号，返回 {(w, h): [video]} """
+    groups = {}
+    for video in videos:
+        cap = _open(video["path"])
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30
+        size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        cap.release()
+        video = dict(video,
+                     fps=fps,
+                     frame_count=frame_count,
+                     event_frames=sorted(
+                         parse_position(e, fps) for e in video["events"]))
+        groups.setdefault(size, []).append(video)
+    return groups
+
+
+def event_windows(video, before, after):
+    """ 每个事件的帧号窗口 [e - before 秒, e + after 秒] """
+    fps = video["fps"]
+    return [(max(1, e - int(before * fps)), e + int(after * fps))
+            for e in video["event_frames"]]
+
+
+def find_roi(videos, matcher, frame_size, before, after, margin, min_score=0.5):
+    """
+    在各事件窗口内逐帧整帧匹配，取每个事件的最佳位置；
+    返回包住所有位置(外扩 margin 像素)的 ROI，没有足够可信的位置时返回 None
+    """
+    locs = []
+    for video in videos:
+        cap = _open(video["path"])
+        for start, end in event_windows(video, before, after):
+            best = (min_score, None)
+            for _, frame in iter_video_frames(cap, start, end):
+                max_val, loc = matcher.match(frame)
+                if max_val > best[0]:
+                    best = (max_val, loc)
+            if best[1] is not None:
+                locs.append(best[1])
+        cap.release()
+    if not locs:
+        return None
+    xs = [x for x, _ in locs]
+    ys = [y for _, y in locs]
+    x0, y0 = max(0, min(xs) - margin), max(0, min(ys) - margin)
+    x1 = max(xs) + matcher.t_w + margin
+    y1 = max(ys) + matcher.t_h + margin
+    return clip_roi((x0, y0, x1 - x0, y1 - y0), *frame_size)
+
+
+def measure_decode(videos, strides, sample_frames=300):
+    """
+    各 stride 下每推进一帧视频的解码耗时(秒)：在每个视频中段的 sample_frames 帧上实测
+    (跳转耗时不计入)，按各视频的帧数加权平均
+    """
+    costs = dict.fromkeys(strides, 0.0)
+    total = 0
+    for video in videos:
+        weight = max(video["frame_count"], 1)
+        first = max(1, video["frame_count"] // 2 - sample_frames // 2)
+        for stride in strides:
+            cap = _open(video["path"])
+            t0 = first_idx = last = None
+            for frame_idx, _ in iter_video_frames(cap, first,
+                                                  first + sample_frames - 1, stride):
+                if t0 is None:
+                    t0, first_idx = time.perf_counter(), frame_idx
+                last = frame_idx
+            elapsed = 0.0 if t0 is None else time.perf_counter() - t0
+            cap.release()
+            if last is not None and last > first_idx:
+                costs[stride] += elapsed / (last - first_idx) * weight
+        total += weight
+    return {stride: cost / max(total, 1) for stride, cost in costs.items()}
+
+
+def score_video(video, matchers, strides):
+    """
+    解码一遍 video，对 frame_idx 为任一 stride 倍数的帧用每个 matcher 各匹配一次。
+    返回 (scores, seconds, samples)：scores[candidate] 为按帧号索引的匹配值数组(未采样为 nan)，
+    seconds[candidate] 为累计匹配耗时
+    """
+    n = max(video["frame_count"], max(video["event_frames"])) + 1
+    scores = {c: np.full(n, np.nan, dtype=np.float32) for c in matchers}
+    seconds = dict.fromkeys(matchers, 0.0)
+    samples = 0
+    cap = _open(video["path"])
+    for frame_idx, frame in iter_video_frames(cap, stride=math.gcd(*strides)):
+        if not any(frame_idx % s == 0 for s in strides):
+            continue
+        if frame_idx >= n:
+            break
+        samples += 1
+        for candidate, matcher in matchers.items():
+            image = frame
+            if candidate.roi is not None:
+                x, y, w, h = candidate.roi
+                image = frame[y:y + h, x:x + w]
+            t0 = time.perf_counter()
+            max_val, _ = matcher.match(image)
+            seconds[candidate] += time.perf_counter() - t0
+            scores[candidate][frame_idx] = max_val
+        if samples % 500 == 0:
+            print(f"[INFO] {os.path.basename(video['path'])}: 第 {frame_idx} 帧")
+            sys.stdout.flush()
+    cap.release()
+    return scores, seconds, samples
+
+
+def _count_clusters(frames, gap):
+    """ 相距不超过 gap 帧的命中算同一次 """
+    if len(frames) == 0:
+        return 0
+    return int(np.count_nonzero(np.diff(frames) > gap)) + 1
+
+
+def pick_threshold(event_best, noise_max, target_recall, margin=0.05,
+                   min_threshold=0.5):
+    """
+    由各事件窗口内的最高匹配值选阈值：取满足召回目标所需的最弱事件的匹配值，再往下留 margin 的余量
+    (但不低于它与非事件帧最高值 noise_max 的中点)。最弱事件低于 min_threshold 时返回 None。
+    """
+    if not event_best:
+        return None
+    required = math.ceil(target_recall * len(event_best) - 1e-9)
+    weakest = sorted(event_best, reverse=True)[max(0, required - 1)]
+    if required == 0:
+        weakest = max(event_best)
+    if weakest < min_threshold:
+        return None
+    threshold = weakest - margin
+    if noise_max < weakest:
+        threshold = max(threshold, (weakest + noise_max) / 2)
+    return float(np.floor(threshold * 1000) / 1000)
+
+
+def evaluate(videos, scores, stride, target_recall, before, after, ignore,
+             margin=0.05, min_threshold=0.5, folds=5):
+    """
+    评估一个 (组合, stride)：videos 与 scores(每个视频的匹配值数组)一一对应。
+    阈值用全部事件按 pick_threshold 选出，作为写入配置的阈值；
+    召回率则按事件分成 folds 份交叉验证：每份事件用其余事件选出的阈值判断是否检出，
+    避免用选阈值的同一批事件报告召回(那样总是偏乐观)。事件少于 2 个时无法留出，只能报告拟合召回。
+    返回 (threshold, recall, false_positives)，无法达到召回目标时 threshold 为 None。
+    事件窗口内的最高值低于 min_threshold 时视为漏检：stride 太大时窗口内可能根本没有采到图标，
+    此时的最高值只是背景上的匹配。
+    """
+    event_best = []
+    noise = []
+    for video, frame_scores in zip(videos, scores):
+        n = len(frame_scores)
+        sampled = np.zeros(n, dtype=bool)
+        sampled[stride::stride] = True
+        sampled &= ~np.isnan(frame_scores)
+        near_event = np.zeros(n, dtype=bool)
+        fps = video["fps"]
+        for start, end in event_windows(video, before, after):
+            window = frame_scores[start:end + 1][sampled[start:end + 1]]
+            event_best.append(float(window.max()) if window.size else -1.0)
+            near_event[max(0, start - int(ignore * fps)):end + int(ignore * fps) + 1] = True
+        noise.append((video, np.flatnonzero(sampled & ~near_event), frame_scores))
+
+    noise_max = max((float(s[idx].max()) for _, idx, s in noise if idx.size),
+                    default=-1.0)
+    threshold = pick_threshold(event_best, noise_max, target_recall, margin,
+                               min_threshold)
+
+    folds = min(folds, len(event_best))
+    if folds < 2:
+        detected = [threshold is not None and v >= threshold for v in event_best]
+    else:
+        detected = []
+        for k in range(folds):
+            train = [v for i, v in enumerate(event_best) if i % folds != k]
+            held_out = [v for i, v in enumerate(event_best) if i % folds == k]
+            fold_threshold = pick_threshold(train, noise_max, target_recall,
+                                            margin, min_threshold)
+            detected += [fold_threshold is not None and v >= fold_threshold
+                         for v in held_out]
+    recall = sum(detected) / len(event_best)
+    if threshold is None:
+        return None, recall, None
+
+    false_positives = 0
+    for video, idx, frame_scores in noise:
+        hits = idx[frame_scores[idx] >= threshold]
+        false_positives += _count_clusters(hits, gap=int(2 * video["fps"]))
+    return threshold, recall, false_positives
+
+
+def tune_resolution(videos,
+                    frame_size,
+                    template_bgr,
+                    scale_factor,
+                    strides=DEFAULT_STRIDES,
+                    downscales=DEFAULT_DOWNSCALES,
+                    modes=MATCH_MODES,
+                    target_recall=0.99,
+                    max_false_positives=0,
+                    before=0.5,
+                    after=3.0,
+                    ignore=5.0,
+                    roi_margin=32):
+    """ 对同一分辨率的一组标注视频调参，返回按吞吐量从高到低排列的全部 TuneResult """
+    reference = TemplateMatcher(scale_template(template_bgr, scale_factor))
+    roi = find_roi(videos, reference, frame_size, before, after, roi_margin)
+    rois = [None] if roi is None else [None, roi]
+    print(f"[INFO] 候选 ROI: {roi}")
+
+    matchers = {}
+    for r, downscale, mode in product(rois, downscales, modes):
+        matchers[Candidate(r, downscale, mode)] = TemplateMatcher(
+            scale_template(template_bgr, scale_factor * downscale),
+            mode=mode,
+            downscale=downscale)
+
+    decode = measure_decode(videos, strides)
+    all_scores = {c: [] for c in matchers}
+    match_seconds = dict.fromkeys(matchers, 0.0)
+    total_samples = 0
+    for video in videos:
+        scores, seconds, samples = score_video(video, matchers, strides)
+        for c in matchers:
+            all_scores[c].append(scores[c])
+            match_seconds[c] += seconds[c]
+        total_samples += samples
+
+    results = []
+    for candidate, stride in product(matchers, strides):
+        threshold, recall, false_positives = evaluate(
+            videos, all_scores[candidate], stride, target_recall, before,
+            after, ignore)
+        per_match = match_seconds[candidate] / max(total_samples, 1)
+        fps = 1.0 / (decode[stride] + per_match / stride)
+        results.append(
+            TuneResult(candidate, stride, threshold, recall, false_positives, fps))
+    results.sort(key=lambda r: -r.fps)
+    return results
+
+
+def meets_target(result, target_recall, max_false_positives):
+    return (result.threshold is not None
+            and result.recall >= target_recall - 1e-9
+            and result.false_positives <= max_false_positives)
+
+
+def write_profile(profile_dir, frame_size, config, report):
+    """ 写出 <w>x<h>.json(DetectorConfig，可用 --config 加载)与 <w>x<h>.report.json，返回前者路径 """
+    os.makedirs(profile_dir, exist_ok=True)
+    name = f"{frame_size[0]}x{frame_size[1]}"
+    path = os.path.join(profile_dir, name + ".json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(config.to_dict(), f, indent=4, ensure_ascii=False)
+    with open(os.path.join(profile_dir, name + ".report.json"), "w",
+              encoding="utf-8") as f:
+        json.dump(report, f, indent=4, ensure_ascii=False)
+    return path
+
+
+def autotune(labels_path,
+             template_path="./terror_shock.png",
+             profile_dir=PROFILE_DIR,
+             target_recall=0.99,
+             max_false_positives=0,
+             strides=DEFAULT_STRIDES,
+             downscales=DEFAULT_DOWNSCALES,
+             modes=MATCH_MODES,
+             batch_size=16):
+    """
+    对标注文件中的每种分辨率调参，把满足目标的最快配置写到 profile_dir。
+    返回 {(w, h): DetectorConfig 或 None(没有满足目标的配置)}
+    """
+    template_bgr = load_template(template_path)
+    if template_bgr is None:
+        raise ValueError(f"无法读取模板图像: {template_path}")
+    chosen = {}
+    for frame_size, videos in group_by_resolution(load_labels(labels_path)).items():
+        w, h = frame_size
+        n_events = sum(len(v["event_frames"]) for v in videos)
+        print(f"\n=== {w}x{h}: {len(videos)} 个视频, {n_events} 个事件 ===")
+        scale_factor = videos[0]["scale_factor"]
+        if scale_factor is None:
+            scale_factor, _ = lookup_scale_factor(w, h)
+        if scale_factor is None:
+            print(f"⚠️ 没有 {w}x{h} 的 scale_factor，跳过(可在标注文件中给出)")
+            chosen[frame_size] = None
+            continue
+
+        results = tune_resolution(videos, frame_size, template_bgr, scale_factor,
+                                  strides=strides,
+                                  downscales=downscales,
+                                  modes=modes,
+                                  target_recall=target_recall,
+                                  max_false_positives=max_false_positives)
+        passing = [r for r in results
+                   if meets_target(r, target_recall, max_false_positives)]
+        for r in results[:10] + [r for r in passing[:3] if r not in results[:10]]:
+            mark = "✅" if r in passing else "  "
+            print(f"{mark} stride={r.stride:>3} roi={r.candidate.roi} "
+                  f"downscale={r.candidate.downscale} mode={r.candidate.match_mode} "
+                  f"threshold={r.threshold} recall={r.recall:.3f} "
+                  f"fp={r.false_positives} {r.fps:.0f} 帧/s")
+        if not passing:
+            print(f"❌ {w}x{h} 没有配置达到召回 {target_recall:.1%}")
+            chosen[frame_size] = None
+            continue
+
+        best = passing[0]
+        config = DetectorConfig(template_path=template_path,
+                                threshold=best.threshold,
+                                stride=best.stride,
+                                match_mode=best.candidate.match_mode,
+                                roi=best.candidate.roi,
+                                batch_size=batch_size,
+                                scale_factor=scale_factor,
+                                downscale=best.candidate.downscale).validate()
+        report = {
+            "labels": os.path.abspath(labels_path),
+            "target_recall": target_recall,
+            "max_false_positives": max_false_positives,
+            "events": n_events,
+            "results": [{
+                "stride": r.stride,
+                "roi": r.candidate.roi,
+                "downscale": r.candidate.downscale,
+                "match_mode": r.candidate.match_mode,
+                "threshold": r.threshold,
+                "recall": r.recall,
+                "false_positives": r.false_positives,
+                "fps": round(r.fps, 1),
+            } for r in results],
+        }
+        path = write_profile(profile_dir, frame_size, config, report)
+        print(f"✅ {w}x{h}: stride={best.stride}, roi={best.candidate.roi}, "
+              f"downscale={best.candidate.downscale}, mode={best.candidate.match_mode}, "
+              f"threshold={best.threshold}, 约 {best.fps:.0f} 帧/s -> {path}")
+        chosen[frame_size] = config
+    return chosen
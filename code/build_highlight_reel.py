@@ -0,0 +1,296 @@
+# build_highlight_reel.py
+import os
+import sys
+import glob
+import json
+import shutil
+import tempfile
+import subprocess
+from collections import Counter
+from datetime import datetime
+from creat_video_cut import CLIP_MANIFEST
+from governor import get_governor
+
+# 与参考片段不兼容时重新编码所用的编码器
+VIDEO_ENCODERS = {"h264": "libx264", "hevc": "libx265"}
+AUDIO_ENCODERS = {"aac": "aac", "mp3": "libmp3lame", "opus": "libopus"}
+# 把 MP4 中的码流转为 Annex B(参数集写在关键帧之前)的 bitstream filter
+ANNEXB_FILTERS = {"h264": "h264_mp4toannexb", "hevc": "hevc_mp4toannexb"}
+
+
+def recording_time(manifest, clip_dir):
+    """
+    推断录屏开始时间：优先解析文件名中的时间戳(如 20250322-134043.mp4)，
+    其次使用清单中的 recorded_at，最后退回片段目录的修改时间。
+    """
+    video = manifest.get("video") if manifest else None
+    if video:
+        name = os.path.splitext(os.path.basename(video))[0]
+        try:
+            return datetime.strptime(name[:15], "%Y%m%d-%H%M%S")
+        except ValueError:
+            pass
+    if manifest and manifest.get("recorded_at"):
+        return datetime.fromisoformat(manifest["recorded_at"])
+    return datetime.fromtimestamp(os.path.getmtime(clip_dir))
+
+
+def collect_clips(output_dirs, order="time", min_score=None, day=None):
+    """
+    从一个或多个输出目录(find_template_and_extract_clips 的 output_dir)收集片段，
+    即 <output>/<video>_scale<sf>/clip_NNN.mp4。
+    order: "time" 按录屏时间 + 片段起点排序；"score" 按匹配值从高到低排序。
+    min_score: 仅保留匹配值不低于该值的片段；day: 仅保留某天("2025-03-22")的录屏。
+    返回 [{"path", "time", "score", "video"}]。
+    """
+    if isinstance(output_dirs, str):
+        output_dirs = [output_dirs]
+
+    clips = []
+    for output_dir in output_dirs:
+        for clip_dir in sorted(glob.glob(os.path.join(output_dir, "*_scale*"))):
+            if not os.path.isdir(clip_dir):
+                continue
+            manifest_path = os.path.join(clip_dir, CLIP_MANIFEST)
+            manifest = None
+            if os.path.exists(manifest_path):
+                with open(manifest_path, "r", encoding="utf-8") as f:
+                    manifest = json.load(f)
+            rec_time = recording_time(manifest, clip_dir)
+            if day and rec_time.strftime("%Y-%m-%d") != day:
+                continue
+
+            if manifest:
+                entries = manifest["clips"]
+            else:
+                # 旧目录没有清单：按文件名顺序，无匹配值
+                entries = [{
+                    "file": os.path.basename(p),
+                    "start_sec": 0.0,
+                    "score": None
+                } for p in sorted(
+                    glob.glob(os.path.join(clip_dir, "clip_*.mp4")))]
+
+            for entry in entries:
+                path = os.path.join(clip_dir, entry["file"])
+                if not os.path.exists(path):
+                    continue
+                score = entry.get("score")
+                if min_score is not None and (score is None
+                                              or score < min_score):
+                    continue
+                clips.append({
+                    "path": path,
+                    "time": rec_time.timestamp() + entry.get("start_sec", 0.0),
+                    "score": score,
+                    "video": manifest["video"] if manifest else clip_dir
+                })
+
+    if order == "score":
+        clips.sort(key=lambda c: (-(c["score"] or 0.0), c["time"]))
+    else:
+        clips.sort(key=lambda c: c["time"])
+    return clips
+
+
+def probe_stream_signature(path):
+    """
+    用 ffprobe 读取片段的编码参数，返回 (video, audio) 两个元组。
+    视频部分包含 profile/level 与 extradata(H.264/HEVC 的 SPS/PPS 等参数集)的哈希：
+    只有这些也完全一致时，concat demuxer 流复制拼接出的码流在接缝处才能正常解码。
+    """
+    cmd = [
+        "ffprobe", "-v", "error", "-show_data_hash", "SHA256", "-show_entries",
+        "stream=codec_type,codec_name,profile,level,width,height,pix_fmt,"
+        "r_frame_rate,time_base,sample_rate,channels,extradata_hash", "-of",
+        "json", path
+    ]
+    out = subprocess.run(cmd, capture_output=True, text=True, check=True)
+    streams = json.loads(out.stdout).get("streams", [])
+    video, audio = None, None
+    for s in streams:
+        if s.get("codec_type") == "video" and video is None:
+            video = (s.get("codec_name"), s.get("profile"), s.get("level"),
+                     s.get("width"), s.get("height"), s.get("pix_fmt"),
+                     s.get("r_frame_rate"), s.get("time_base"),
+                     s.get("extradata_hash"))
+        elif s.get("codec_type") == "audio" and audio is None:
+            audio = (s.get("codec_name"), s.get("sample_rate"),
+                     s.get("channels"), s.get("extradata_hash"))
+    return video, audio
+
+
+def _compatible(sig, reference):
+    """ 除参数集(extradata)外编码参数一致；参数集不同的片段经 Annex B 重封装后即可流复制 """
+    if sig is None or reference is None:
+        return sig == reference
+    return sig[:-1] == reference[:-1]
+
+
+def plan_segments(signatures):
+    """
+    以出现最多的签名为参考，给出每段的处理方式：
+    None 为流复制；"audio" 为视频流复制、只重新编码音频；"video" 为音视频都按参考重新编码。
+    返回 (参考签名, 处理方式列表)。
+    """
+    reference = Counter(signatures).most_common(1)[0][0]
+    actions = []
+    for video, audio in signatures:
+        if not _compatible(video, reference[0]):
+            actions.append("video")
+        elif not _compatible(audio, reference[1]):
+            actions.append("audio")
+        else:
+            actions.append(None)
+    return reference, actions
+
+
+def _profile_args(v_codec, profile, level):
+    """ 参考片段的 profile/level 对应的编码器参数(ffprobe 的 level 为 31 这样的整数) """
+    args = []
+    if profile:
+        args += ["-profile:v",
+                 profile.lower().replace("constrained ", "").replace(" ", "")]
+    if v_codec == "h264" and level and level > 0:
+        args += ["-level", f"{level // 10}.{level % 10}"]
+    return args
+
+
+def reencode_to_signature(src, dst, signature, src_has_audio=True,
+                          copy_video=False):
+    """
+    将片段按参考签名的编码器、profile/level、分辨率、像素格式与帧率重新编码为 MPEG-TS(dst)。
+    TS 中参数集随每个关键帧重复，与其他片段拼接时解码器在接缝处改用本段的参数集。
+    copy_video=True 时视频流复制，只重新编码音频(或补/去音轨)。
+    参考有音轨而片段没有时补一条静音音轨，保证各段流结构一致。
+    """
+    video, audio = signature
+    v_codec, profile, level, width, height, pix_fmt, frame_rate, _, _ = video
+    cmd = ["ffmpeg", "-y", "-i", src]
+    if audio is not None and not src_has_audio:
+        _, sample_rate, channels, _ = audio
+        cmd += [
+            "-f", "lavfi", "-i",
+            f"anullsrc=r={sample_rate}:cl={'mono' if channels == 1 else 'stereo'}",
+            "-map", "0:v:0", "-map", "1:a:0", "-shortest"
+        ]
+    if copy_video:
+        cmd += ["-c:v", "copy"]
+        if v_codec in ANNEXB_FILTERS:
+            cmd += ["-bsf:v", ANNEXB_FILTERS[v_codec]]
+    else:
+        vf = (f"scale={width}:{height}:force_original_aspect_ratio=decrease,"
+              f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,fps={frame_rate}")
+        cmd += [
+            "-vf", vf, "-c:v",
+            VIDEO_ENCODERS.get(v_codec, v_codec), "-pix_fmt", pix_fmt
+        ] + _profile_args(v_codec, profile, level)
+    if audio is not None:
+        a_codec, sample_rate, channels, _ = audio
+        cmd += [
+            "-c:a",
+            AUDIO_ENCODERS.get(a_codec, a_codec), "-ar",
+            str(sample_rate), "-ac",
+            str(channels)
+        ]
+    else:
+        cmd += ["-an"]
+    # 重新编码是唯一真正吃 CPU 的步骤，线程数与优先级由 governor 统一控制
+    cmd += get_governor().ffmpeg_args()
+    cmd += ["-f", "mpegts", dst]
+    print("[FFmpeg]", " ".join(cmd))
+    get_governor().run_ffmpeg(cmd, check=True)
+
+
+def remux_annexb(src, dst, v_codec):
+    """ 流复制重封装为 MPEG-TS：参数集写入每个关键帧之前(Annex B)，不解码不编码 """
+    cmd = ["ffmpeg", "-y", "-i", src, "-map", "0", "-c", "copy"]
+    if v_codec in ANNEXB_FILTERS:
+        cmd += ["-bsf:v", ANNEXB_FILTERS[v_codec]]
+    cmd += ["-f", "mpegts", dst]
+    print("[FFmpeg]", " ".join(cmd))
+    subprocess.run(cmd,
+                   stdout=subprocess.DEVNULL,
+                   stderr=subprocess.DEVNULL,
+                   check=True)
+
+
+def concat_copy(paths, out_file, workdir, extra_args=()):
+    """ 用 concat demuxer + 流复制拼接，不解码不编码，耗时取决于磁盘 I/O """
+    list_file = os.path.join(workdir, "concat.txt")
+    with open(list_file, "w", encoding="utf-8") as f:
+        for path in paths:
+            escaped = os.path.abspath(path).replace("\\", "/").replace(
+                "'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+    cmd = [
+        "ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", list_file, "-c",
+        "copy"
+    ] + list(extra_args) + ["-movflags", "+faststart", out_file]
+    print("[FFmpeg]", " ".join(cmd))
+    subprocess.run(cmd,
+                   stdout=subprocess.DEVNULL,
+                   stderr=subprocess.DEVNULL,
+                   check=True)
+
+
+def build_highlight_reel(clips, out_file):
+    """
+    将 collect_clips 得到的片段按顺序拼接为一个合集 out_file。
+    全部片段签名(含 profile/level/参数集)一致时直接流复制拼接；
+    否则以出现最多的签名为参考，只把编码参数与参考不一致的片段按参考重新编码(见 plan_segments)，
+    其余片段仍流复制。混合拼接时各段先转为 MPEG-TS(参数集随关键帧重复)再拼接，
+    接缝处解码器使用本段自己的参数集，流复制段与重新编码段(参数集不同)可以放在一起。
+    返回 (片段数, 重新编码的片段数)。
+    """
+    if not clips:
+        print("⚠️ 没有可拼接的片段")
+        return 0, 0
+
+    paths = [c["path"] for c in clips]
+    signatures = [probe_stream_signature(p) for p in paths]
+    reference, actions = plan_segments(signatures)
+    if reference[0] is None:
+        print("❌ 参考片段没有视频流，无法拼接")
+        return 0, 0
+
+    out_dir = os.path.dirname(os.path.abspath(out_file))
+    os.makedirs(out_dir, exist_ok=True)
+    workdir = tempfile.mkdtemp(prefix="reel_", dir=out_dir)
+    reencoded = sum(action is not None for action in actions)
+    try:
+        if all(sig == reference for sig in signatures):
+            concat_copy(paths, out_file, workdir)
+        else:
+            print(f"[INFO] 编码参数不一致，重新编码 {reencoded}/{len(paths)} 段，其余流复制")
+            v_codec = reference[0][0]
+            segments = []
+            for idx, (path, sig, action) in enumerate(
+                    zip(paths, signatures, actions)):
+                segment = os.path.join(workdir, f"segment_{idx:04d}.ts")
+                if action is None:
+                    remux_annexb(path, segment, v_codec)
+                else:
+                    reencode_to_signature(path,
+                                          segment,
+                                          reference,
+                                          src_has_audio=sig[1] is not None,
+                                          copy_video=action == "audio")
+                segments.append(segment)
+            extra_args = []
+            if reference[1] is not None and reference[1][0] == "aac":
+                extra_args += ["-bsf:a", "aac_adtstoasc"]
+            time_base = reference[0][7]
+            if time_base and "/" in time_base:
+                extra_args += ["-video_track_timescale", time_base.split("/")[1]]
+            concat_copy(segments, out_file, workdir, extra_args)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"✅ 合集已保存: {out_file} (共 {len(paths)} 段，重新编码 {reencoded} 段)")
+    return len(paths), reencoded
+
+
+if __name__ == "__main__":
+    from cli import main
+    sys.exit(main(["reel"] + sys.argv[1:]))
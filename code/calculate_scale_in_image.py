@@ -3,27 +3,29 @@ import cv2
 import os
 import numpy as np
 import sys
-import json
-from datetime import datetime
-from lib import (load_scale_factors, save_scale_factors, get_scale_factor,
-                 create_red_mask, add_scale_factors, end)
+from concurrent.futures import ProcessPoolExecutor
+from lib import (get_scale_factor, add_scale_factors, get_scale_store,
+                 lookup_scale_factor, refine_scale_factor)
+from matcher import TemplateMatcher, load_template
+from feature_scale import calibrate_by_features, verify_scale
+from governor import get_governor
 
-# 日志文件写入
-current_time = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-log_filename = f"./log/output_{current_time}.log"
-os.makedirs("./log", exist_ok=True)
-f = open(log_filename, "w", encoding="utf-8")
-print("日志文件:", log_filename)
-sys.stdout = f
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
 
 
 def process_image_find_scale(frame_path,
                              template_path,
                              output_dir,
-                             threshold=0.7):
+                             threshold=0.7,
+                             match_mode="masked_gray",
+                             method="features"):
     """
     在一张图片 frame_path 上，通过多种 scale_factor 的尝试来匹配 template_path。
     目的是在已有 scale_factor 基础上微调，找到最优匹配值的 scale_factor 并保存到 JSON。
+    match_mode 指定匹配模式(见 matcher.MATCH_MODES)，可用于观察各模式在含图标帧上的匹配值，
+    以标定该模式的阈值。scale_factor 与模式无关，各模式标定结果写入同一条记录(来源中注明模式)。
+    method="features" 时先用特征点直接估计比例并验证一次(见 feature_scale)，
+    验证通过即保存，不需要已有记录；未通过再退回 method="sweep" 的网格搜索。
     """
     frame_name = os.path.splitext(os.path.basename(frame_path))[0]
     output_path = os.path.join(output_dir, frame_name)
@@ -52,8 +54,39 @@ def process_image_find_scale(frame_path,
     video_width = frame.shape[1]
     video_height = frame.shape[0]
 
-    # 尝试从 JSON 中获取已有 scale_factor，若没有则让用户输入
-    tmp_scale = get_scale_factor(video_width, video_height)
+    key = f"{video_width}x{video_height}"
+    if method == "features":
+        result = calibrate_by_features(frame,
+                                       template_bgr,
+                                       threshold=threshold,
+                                       match_mode=match_mode)
+        if result is not None and result[1] >= threshold:
+            scale_factor, max_val, max_loc, _ = result
+            template_h = int(template_bgr.shape[0] * scale_factor)
+            template_w = int(template_bgr.shape[1] * scale_factor)
+            frame_copy = frame.copy()
+            cv2.rectangle(frame_copy, max_loc,
+                          (max_loc[0] + template_w, max_loc[1] + template_h),
+                          (0, 0, 255), 2)
+            save_path = os.path.join(output_path,
+                                     f"features_{scale_factor:.5f}.jpg")
+            cv2.imwrite(save_path, frame_copy)
+            print(f"[MATCH] mode={match_mode}, scale_factor={scale_factor:.5f}, "
+                  f"val={max_val:.5f}, {save_path}")
+            add_scale_factors(key,
+                              scale_factor,
+                              score=max_val,
+                              source=f"features:{frame_path}:{match_mode}")
+            print(f"已更新 scale_factor={scale_factor:.5f} 到 JSON文件。")
+            return scale_factor, max_val
+        print("⚠️ 特征估计失败或未通过验证，退回网格搜索")
+
+    # 尝试从 JSON 中获取已有 scale_factor；若没有则按已知分辨率预测并验证，仍无则让用户输入
+    tmp_scale = get_scale_factor(video_width,
+                                 video_height,
+                                 frame=frame,
+                                 template_bgr=template_bgr,
+                                 threshold=threshold)
     if tmp_scale is None:
         print("❌ 用户未提供有效scale_factor，无法进行微调。")
         return
@@ -64,8 +97,8 @@ def process_image_find_scale(frame_path,
     best_scale_factor = None
     best_max_val = -1.0
 
-    # 灰度化输入图
-    gray_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    # 输入图按匹配模式预处理(与 scale_factor 无关，只做一次)
+    prepared_frame = None
 
     for scale_factor in scale_list:
         # 防止无效 scale_factor
@@ -80,16 +113,12 @@ def process_image_find_scale(frame_path,
 
         template_scaled = cv2.resize(template_bgr, (new_w, new_h),
                                      interpolation=cv2.INTER_AREA)
-        gray_template = cv2.cvtColor(template_scaled, cv2.COLOR_BGR2GRAY)
-
-        mask = create_red_mask(template_scaled)
+        matcher = TemplateMatcher(template_scaled, mode=match_mode)
+        if prepared_frame is None:
+            prepared_frame = matcher.prepare(frame)
 
         # matchTemplate
-        result = cv2.matchTemplate(gray_frame,
-                                   gray_template,
-                                   cv2.TM_CCOEFF_NORMED,
-                                   mask=mask)
-        _, max_val, _, max_loc = cv2.minMaxLoc(result)
+        max_val, max_loc = matcher.match_prepared(prepared_frame)
 
         # 若匹配成功超过阈值，保存可视化结果
         if max_val >= threshold:
@@ -101,7 +130,7 @@ def process_image_find_scale(frame_path,
                                      f"scale_{scale_factor:.5f}.jpg")
             cv2.imwrite(save_path, frame_copy)
             print(
-                f"[MATCH] scale_factor={scale_factor:.5f}, val={max_val:.5f}, {save_path}"
+                f"[MATCH] mode={match_mode}, scale_factor={scale_factor:.5f}, val={max_val:.5f}, {save_path}"
             )
 
         # 更新最佳
@@ -115,18 +144,186 @@ def process_image_find_scale(frame_path,
 
     # 若找到有效匹配，则更新 JSON
     if best_max_val >= threshold:
-        key = f"{video_width}x{video_height}"
-        add_scale_factors(key, best_scale_factor)
+        add_scale_factors(key,
+                          best_scale_factor,
+                          score=best_max_val,
+                          source=f"image:{frame_path}:{match_mode}")
         print(f"已更新 scale_factor={best_scale_factor:.5f} 到 JSON文件。")
+    return best_scale_factor, best_max_val
 
 
-if __name__ == "__main__":
-    frame_path = "./matched_frames/short_scale0.42738/frame_320.jpg"
-    template_path = "./terror_shock.png"
-    output_dir = "./matched_frames"
-    threshold_value = 0.7
+def list_frames(paths):
+    """ paths 中的图片文件与目录(不递归)下的图片，按路径排序去重 """
+    frames = set()
+    for path in paths:
+        if os.path.isdir(path):
+            for name in os.listdir(path):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    frames.add(os.path.join(path, name))
+        else:
+            frames.add(path)
+    return sorted(frames)
+
+
+def _worker_init(cv_threads=1):
+    # 并行的是进程，每个进程内 OpenCV 只用分到的线程数，避免线程数成倍超额
+    cv2.setNumThreads(cv_threads)
+
+
+_worker_template = {}
+
+
+def calibrate_frame(frame_path, template_path, output_dir, threshold=0.7,
+                    match_mode="masked_gray", method="features"):
+    """
+    标定单张图片，不写 scale_factors.json、不提示输入(可在进程池中运行)。
+    先做特征估计；失败或未通过验证时，在已记录/预测的 scale_factor 附近做网格搜索。
+    返回 {"path", "width", "height", "scale", "score", "method"}，失败时 scale 为 None 并带 "error"。
+    """
+    if template_path not in _worker_template:
+        _worker_template[template_path] = load_template(template_path)
+    template_bgr = _worker_template[template_path]
+    result = {"path": frame_path, "scale": None, "score": None, "method": None}
+    if template_bgr is None:
+        result["error"] = f"无法读取模板图像: {template_path}"
+        return result
+    frame = cv2.imread(frame_path)
+    if frame is None:
+        result["error"] = "无法读取图像"
+        return result
+    result["height"], result["width"] = frame.shape[:2]
 
-    process_image_find_scale(frame_path, template_path, output_dir,
-                             threshold_value)
+    found = None
+    if method == "features":
+        estimate = calibrate_by_features(frame, template_bgr, threshold=threshold,
+                                         match_mode=match_mode)
+        if estimate is not None and estimate[1] >= threshold:
+            found = ("features", estimate[0], estimate[1], estimate[2])
+    if found is None:
+        center, _ = lookup_scale_factor(result["width"], result["height"])
+        if center is None:
+            result["error"] = "特征估计失败，且没有可作为搜索中心的 scale_factor"
+            return result
+        scale, _ = refine_scale_factor(frame, template_bgr, center, span=0.01,
+                                       steps=21)
+        max_val, max_loc = verify_scale(frame, template_bgr, scale,
+                                        match_mode=match_mode)
+        found = ("sweep", scale, max_val, max_loc)
 
-end()
+    result["method"], scale, max_val, max_loc = found
+    result["scale"], result["score"] = float(scale), float(max_val)
+    if max_val >= threshold:
+        frame_name = os.path.splitext(os.path.basename(frame_path))[0]
+        output_path = os.path.join(output_dir, frame_name)
+        os.makedirs(output_path, exist_ok=True)
+        template_w = int(template_bgr.shape[1] * scale)
+        template_h = int(template_bgr.shape[0] * scale)
+        cv2.rectangle(frame, max_loc,
+                      (max_loc[0] + template_w, max_loc[1] + template_h),
+                      (0, 0, 255), 2)
+        cv2.imwrite(
+            os.path.join(output_path, f"{result['method']}_{scale:.5f}.jpg"),
+            frame)
+    return result
+
+
+def aggregate_scales(results, threshold=0.7, k=3.0, min_spread=0.002):
+    """
+    按分辨率汇总多张图的标定结果。每组只用匹配值 >= threshold 的结果：
+    以中位数为中心、MAD 估计离散度(乘 1.4826 换算为标准差，且不小于 min_spread * 中位数)，
+    偏离超过 k 倍的视为离群值剔除；其余按匹配值加权平均。
+    返回 {"WxH": {"scale", "score", "samples", "outliers", "spread", "confidence"}}：
+    score 为加权平均匹配值，spread 为内点的离散度，
+    confidence = 内点平均匹配值 × 内点占该分辨率全部图片的比例。
+    """
+    groups = {}
+    for r in results:
+        if "width" in r:
+            groups.setdefault(f"{r['width']}x{r['height']}", []).append(r)
+
+    summary = {}
+    for key, group in sorted(groups.items()):
+        valid = [r for r in group
+                 if r["scale"] is not None and r["score"] >= threshold]
+        if not valid:
+            continue
+        scales = np.array([r["scale"] for r in valid])
+        scores = np.array([r["score"] for r in valid])
+        center = float(np.median(scales))
+        mad = float(np.median(np.abs(scales - center))) * 1.4826
+        spread = max(mad, min_spread * center)
+        inlier = np.abs(scales - center) <= k * spread
+        scale = float(np.average(scales[inlier], weights=scores[inlier]))
+        score = float(np.average(scores[inlier], weights=scores[inlier]))
+        summary[key] = {
+            "scale": scale,
+            "score": score,
+            "samples": int(inlier.sum()),
+            "outliers": int((~inlier).sum()),
+            "spread": float(np.std(scales[inlier])),
+            "confidence": float(scores[inlier].mean() * inlier.sum() / len(group)),
+        }
+    return summary
+
+
+def calibrate_frames(paths,
+                     template_path,
+                     output_dir,
+                     threshold=0.7,
+                     match_mode="masked_gray",
+                     method="features",
+                     workers=None,
+                     write=True):
+    """
+    用多张图片(文件或目录，分辨率可混合)标定：在进程池中逐张标定(见 calibrate_frame)，
+    按分辨率稳健汇总(见 aggregate_scales)，write=True 时一次原子写入 scale_factors.json。
+    返回 aggregate_scales 的结果；没有可用图片时返回 None。
+    """
+    frames = list_frames(paths)
+    if not frames:
+        print(f"❌ 没有找到图片: {paths}")
+        return None
+    # 进程数与每进程线程数按核心预算分配(标定不导出，用全部核心)
+    cores = get_governor().cores
+    workers = min(workers or cores, len(frames))
+    cv_threads = max(1, cores // workers)
+    print(f"[INFO] 标定 {len(frames)} 张图片，{workers} 个进程 x {cv_threads} 线程")
+
+    results = []
+    with ProcessPoolExecutor(max_workers=workers,
+                             initializer=_worker_init,
+                             initargs=(cv_threads, )) as pool:
+        futures = [
+            pool.submit(calibrate_frame, frame_path, template_path, output_dir,
+                        threshold, match_mode, method) for frame_path in frames
+        ]
+        for future in futures:
+            r = future.result()
+            results.append(r)
+            if r["scale"] is None:
+                print(f"⚠️ {r['path']}: {r.get('error')}")
+            else:
+                print(f"[MATCH] {r['path']}: {r['width']}x{r['height']}, "
+                      f"scale_factor={r['scale']:.5f}, val={r['score']:.5f} ({r['method']})")
+            sys.stdout.flush()
+
+    summary = aggregate_scales(results, threshold=threshold)
+    if not summary:
+        print("❌ 没有匹配值达到阈值的图片")
+        return summary
+    print("\n=== 按分辨率汇总 ===")
+    for key, s in summary.items():
+        print(f"{key}: scale_factor={s['scale']:.5f} (±{s['spread']:.5f}), "
+              f"内点 {s['samples']}，离群 {s['outliers']}，置信度 {s['confidence']:.3f}")
+    if write:
+        get_scale_store().update_many({
+            key: dict(s, source=f"images:{len(frames)}:{match_mode}")
+            for key, s in summary.items()
+        })
+        print(f"已更新 {len(summary)} 个分辨率的 scale_factor 到 JSON文件。")
+    return summary
+
+
+if __name__ == "__main__":
+    from cli import main
+    sys.exit(main(["calibrate"] + sys.argv[1:]))
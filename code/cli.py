@@ -0,0 +1,562 @@
+# cli.py
+"""
+ID5-Clips 命令行入口：
+
+    python code/cli.py detect VIDEO [选项]     # 检测并保存命中帧；--events 输出 JSON 行
+    python code/cli.py cut VIDEO [选项]        # 检测并用 FFmpeg 剪出片段
+    python code/cli.py calibrate FRAME... [选项]  # 在含图标的截图(或目录)上标定 scale_factor
+    python code/cli.py calibrate-video VIDEO [选项]  # 在视频帧上搜索 scale_factor(逐次减半)
+    python code/cli.py tune LABELS [选项]      # 在标注录像上自动选 stride/ROI/downscale/模式
+    python code/cli.py check --config CFG      # 只校验配置
+    python code/cli.py submit VIDEO... --spool DIR   # 提交到共享任务目录
+    python code/cli.py worker --spool DIR [--local N|auto]  # 认领并执行任务
+    python code/cli.py status --spool DIR      # 查看队列状态
+    python code/cli.py watch DIR [--spool DIR] # 监视目录，只处理新录像
+    python code/cli.py bench VIDEO [选项]      # 实测不同核心划分下的总扫描吞吐量
+    python code/cli.py reel DIR... [选项]      # 把剪出的片段拼接为合集
+
+cv2/NumPy 只在真正执行子命令时才导入，--help 与配置校验可以立即返回。
+"""
+import os
+import sys
+import json
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from config import DetectorConfig, MATCH_MODES, parse_roi
+
+
+def add_detector_args(parser):
+    """ 检测相关参数；未指定的项沿用 --config 文件或 DetectorConfig 默认值 """
+    parser.add_argument("--config", help="DetectorConfig 的 JSON 文件")
+    parser.add_argument("--template", dest="template_path", help="模板图像路径")
+    parser.add_argument("--threshold", type=float, help="匹配阈值")
+    parser.add_argument("--stride", type=int, help="每隔多少帧匹配一次")
+    parser.add_argument("--mode",
+                        dest="match_mode",
+                        choices=MATCH_MODES,
+                        help="匹配模式")
+    parser.add_argument("--roi", type=parse_roi, help="搜索区域 x,y,w,h")
+    parser.add_argument("--batch-size", type=int, help="ROI 批量匹配的帧数")
+    parser.add_argument("--scale",
+                        dest="scale_factor",
+                        type=float,
+                        help="指定 scale_factor，不查询 scale_factors.json")
+    parser.add_argument("--track-margin",
+                        type=int,
+                        help="跟踪模式：命中后先在上次位置周围这么多像素内搜索(如 16)")
+    parser.add_argument("--downscale",
+                        type=float,
+                        help="匹配前把帧缩小到该倍数(如 0.5)，模板同步缩小")
+
+
+def add_range_args(parser):
+    parser.add_argument("--start", help="起始位置：帧号或时间戳(如 1:59:30、7170.5s)")
+    parser.add_argument("--end", help="结束位置：帧号或时间戳")
+
+
+def add_frame_cache_arg(parser):
+    parser.add_argument("--frame-cache",
+                        metavar="DIR",
+                        help="从该目录下的解码帧缓存扫描(首次使用时建立)，反复实验同一录像时不再解码")
+
+
+def build_config(args, default_stride=None):
+    """ 合并配置文件与命令行参数并校验 """
+    data = {}
+    if getattr(args, "config", None):
+        with open(args.config, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    if default_stride is not None:
+        data.setdefault("stride", default_stride)
+    for name in ("template_path", "threshold", "stride", "match_mode", "roi",
+                 "batch_size", "scale_factor", "track_margin", "downscale"):
+        value = getattr(args, name, None)
+        if value is not None:
+            data[name] = value
+    return DetectorConfig.from_dict(data).validate()
+
+
+def cmd_check(args):
+    config = build_config(args)
+    print(json.dumps(config.to_dict(), indent=4, ensure_ascii=False))
+    return 0
+
+
+def cmd_detect(args):
+    config = build_config(args, default_stride=10)
+    if args.events:
+        # 事件流模式：直接把命中写到 stdout，便于被其他程序管道消费
+        from detector import Detector
+        detector = Detector(config)
+        video = args.video
+        if args.frame_cache:
+            from frame_cache import open_frame_cache
+            video = open_frame_cache(args.video, args.frame_cache, crop=config.roi,
+                                     start=args.start, end=args.end,
+                                     match_mode=config.match_mode)
+        for m in detector.iter_matches(video, args.start, args.end):
+            print(json.dumps(m._asdict()), flush=True)
+        return 0
+
+    from detect_template_in_video import find_template_in_video
+    find_template_in_video(args.video,
+                           config.template_path,
+                           args.output_dir,
+                           threshold=config.threshold,
+                           start=args.start,
+                           end=args.end,
+                           match_mode=config.match_mode,
+                           roi=config.roi,
+                           batch_size=config.batch_size,
+                           stride=config.stride,
+                           scale_factor=config.scale_factor,
+                           track_margin=config.track_margin,
+                           downscale=config.downscale,
+                           frame_cache=args.frame_cache)
+    return 0
+
+
+def cmd_cut(args):
+    config = build_config(args, default_stride=13)
+    if args.single_pass:
+        if args.frame_cache:
+            print("⚠️ --single-pass 需要读取原视频的压缩包，忽略 --frame-cache")
+        from stream_cut import single_pass_extract_clips
+        manifest = single_pass_extract_clips(args.video,
+                                             config.template_path,
+                                             args.output_dir,
+                                             threshold=config.threshold,
+                                             start=args.start,
+                                             end=args.end,
+                                             match_mode=config.match_mode,
+                                             roi=config.roi,
+                                             stride=config.stride,
+                                             scale_factor=config.scale_factor,
+                                             downscale=config.downscale,
+                                             batch_size=config.batch_size,
+                                             track_margin=config.track_margin)
+        return 0 if manifest is not None else 1
+
+    kwargs = dict(threshold=config.threshold,
+                  start=args.start,
+                  end=args.end,
+                  match_mode=config.match_mode,
+                  roi=config.roi,
+                  batch_size=config.batch_size,
+                  stride=config.stride,
+                  scale_factor=config.scale_factor,
+                  track_margin=config.track_margin,
+                  downscale=config.downscale,
+                  frame_cache=args.frame_cache)
+    if args.audio_cue:
+        from audio_prefilter import prefilter_and_extract_clips
+        manifest = prefilter_and_extract_clips(args.video,
+                                               config.template_path,
+                                               args.output_dir,
+                                               args.audio_cue,
+                                               audio_threshold=args.audio_threshold,
+                                               **kwargs)
+        return 0 if manifest is not None else 1
+
+    from creat_video_cut import find_template_and_extract_clips
+    manifest = find_template_and_extract_clips(args.video,
+                                               config.template_path,
+                                               args.output_dir, **kwargs)
+    return 0 if manifest is not None else 1
+
+
+def cmd_calibrate(args):
+    if len(args.frames) > 1 or os.path.isdir(args.frames[0]):
+        # 多张图：进程池并行标定，按分辨率稳健汇总后一次写入
+        from calculate_scale_in_image import calibrate_frames
+        summary = calibrate_frames(args.frames,
+                                   args.template,
+                                   args.output_dir,
+                                   threshold=args.threshold,
+                                   match_mode=args.mode,
+                                   method=args.method,
+                                   workers=args.workers)
+        return 0 if summary else 1
+
+    from calculate_scale_in_image import process_image_find_scale
+    result = process_image_find_scale(args.frames[0],
+                                      args.template,
+                                      args.output_dir,
+                                      threshold=args.threshold,
+                                      match_mode=args.mode,
+                                      method=args.method)
+    return 0 if result is not None else 1
+
+
+def parse_scale_range(value):
+    """ "0.4:0.6:20" -> 与 np.linspace(0.4, 0.6, 20) 相同的候选列表，即 起:止:个数 """
+    low, high, count = value.split(":")
+    low, high, count = float(low), float(high), int(count)
+    if count < 1:
+        raise argparse.ArgumentTypeError(f"候选个数必须 >= 1: {value}")
+    if count == 1:
+        return [low]
+    return [low + (high - low) * i / (count - 1) for i in range(count)]
+
+
+def cmd_calibrate_video(args):
+    from lib import add_scale_factors
+    from matcher import load_template
+    from scale_search import (load_gray_frames, halving_scale_search,
+                              exhaustive_scale_search)
+    template_bgr = load_template(args.template)
+    if template_bgr is None:
+        raise ValueError(f"无法读取模板图像: {args.template}")
+    try:
+        first_frame, frames = load_gray_frames(args.video, args.start, args.end,
+                                               args.frame_cache)
+    except IOError as e:
+        print(f"❌ {e}")
+        return 1
+    print(f"[INFO] 读取 {len(frames)} 帧 (从第 {first_frame} 帧起)")
+
+    if args.search == "halving":
+        result = halving_scale_search(frames,
+                                      template_bgr,
+                                      args.scales,
+                                      first_frame=first_frame,
+                                      threshold=args.threshold,
+                                      verbose=True)
+    else:
+        result = exhaustive_scale_search(frames,
+                                         template_bgr,
+                                         args.scales,
+                                         first_frame=first_frame,
+                                         threshold=args.threshold,
+                                         refine_steps=5)
+    print(f"[INFO] 最优 scale_factor = {result.scale_factor:.5f}, 匹配值 {result.score:.5f}, "
+          f"出现帧 {result.frame_idx}；细化 {result.refined_scale_factor:.5f} "
+          f"(匹配值 {result.refined_score:.5f})；matchTemplate {result.calls} 次，"
+          f"{len(result.hits)} 帧 >= {args.threshold}")
+    if result.refined_score < args.threshold:
+        print(f"❌ 匹配值低于阈值 {args.threshold}，未写入 scale_factor")
+        return 1
+    height, width = frames[0].shape[:2]
+    key = f"{width}x{height}"
+    add_scale_factors(key,
+                      result.refined_scale_factor,
+                      score=result.refined_score,
+                      source=f"video-{args.search}:{args.video}")
+    print(f"✅ 已写入 {key}: {result.refined_scale_factor:.5f}")
+    return 0
+
+
+def parse_list(cast):
+    """ "1,2,5" -> (1, 2, 5) """
+    return lambda value: tuple(cast(v) for v in value.split(",") if v.strip())
+
+
+def cmd_tune(args):
+    from autotune import autotune
+    # 未指定的搜索范围使用 autotune 中的默认值
+    space = {name: getattr(args, name) for name in ("strides", "downscales", "modes")
+             if getattr(args, name) is not None}
+    chosen = autotune(args.labels,
+                      template_path=args.template,
+                      profile_dir=args.profile_dir,
+                      target_recall=args.target_recall,
+                      max_false_positives=args.max_false_positives,
+                      **space)
+    return 0 if chosen and all(c is not None for c in chosen.values()) else 1
+
+
+def cmd_submit(args):
+    config = build_config(args, default_stride=13)
+    from spool_queue import submit_job
+    for video in args.videos:
+        job_id = submit_job(args.spool, video, config, args.output_dir,
+                            start=args.start, end=args.end)
+        print(f"[INFO] 已提交任务 {job_id}: {video}")
+    return 0
+
+
+def cmd_worker(args):
+    from spool_queue import run_worker, run_local_workers
+    kwargs = dict(heartbeat=args.heartbeat,
+                  stale_after=args.stale_after,
+                  exit_when_empty=args.exit_when_empty or bool(args.local))
+    if args.local:
+        workers = None if args.local == "auto" else int(args.local)
+        status = run_local_workers(args.spool, workers=workers, **kwargs)
+        print(f"[INFO] 队列状态: {status}")
+        return 0 if not status["failed"] else 1
+    run_worker(args.spool, worker_id=args.worker_id, **kwargs)
+    return 0
+
+
+def cmd_status(args):
+    from spool_queue import queue_status, requeue_stale
+    if args.requeue:
+        requeue_stale(args.spool, stale_after=args.stale_after)
+    print(json.dumps(queue_status(args.spool)))
+    return 0
+
+
+def cmd_watch(args):
+    config = build_config(args, default_stride=13)
+    from watch_folder import watch_folder
+    watch_folder(args.watch_dir,
+                 config,
+                 args.output_dir,
+                 catalog_path=args.catalog,
+                 poll=args.poll,
+                 settle=args.settle,
+                 spool=args.spool,
+                 once=args.once)
+    return 0
+
+
+def cmd_reel(args):
+    from build_highlight_reel import build_highlight_reel, collect_clips
+    clips = collect_clips(args.clip_dirs,
+                          order=args.order,
+                          min_score=args.min_score,
+                          day=args.day)
+    count, _ = build_highlight_reel(clips, args.out)
+    return 0 if count else 1
+
+
+def cmd_bench(args):
+    from governor import benchmark, get_governor
+    config = build_config(args, default_stride=13)
+    governor = get_governor()
+    export_cmd = None
+    export_cores = 0
+    if args.with_export:
+        # 用解码整段视频模拟导出/转码负载
+        export_cmd = ["ffmpeg", "-v", "error", "-y", "-i", args.video, "-f", "null", "-"]
+        export_cores = governor.export_cores
+    results = benchmark(args.video,
+                        config,
+                        frames=args.frames,
+                        cores=governor.cores,
+                        splits=args.splits,
+                        export_cmd=export_cmd,
+                        export_cores=export_cores)
+    best = max(results, key=lambda r: r["fps"])
+    print(f"✅ 最快: {best['workers']} 进程 x {best['cv_threads']} 线程, {best['fps']} 帧/s "
+          f"(--cores {governor.cores}，worker --local {best['workers']})")
+    return 0
+
+
+def parse_split(value):
+    """ "1x4,2x2,4x1" -> [(1, 4), (2, 2), (4, 1)]，即 (进程数, 每进程 OpenCV 线程数) """
+    splits = []
+    for item in value.split(","):
+        workers, threads = item.lower().split("x")
+        splits.append((int(workers), int(threads)))
+    return splits
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="id5clips",
+                                     description="第五人格录屏恐惧震慑检测与剪辑")
+    parser.add_argument("--log-dir", default="./log", help="日志目录")
+    parser.add_argument("--no-log",
+                        action="store_true",
+                        help="不写日志文件，直接输出到终端")
+    parser.add_argument("--metrics-port",
+                        type=int,
+                        help="在 127.0.0.1 的该端口提供 /metrics 与 /metrics.json 进度指标")
+    parser.add_argument("--cores",
+                        type=int,
+                        help="本进程可用的核心预算(默认为全部可用核心)")
+    parser.add_argument("--export-cores",
+                        type=int,
+                        help="预算中留给 FFmpeg 导出的核心数(默认 1/4)")
+    parser.add_argument("--export-slots",
+                        type=int,
+                        default=1,
+                        help="同时运行的 FFmpeg 导出数")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("detect", help="检测并保存命中帧")
+    p.add_argument("video")
+    p.add_argument("--output-dir", default="./matched_frames")
+    p.add_argument("--events",
+                   action="store_true",
+                   help="不保存图片，把每个命中以 JSON 行输出到 stdout")
+    add_detector_args(p)
+    add_range_args(p)
+    add_frame_cache_arg(p)
+    p.set_defaults(func=cmd_detect)
+
+    p = sub.add_parser("cut", help="检测并剪出片段")
+    p.add_argument("video")
+    p.add_argument("--output-dir", default="./clips")
+    p.add_argument("--single-pass",
+                   action="store_true",
+                   help="检测时直接复制压缩包写出片段，只读一次源视频(需要 PyAV)")
+    p.add_argument("--audio-cue",
+                   help="恐惧震慑音效的参考音频；给定时先做音频预筛，只在候选窗口内做视频匹配")
+    p.add_argument("--audio-threshold",
+                   type=float,
+                   default=0.5,
+                   help="音效互相关阈值")
+    add_detector_args(p)
+    add_range_args(p)
+    add_frame_cache_arg(p)
+    p.set_defaults(func=cmd_cut)
+
+    p = sub.add_parser("calibrate", help="在含图标的截图上标定 scale_factor")
+    p.add_argument("frames", nargs="+", help="图片文件或目录；多张时并行标定并按分辨率汇总")
+    p.add_argument("--template", default="./terror_shock.png")
+    p.add_argument("--output-dir", default="./matched_frames")
+    p.add_argument("--threshold", type=float, default=0.7)
+    p.add_argument("--mode",
+                   choices=MATCH_MODES,
+                   default="masked_gray",
+                   help="标定所用匹配模式；scale_factor 与模式无关，各模式共用同一条记录")
+    p.add_argument("--method",
+                   choices=("features", "sweep"),
+                   default="features",
+                   help="features: 特征点一次估计+验证；sweep: 多比例网格搜索")
+    p.add_argument("--workers", type=int, help="多张图时的进程数(默认 CPU 核数)")
+    p.set_defaults(func=cmd_calibrate)
+
+    p = sub.add_parser("calibrate-video",
+                       help="在视频帧上搜索最优 scale_factor 并写入 scale_factors.json")
+    p.add_argument("video")
+    p.add_argument("--template", default="./terror_shock.png")
+    p.add_argument("--threshold", type=float, default=0.7)
+    p.add_argument("--scales",
+                   type=parse_scale_range,
+                   default="0.4:0.6:20",
+                   help="候选 scale_factor 范围 起:止:个数")
+    p.add_argument("--search",
+                   choices=("halving", "exhaustive"),
+                   default="halving",
+                   help="halving: 逐次减半剪枝(结果与穷举一致)；exhaustive: 全部候选 x 全部帧")
+    add_range_args(p)
+    add_frame_cache_arg(p)
+    p.set_defaults(func=cmd_calibrate_video)
+
+    p = sub.add_parser("tune",
+                       help="在标注录像上搜索满足召回目标的最快配置，按分辨率写出配置文件")
+    p.add_argument("labels", help="标注文件(JSON)，格式见 autotune 模块")
+    p.add_argument("--template", default="./terror_shock.png")
+    p.add_argument("--profile-dir", default="./profiles", help="配置文件输出目录")
+    p.add_argument("--target-recall", type=float, default=0.99, help="召回目标")
+    p.add_argument("--max-false-positives",
+                   type=int,
+                   default=0,
+                   help="允许的误报次数(标注事件以外的命中)")
+    p.add_argument("--strides", type=parse_list(int), help="候选 stride，如 1,2,5,10")
+    p.add_argument("--downscales", type=parse_list(float), help="候选缩小倍数，如 1,0.5")
+    p.add_argument("--modes", type=parse_list(str), help="候选匹配模式，逗号分隔")
+    p.set_defaults(func=cmd_tune)
+
+    p = sub.add_parser("submit", help="把视频作为剪辑任务提交到共享 spool 目录")
+    p.add_argument("videos", nargs="+")
+    p.add_argument("--spool", required=True, help="共享任务目录")
+    p.add_argument("--output-dir", default="./clips", help="片段输出目录(worker 需可访问)")
+    add_detector_args(p)
+    add_range_args(p)
+    p.set_defaults(func=cmd_submit)
+
+    p = sub.add_parser("worker", help="从 spool 目录认领并执行剪辑任务")
+    p.add_argument("--spool", required=True, help="共享任务目录")
+    p.add_argument("--worker-id", help="默认为 主机名-进程号")
+    p.add_argument("--local",
+                   help="在本机启动 N 个 worker 进程(auto 按核心预算决定)，队列清空后退出")
+    p.add_argument("--exit-when-empty",
+                   action="store_true",
+                   help="队列清空后退出，而不是持续等待新任务")
+    p.add_argument("--heartbeat", type=float, default=10, help="心跳间隔(秒)")
+    p.add_argument("--stale-after",
+                   type=float,
+                   default=60,
+                   help="心跳超过该秒数未更新即重新排队")
+    p.set_defaults(func=cmd_worker)
+
+    p = sub.add_parser("watch", help="监视目录，只处理新出现的录像")
+    p.add_argument("watch_dir")
+    p.add_argument("--output-dir", default="./clips")
+    p.add_argument("--catalog", default="./catalog.sqlite", help="SQLite 目录文件")
+    p.add_argument("--poll", type=float, default=60, help="扫描间隔(秒)")
+    p.add_argument("--settle",
+                   type=float,
+                   default=30,
+                   help="mtime 距今不足该秒数的文件视为仍在写入")
+    p.add_argument("--spool", help="给定时把新视频提交到 spool 队列而不是本地处理")
+    p.add_argument("--once", action="store_true", help="只扫描一轮")
+    add_detector_args(p)
+    p.set_defaults(func=cmd_watch)
+
+    p = sub.add_parser("bench", help="实测不同核心划分(进程数 x OpenCV 线程数)下的总扫描吞吐量")
+    p.add_argument("video")
+    p.add_argument("--frames", type=int, default=300, help="每个进程扫描的帧数")
+    p.add_argument("--splits",
+                   type=parse_split,
+                   help="要测的划分，如 1x4,2x2,4x1(默认 1,2,4,... 个进程平分扫描核心)")
+    p.add_argument("--with-export",
+                   action="store_true",
+                   help="测量期间在导出核心上用 FFmpeg 解码本视频，模拟扫描与导出同时进行")
+    add_detector_args(p)
+    p.set_defaults(func=cmd_bench)
+
+    p = sub.add_parser("reel", help="把剪出的片段按录屏时间或匹配值拼接为一个合集")
+    p.add_argument("clip_dirs",
+                   nargs="*",
+                   default=["./clips"],
+                   help="cut 的输出目录(默认 ./clips)")
+    p.add_argument("--out", default="./reels/highlights.mp4", help="合集文件")
+    p.add_argument("--order",
+                   choices=("time", "score"),
+                   default="time",
+                   help="time: 按录屏时间；score: 按匹配值从高到低")
+    p.add_argument("--min-score", type=float, help="只保留匹配值不低于该值的片段")
+    p.add_argument("--day", help="只保留某天的录屏，如 2025-03-22")
+    p.set_defaults(func=cmd_reel)
+
+    p = sub.add_parser("status", help="打印 spool 目录中各状态的任务数")
+    p.add_argument("--spool", required=True, help="共享任务目录")
+    p.add_argument("--requeue", action="store_true", help="先回收心跳超时的任务")
+    p.add_argument("--stale-after", type=float, default=60)
+    p.set_defaults(func=cmd_status)
+
+    p = sub.add_parser("check", help="校验配置并打印合并后的结果")
+    add_detector_args(p)
+    p.set_defaults(func=cmd_check)
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    try:
+        if args.command in ("check", "status"):
+            return args.func(args)
+        from governor import configure_governor
+        configure_governor(cores=args.cores,
+                           export_cores=args.export_cores,
+                           export_slots=args.export_slots).apply()
+        if args.metrics_port is not None:
+            from metrics import start_metrics_server
+            server = start_metrics_server(args.metrics_port)
+            print(f"[INFO] 指标: http://127.0.0.1:{server.server_port}/metrics",
+                  file=sys.stderr)
+        # 事件流模式输出到 stdout，不重定向到日志
+        use_log = not args.no_log and not getattr(args, "events", False)
+        if use_log:
+            from lib import start_log
+            start_log(args.log_dir)
+        try:
+            return args.func(args)
+        finally:
+            if use_log:
+                from lib import end
+                end()
+    except ValueError as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
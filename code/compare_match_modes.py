@@ -0,0 +1,153 @@
+# compare_match_modes.py
+import sys
+import json
+import time
+import cv2
+import numpy as np
+from lib import get_video_scale_factor, iter_video_frames, start_log, end
+from matcher import TemplateMatcher, load_template, scale_template
+
+
+def best_threshold(pos_scores, neg_scores):
+    """
+    为候选模式选择阈值：以基线判定为正/负样本，
+    在所有候选分数上取 F1 最大者；F1 相同时取更低的阈值以保召回。
+    返回 (threshold, f1)。
+    """
+    pos = np.asarray(pos_scores, dtype=np.float64)
+    neg = np.asarray(neg_scores, dtype=np.float64)
+    if pos.size == 0:
+        return None, 0.0
+    best_t, best_f1 = None, -1.0
+    for t in np.unique(pos):
+        tp = np.count_nonzero(pos >= t)
+        fp = np.count_nonzero(neg >= t)
+        fn = pos.size - tp
+        f1 = 2 * tp / (2 * tp + fp + fn)
+        if f1 > best_f1:
+            best_t, best_f1 = float(t), f1
+    return best_t, best_f1
+
+
+def compare_match_modes(video_path,
+                        template_path,
+                        threshold=0.7,
+                        candidate_mode="red_likelihood",
+                        start=None,
+                        end=None,
+                        stride=13,
+                        report_path=None):
+    """
+    在同一批采样帧上对比基线 "masked_gray" 与 candidate_mode：
+    - 以基线匹配值 >= threshold 的帧为正样本，统计候选模式的分数分布、推荐阈值、
+      该阈值下的召回率/精确率以及匹配位置是否一致
+    - 分别统计两种模式的单帧耗时(含帧预处理)
+    返回报告 dict，并可写入 report_path。
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        print(f"❌ 无法打开视频: {video_path}")
+        return None
+
+    template_bgr = load_template(template_path)
+    if template_bgr is None:
+        print(f"❌ 无法读取模板图像: {template_path}")
+        return None
+    scale_factor = get_video_scale_factor(cap, template_bgr, start, end)
+    if scale_factor is None:
+        print("❌ 没有可用的 scale_factor")
+        return None
+    template_bgr = scale_template(template_bgr, scale_factor)
+    baseline = TemplateMatcher(template_bgr, mode="masked_gray")
+    candidate = TemplateMatcher(template_bgr, mode=candidate_mode)
+
+    base_time, cand_time = 0.0, 0.0
+    records = []
+    for frame_idx, frame in iter_video_frames(cap, start, end, stride=stride):
+        t0 = time.perf_counter()
+        base_val, base_loc = baseline.match(frame)
+        t1 = time.perf_counter()
+        cand_val, cand_loc = candidate.match(frame)
+        t2 = time.perf_counter()
+        base_time += t1 - t0
+        cand_time += t2 - t1
+        records.append((frame_idx, base_val, base_loc, cand_val, cand_loc))
+        if frame_idx % 100 == 0:
+            sys.stdout.flush()
+    cap.release()
+
+    if not records:
+        print("❌ 没有采样到任何帧")
+        return None
+
+    positives = [r for r in records if r[1] >= threshold]
+    negatives = [r for r in records if r[1] < threshold]
+    cand_threshold, f1 = best_threshold([r[3] for r in positives],
+                                        [r[3] for r in negatives])
+
+    report = {
+        "video": video_path,
+        "candidate_mode": candidate_mode,
+        "baseline_threshold": threshold,
+        "frames": len(records),
+        "baseline_hits": len(positives),
+        "baseline_ms_per_frame": base_time / len(records) * 1000,
+        "candidate_ms_per_frame": cand_time / len(records) * 1000,
+        "speedup": base_time / cand_time if cand_time > 0 else None,
+        "suggested_threshold": cand_threshold,
+        "f1": f1,
+    }
+    if positives:
+        pos_scores = np.array([r[3] for r in positives])
+        report["positive_scores"] = {
+            "min": float(pos_scores.min()),
+            "median": float(np.median(pos_scores))
+        }
+    if negatives:
+        neg_scores = np.array([r[3] for r in negatives])
+        report["negative_scores"] = {
+            "max": float(neg_scores.max()),
+            "p99": float(np.percentile(neg_scores, 99))
+        }
+    if cand_threshold is not None:
+        cand_hits = [r for r in records if r[3] >= cand_threshold]
+        both = [r for r in positives if r[3] >= cand_threshold]
+        same_loc = [
+            r for r in both
+            if abs(r[2][0] - r[4][0]) <= 2 and abs(r[2][1] - r[4][1]) <= 2
+        ]
+        report["recall"] = len(both) / len(positives)
+        report["precision"] = len(both) / len(cand_hits) if cand_hits else 0.0
+        report["location_agreement"] = len(same_loc) / len(both) if both else 0.0
+        report["missed_frames"] = [
+            r[0] for r in positives if r[3] < cand_threshold
+        ]
+        report["extra_frames"] = [
+            r[0] for r in negatives if r[3] >= cand_threshold
+        ]
+
+    print("\n=== 匹配模式对比 ===")
+    for key, value in report.items():
+        print(f"{key}: {value}")
+
+    if report_path:
+        with open(report_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=4, ensure_ascii=False)
+        print("报告已保存:", report_path)
+    return report
+
+
+if __name__ == "__main__":
+    start_log()
+    video_path = "./clips/clip_001.mp4"
+    template_path = "./terror_shock.png"
+    threshold_value = 0.7
+    report_path = "./log/compare_match_modes.json"
+
+    compare_match_modes(video_path,
+                        template_path,
+                        threshold=threshold_value,
+                        stride=1,
+                        report_path=report_path)
+
+    end()
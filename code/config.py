@@ -0,0 +1,87 @@
+# config.py
+# 只依赖标准库：CLI 在解析参数、校验配置时导入本模块，不会触发 cv2/NumPy 的加载
+import os
+import json
+from dataclasses import dataclass, asdict, fields
+from typing import Optional, Tuple
+
+# 可选的匹配模式：
+# - "masked_gray": 灰度图 + 红色 mask 的 TM_CCOEFF_NORMED(原有方式)
+# - "red_likelihood": 帧与模板都转为红色似然图，再做不带 mask 的 TM_CCOEFF_NORMED，
+#   省去 OpenCV 为支持 mask 额外计算的几次相关运算
+# 两种模式的匹配值分布不同，阈值需分别标定；scale_factor 是图标在画面中的几何大小，
+# 与模式无关，scale_factors.json 中每个分辨率只有一条记录，各模式共用(实测对比见 README)
+MATCH_MODES = ("masked_gray", "red_likelihood")
+
+
+def parse_roi(value):
+    """ "x,y,w,h" 或 [x, y, w, h] -> (x, y, w, h)；None 原样返回 """
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = [v for v in value.replace(" ", "").split(",") if v]
+    roi = tuple(int(v) for v in value)
+    if len(roi) != 4:
+        raise ValueError(f"ROI 需要 4 个整数 x,y,w,h: {value!r}")
+    return roi
+
+
+@dataclass
+class DetectorConfig:
+    """
+    检测器配置，一次配置可复用于多个视频。
+    scale_factor 为 None 时按视频分辨率从 scale_factors.json 查找或预测。
+    """
+    template_path: str = "./terror_shock.png"
+    threshold: float = 0.7
+    stride: int = 10
+    match_mode: str = "masked_gray"
+    roi: Optional[Tuple[int, int, int, int]] = None
+    batch_size: int = 16
+    scale_factor: Optional[float] = None
+    # 跟踪模式：命中后先在上次位置周围 track_margin 像素内搜索；None 为关闭
+    track_margin: Optional[int] = None
+    # 匹配前把帧(与模板)缩小到 downscale 倍，1.0 为原分辨率；结果坐标仍按原分辨率
+    downscale: float = 1.0
+
+    def validate(self):
+        """ 检查配置是否合法，返回自身；不合法时抛出 ValueError """
+        self.roi = parse_roi(self.roi)
+        if not os.path.isfile(self.template_path):
+            raise ValueError(f"模板图像不存在: {self.template_path}")
+        if not -1.0 <= self.threshold <= 1.0:
+            raise ValueError(f"threshold 应在 [-1, 1] 内: {self.threshold}")
+        if self.stride < 1:
+            raise ValueError(f"stride 应 >= 1: {self.stride}")
+        if self.match_mode not in MATCH_MODES:
+            raise ValueError(
+                f"未知的匹配模式: {self.match_mode}，可选: {MATCH_MODES}")
+        if self.roi is not None and (self.roi[2] <= 0 or self.roi[3] <= 0):
+            raise ValueError(f"ROI 宽高应为正数: {self.roi}")
+        if self.batch_size < 1:
+            raise ValueError(f"batch_size 应 >= 1: {self.batch_size}")
+        if self.scale_factor is not None and self.scale_factor <= 0:
+            raise ValueError(f"scale_factor 应为正数: {self.scale_factor}")
+        if self.track_margin is not None and self.track_margin < 0:
+            raise ValueError(f"track_margin 应 >= 0: {self.track_margin}")
+        if not 0 < self.downscale <= 1.0:
+            raise ValueError(f"downscale 应在 (0, 1] 内: {self.downscale}")
+        return self
+
+    @classmethod
+    def from_dict(cls, data):
+        """ 从 dict 构造，未知字段报错以便及早发现拼写错误 """
+        names = {f.name for f in fields(cls)}
+        unknown = set(data) - names
+        if unknown:
+            raise ValueError(f"未知的配置项: {sorted(unknown)}")
+        return cls(**data)
+
+    @classmethod
+    def load(cls, path):
+        """ 从 JSON 文件读取配置 """
+        with open(path, "r", encoding="utf-8") as f:
+            return cls.from_dict(json.load(f))
+
+    def to_dict(self):
+        return asdict(self)
@@ -1,11 +1,23 @@
 # extract_clips_by_template.py
 import cv2
 import os
-import numpy as np
 import sys
-import subprocess
+import json
+from datetime import datetime
 from typing import List, Tuple
-from lib import get_scale_factor, create_red_mask, end
+from lib import get_video_scale_factor, parse_position
+from config import DetectorConfig
+from detector import Detector
+from frame_cache import open_frame_cache
+from governor import get_governor
+from matcher import load_template
+from metrics import METRICS
+
+# 每个输出子目录下记录片段信息(来源视频、区间、匹配值)的清单文件，供合集拼接使用
+CLIP_MANIFEST = "clips.json"
+# 每个命中帧前后保留的帧数
+PRE_ROLL_FRAMES = 200
+POST_ROLL_FRAMES = 100
 
 
 # 合并区间
@@ -24,16 +36,74 @@ def merge_intervals(intervals: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
     return merged
 
 
+def clip_windows(windows, start, end, fps):
+    """
+    把扫描窗口 [(start, end), ...](帧号、秒数或时间戳，见 lib.parse_position)限制在 [start, end] 内，
+    返回帧号表示的窗口，去掉限制后为空的窗口
+    """
+    first = parse_position(start, fps) or 1
+    last = parse_position(end, fps)
+    clipped = []
+    for win_start, win_end in windows:
+        win_first = max(parse_position(win_start, fps) or 1, first)
+        win_last = parse_position(win_end, fps)
+        if last is not None:
+            win_last = last if win_last is None else min(win_last, last)
+        if win_last is None or win_first <= win_last:
+            clipped.append((win_first, win_last))
+    return clipped
+
+
 def find_template_and_extract_clips(video_path,
                                     template_path,
                                     output_dir,
                                     threshold=0.6,
-                                    start_frame=0):
-    print(
-        f"[INFO] Video: {video_path}, Template: {template_path}, Threshold={threshold}"
-    )
+                                    start_frame=0,
+                                    start=None,
+                                    end=None,
+                                    match_mode="masked_gray",
+                                    roi=None,
+                                    batch_size=16,
+                                    stride=13,
+                                    scale_factor=None,
+                                    track_margin=None,
+                                    downscale=1.0,
+                                    windows=None,
+                                    frame_cache=None,
+                                    interactive=True):
+    """
+    扫描 video_path 中匹配 template_path 的帧，合并前后区间后用 FFmpeg 剪出片段。
+    start/end 为扫描范围，可用帧号或时间戳(如 "1:59:30")，通过关键帧跳转定位；
+    start_frame 为旧参数，等价于 start。
+    match_mode 见 matcher.MATCH_MODES；不同模式的匹配值分布不同，阈值需分别标定。
+    roi=(x, y, w, h) 时只在该区域内搜索，每 batch_size 帧批量匹配一次(见 matcher.scan_capture)。
+    scale_factor 为 None 时按分辨率查询；只有预测值时先在扫描范围内的采样帧上验证
+    (见 lib.get_video_scale_factor)，必要时提示输入；interactive=False 时(无人值守的 worker)
+    不提示，没有可用的 scale_factor 即返回 None。每 stride 帧匹配一次。
+    track_margin 不为 None 时使用跟踪模式：命中后先只在上次位置附近搜索(见 matcher.scan_capture)。
+    downscale < 1 时帧与模板都缩小后再匹配(见 matcher.TemplateMatcher)。
+    windows 为 [(start, end), ...] 时只扫描这些范围与 [start, end] 的交集(按顺序依次跳转)，
+    用于 audio_prefilter 给出的候选时间窗口。
+    frame_cache 为目录时从该目录下的解码帧缓存扫描(首次使用时建立，见 frame_cache 模块)，
+    反复实验同一段录像时不再解码；剪辑仍从原视频进行。
+    返回片段清单(同 clips.json)。
+    """
+    if start is None and start_frame:
+        start = start_frame
 
-    cap = cv2.VideoCapture(video_path)
+    print(
+        f"[INFO] Video: {video_path}, Template: {template_path}, Threshold={threshold}, "
+        f"Start={start}, End={end}")
+
+    if frame_cache is not None:
+        try:
+            cap = open_frame_cache(video_path, frame_cache, crop=roi, start=start,
+                                   end=end, match_mode=match_mode)
+        except (IOError, ValueError) as e:
+            print(f"\u274c {e}")
+            return
+    else:
+        cap = cv2.VideoCapture(video_path)
 
     fps = cap.get(cv2.CAP_PROP_FPS)
     if fps == 0:
@@ -43,105 +113,134 @@ def find_template_and_extract_clips(video_path,
         print(f"\u274c 无法打开视频: {video_path}")
         return
 
-    video_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-    video_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    scale_factor = get_scale_factor(video_width, video_height)
+    if scale_factor is None:
+        scale_factor = get_video_scale_factor(cap,
+                                              load_template(template_path),
+                                              start,
+                                              end,
+                                              interactive=interactive)
+        if scale_factor is None:
+            print("\u274c 没有可用的 scale_factor")
+            return
     print(f"[INFO] 使用 scale_factor = {scale_factor:.5f}")
 
-    template_rgba = cv2.imread(template_path, cv2.IMREAD_UNCHANGED)
-    if template_rgba is None:
-        print(f"\u274c 无法读取模板图像: {template_path}")
+    config = DetectorConfig(template_path=template_path,
+                            threshold=threshold,
+                            stride=stride,
+                            match_mode=match_mode,
+                            roi=roi,
+                            batch_size=batch_size,
+                            scale_factor=scale_factor,
+                            track_margin=track_margin,
+                            downscale=downscale)
+    try:
+        detector = Detector(config)
+        detector.matcher_for(scale_factor)
+    except ValueError as e:
+        print(f"\u274c {e}")
         return
 
-    if template_rgba.shape[2] == 4:
-        b, g, r, a = cv2.split(template_rgba)
-        template_bgr = cv2.merge([b, g, r])
-    else:
-        template_bgr = template_rgba
-
-    if scale_factor != 1.0:
-        new_w = int(template_bgr.shape[1] * scale_factor)
-        new_h = int(template_bgr.shape[0] * scale_factor)
-        template_bgr = cv2.resize(template_bgr, (new_w, new_h),
-                                  interpolation=cv2.INTER_AREA)
-
-    mask = create_red_mask(template_bgr)
-    gray_template = cv2.cvtColor(template_bgr, cv2.COLOR_BGR2GRAY)
-    t_h, t_w = gray_template.shape[:2]
-
     video_name = os.path.splitext(os.path.basename(video_path))[0]
-    os.makedirs(output_dir, exist_ok=True)
-
-    match_intervals = []
-    frame_idx = 0
-
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
-
-        frame_idx += 1
-        if frame_idx < start_frame:
-            continue
-
-        if frame_idx % 13 != 0:
-            continue
-        else:
-            print(f"[INFO] 正在处理第 {frame_idx} 帧...")
-
-        if frame_idx % 100 == 0:
-            sys.stdout.flush()
-
-        gray_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        result = cv2.matchTemplate(gray_frame,
-                                   gray_template,
-                                   cv2.TM_CCOEFF_NORMED,
-                                   mask=mask)
-        _, max_val, _, max_loc = cv2.minMaxLoc(result)
-
-        if np.isinf(max_val) or np.isnan(max_val):
-            continue
-
-        if max_val >= threshold:
-            match_intervals.append((max(0, frame_idx - 200), frame_idx + 100))
-            print(f"[MATCH] Frame={frame_idx}, val={max_val:.3f}")
-
-    cap.release()
-
     sub_dir = f"{video_name}_scale{scale_factor:.5f}"
     output_path = os.path.join(output_dir, sub_dir)
     os.makedirs(output_path, exist_ok=True)
-    # 合并区间并用 FFmpeg 剪切
-    merged = merge_intervals(match_intervals)
-    print("\n=== 总共剪辑区间 ===")
-    for idx, (start_f, end_f) in enumerate(merged):
+
+    manifest = {
+        "video": os.path.abspath(video_path),
+        "recorded_at": datetime.fromtimestamp(
+            os.path.getmtime(video_path)).isoformat(timespec="seconds"),
+        "fps": fps,
+        "scale_factor": scale_factor,
+        "threshold": threshold,
+        "clips": []
+    }
+    hits = []
+    governor = get_governor()
+
+    def export_clip(start_f, end_f):
+        """ 区间不会再与后续命中合并：写入清单，交给 governor 在后台用 FFmpeg 剪切 """
         start_sec = start_f / fps
         duration = (end_f - start_f) / fps
-        out_file = os.path.join(output_path, f"clip_{idx+1:03d}.mp4")
+        out_file = os.path.join(output_path,
+                                f"clip_{len(manifest['clips']) + 1:03d}.mp4")
+        clip_hits = [(f_idx, val) for f_idx, val in hits
+                     if start_f <= f_idx <= end_f]
+        manifest["clips"].append({
+            "file": os.path.basename(out_file),
+            "start_frame": start_f,
+            "end_frame": end_f,
+            "start_sec": round(start_sec, 3),
+            "duration": round(duration, 3),
+            "score": max((val for _, val in clip_hits), default=0.0),
+            "hits": [f_idx for f_idx, _ in clip_hits]
+        })
 
         ffmpeg_cmd = [
-            "ffmpeg", "-y", "-ss", f"{start_sec:.2f}", "-i", video_path, "-t",
-            f"{duration:.2f}", "-c", "copy", out_file
+            "ffmpeg", "-y", *governor.ffmpeg_args(), "-ss", f"{start_sec:.2f}",
+            "-i", video_path, "-t", f"{duration:.2f}", "-c", "copy", out_file
         ]
         print("[FFmpeg]", " ".join(ffmpeg_cmd))
-        subprocess.run(ffmpeg_cmd,
-                       stdout=subprocess.DEVNULL,
-                       stderr=subprocess.DEVNULL)
+        governor.submit_export(ffmpeg_cmd)
+
+    if windows is None:
+        windows = [(start, end)]
+        METRICS.start_video(video_path, *detector.scan_range(cap, start, end))
+    else:
+        total = len(windows)
+        windows = clip_windows(windows, start, end, fps)
+        print(f"[INFO] 只扫描 {len(windows)} 个候选窗口(共 {total} 个，已限制在扫描范围内)")
+        # 按扫描范围统计进度，位置随窗口跳跃前进
+        METRICS.start_video(video_path, *detector.scan_range(cap, start, end))
+
+    # 每 stride 帧处理一次，其余帧只解码不转换；配置 roi 时批量匹配。
+    # 命中按帧号递增到达，区间随扫描合并；一个区间确定不会再扩展时立即开始导出，
+    # 导出在后台以较低优先级运行，与扫描重叠
+    current = None
+    for win_start, win_end in windows:
+        for frame_idx, frame, max_val, max_loc in detector.iter_scored(
+                cap, win_start, win_end, scale_factor):
+            METRICS.frame(frame_idx)
+            print(f"[INFO] 正在处理第 {frame_idx} 帧...")
 
+            if frame_idx % 100 == 0:
+                sys.stdout.flush()
+
+            if max_val >= threshold:
+                interval = (max(0, frame_idx - PRE_ROLL_FRAMES),
+                            frame_idx + POST_ROLL_FRAMES)
+                hits.append((frame_idx, float(max_val)))
+                METRICS.hit()
+                print(f"[MATCH] Frame={frame_idx}, val={max_val:.3f}")
+                if current is None:
+                    current = interval
+                    continue
+                merged = merge_intervals([current, interval])
+                if len(merged) == 2:
+                    export_clip(*current)
+                current = merged[-1]
+
+    cap.release()
+    if current is not None:
+        export_clip(*current)
+
+    print(f"\n=== 总共剪辑区间: {len(manifest['clips'])} 个，等待导出完成 ===")
+    failed = governor.wait_exports()
+    if failed:
+        print(f"⚠️ {failed} 个片段导出失败")
+
+    write_clip_manifest(output_path, manifest)
+    METRICS.finish_video()
     print("\n✅ 所有区间已保存至:", output_dir)
+    return manifest
 
 
-if __name__ == "__main__":
-    video_path = "./video/van/4.mp4"
-    template_path = "./terror_shock.png"
-    output_dir = "./clips"
-    threshold = 0.7
-    start_frame = 0
+def write_clip_manifest(output_path, manifest):
+    """ 将片段清单写入 output_path/clips.json """
+    with open(os.path.join(output_path, CLIP_MANIFEST), "w",
+              encoding="utf-8") as f:
+        json.dump(manifest, f, indent=4, ensure_ascii=False)
 
-    find_template_and_extract_clips(video_path,
-                                    template_path,
-                                    output_dir,
-                                    threshold=threshold,
-                                    start_frame=start_frame)
 
-    end()
+if __name__ == "__main__":
+    from cli import main
+    sys.exit(main(["cut"] + sys.argv[1:]))
@@ -1,65 +1,92 @@
 # detect_template_in_video.py
 import cv2
 import os
-import numpy as np
 import sys
 # 添加 code/ 目录到模块搜索路径
 sys.path.append(os.path.join(os.path.dirname(__file__)))
-from lib import get_scale_factor, create_red_mask, end
+from lib import get_video_scale_factor
+from config import DetectorConfig
+from detector import Detector
+from frame_cache import open_frame_cache
+from matcher import frame_region, load_template
+from metrics import METRICS
 
 
 def find_template_in_video(video_path,
                            template_path,
                            output_dir,
                            threshold=0.6,
-                           start_frame=0):
+                           start_frame=0,
+                           start=None,
+                           end=None,
+                           match_mode="masked_gray",
+                           roi=None,
+                           batch_size=16,
+                           stride=10,
+                           scale_factor=None,
+                           track_margin=None,
+                           downscale=1.0,
+                           frame_cache=None):
     """
     在指定视频(video_path)的每帧中搜索 template_path 的图案，
     并对匹配值 >= threshold 的帧保存到 output_dir。
     同时，会尝试根据视频的分辨率自动获取 scale_factor (若无记录则用户输入)。
+    start/end 为处理范围，可用帧号或时间戳(如 "1:59:30")，通过关键帧跳转定位；
+    start_frame 为旧参数，等价于 start。
+    match_mode 见 matcher.MATCH_MODES；不同模式的匹配值分布不同，阈值需分别标定。
+    roi=(x, y, w, h) 时只在该区域内搜索，每 batch_size 帧批量匹配一次(见 matcher.scan_capture)。
+    scale_factor 为 None 时按分辨率查询(必要时提示输入)。每 stride 帧匹配一次。
+    track_margin 不为 None 时使用跟踪模式：命中后先只在上次位置附近搜索(见 matcher.scan_capture)。
+    downscale < 1 时帧与模板都缩小后再匹配(见 matcher.TemplateMatcher)。
+    frame_cache 为目录时从该目录下的解码帧缓存读取(首次使用时建立，见 frame_cache 模块)，
+    保存的命中帧为灰度图(缓存裁剪到 roi 时只含该区域)。
+    匹配本身由 detector.Detector 完成，本函数负责交互、日志与保存结果。
     """
+    if start is None and start_frame:
+        start = start_frame
 
     print(f"[INFO] Video: {video_path}, Template: {template_path}, "
-          f"Threshold={threshold}, StartFrame={start_frame}")
-
-    # 打开视频
-    cap = cv2.VideoCapture(video_path)
+          f"Threshold={threshold}, Start={start}, End={end}")
+
+    # 打开视频(或帧缓存)
+    if frame_cache is not None:
+        try:
+            cap = open_frame_cache(video_path, frame_cache, crop=roi, start=start,
+                                   end=end, match_mode=match_mode)
+        except (IOError, ValueError) as e:
+            print(f"❌ {e}")
+            return
+    else:
+        cap = cv2.VideoCapture(video_path)
     if not cap.isOpened():
         print(f"❌ 无法打开视频: {video_path}")
         return
 
-    # 获取分辨率
-    video_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-    video_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    scale_factor = get_scale_factor(video_width, video_height)
+    if scale_factor is None:
+        scale_factor = get_video_scale_factor(cap, load_template(template_path),
+                                              start, end)
+        if scale_factor is None:
+            print("❌ 没有可用的 scale_factor")
+            return
     print(f"[INFO] 使用 scale_factor={scale_factor:.5f}")
 
-    # 读取模板
-    template_rgba = cv2.imread(template_path, cv2.IMREAD_UNCHANGED)
-    if template_rgba is None:
-        print(f"❌ 无法读取模板图像: {template_path}")
+    # 读取模板，缩放并按匹配模式预处理
+    config = DetectorConfig(template_path=template_path,
+                            threshold=threshold,
+                            stride=stride,
+                            match_mode=match_mode,
+                            roi=roi,
+                            batch_size=batch_size,
+                            scale_factor=scale_factor,
+                            track_margin=track_margin,
+                            downscale=downscale)
+    try:
+        detector = Detector(config)
+        matcher = detector.matcher_for(scale_factor)
+    except ValueError as e:
+        print(f"❌ {e}")
         return
-
-    # 去掉Alpha通道
-    if template_rgba.shape[2] == 4:
-        b, g, r, a = cv2.split(template_rgba)
-        template_bgr = cv2.merge([b, g, r])
-    else:
-        template_bgr = template_rgba
-
-    # 若 scale_factor != 1.0，则缩放模板
-    if scale_factor != 1.0:
-        new_w = int(template_bgr.shape[1] * scale_factor)
-        new_h = int(template_bgr.shape[0] * scale_factor)
-        template_bgr = cv2.resize(template_bgr, (new_w, new_h),
-                                  interpolation=cv2.INTER_AREA)
-
-    # 生成 mask
-    mask = create_red_mask(template_bgr)
-
-    # 转灰度
-    gray_template = cv2.cvtColor(template_bgr, cv2.COLOR_BGR2GRAY)
-    t_h, t_w = gray_template.shape[:2]
+    t_h, t_w = matcher.t_h, matcher.t_w
 
     # 输出目录
     video_name = os.path.splitext(os.path.basename(video_path))[0]
@@ -69,35 +96,16 @@ def find_template_in_video(video_path,
 
     maxmax = 0.0
     max_frame_idx = -1
-    frame_idx = 0
-
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
-
-        frame_idx += 1
-        if frame_idx < start_frame:
-            continue
-
-        # 每10帧打印一次处理信息
-        if frame_idx % 10 == 0:
-            print(f"Processing frame #{frame_idx} ...")
-        else:
-            continue
-        if frame_idx % 100 == 0:
-            sys.stdout.flush()
 
-        gray_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    METRICS.start_video(video_path, *detector.scan_range(cap, start, end))
 
-        # matchTemplate
-        result = cv2.matchTemplate(gray_frame,
-                                   gray_template,
-                                   cv2.TM_CCOEFF_NORMED,
-                                   mask=mask)
-        _, max_val, _, max_loc = cv2.minMaxLoc(result)
-        if np.isinf(max_val) or np.isnan(max_val):
-            continue
+    # 每 stride 帧处理一次，其余帧只解码不转换；配置 roi 时批量匹配
+    for frame_idx, frame, max_val, max_loc in detector.iter_scored(
+            cap, start, end, scale_factor):
+        METRICS.frame(frame_idx)
+        print(f"Processing frame #{frame_idx} ...")
+        if frame_idx % 100 == 0:
+            sys.stdout.flush()
         # 更新最大匹配值
         if max_val > maxmax:
             maxmax = max_val
@@ -105,7 +113,12 @@ def find_template_in_video(video_path,
 
         # 保存匹配到的帧
         if max_val >= threshold:
-            top_left = max_loc
+            METRICS.hit()
+            if frame.ndim == 2:
+                # 帧缓存中的灰度帧(只读)，转成彩色副本再画框
+                frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+            ox, oy = frame_region(cap)[:2]
+            top_left = (max_loc[0] - ox, max_loc[1] - oy)
             bottom_right = (top_left[0] + t_w, top_left[1] + t_h)
             cv2.rectangle(frame, top_left, bottom_right, (0, 0, 255), 2)
 
@@ -116,22 +129,12 @@ def find_template_in_video(video_path,
             )
 
     cap.release()
+    METRICS.finish_video()
 
     print("\n=== 检测完成 ===")
     print(f"全局最高匹配值: {maxmax:.3f}, 出现在帧: {max_frame_idx}")
 
 
 if __name__ == "__main__":
-    video_path = "E:\录屏\\20250322-134043.mp4"
-    template_path = "./terror_shock.png"
-    output_dir = "./matched_frames"
-    threshold_value = 0.7
-    start_frame_value = 10000
-
-    find_template_in_video(video_path,
-                           template_path,
-                           output_dir,
-                           threshold=threshold_value,
-                           start_frame=start_frame_value)
-
-end()
+    from cli import main
+    sys.exit(main(["detect"] + sys.argv[1:]))
@@ -0,0 +1,140 @@
+# detector.py
+from collections import namedtuple
+import cv2
+from config import DetectorConfig
+from frame_cache import FrameCache
+from lib import (get_scale_store, lookup_scale_factor, parse_position,
+                 sample_frames, verify_scale_on_frames)
+from matcher import TemplateMatcher, load_template, scale_template, scan_capture
+
+# iter_matches 产出的单个命中：帧号(从 1 计数)、时间戳(秒)、匹配值、左上角坐标 (x, y)
+Match = namedtuple("Match", ["frame_idx", "timestamp", "score", "loc"])
+VideoInfo = namedtuple("VideoInfo", ["width", "height", "fps", "frame_count"])
+
+
+class Detector:
+    """
+    可嵌入的恐惧震慑检测器：按 DetectorConfig 配置一次，之后可对任意多个视频调用。
+    不写日志、不重定向 stdout、不提示输入；出错时抛出异常。
+
+        detector = Detector(DetectorConfig(threshold=0.7))
+        for m in detector.iter_matches("video.mp4"):
+            print(m.frame_idx, m.timestamp, m.score, m.loc)
+    """
+
+    def __init__(self, config=None):
+        self.config = (config or DetectorConfig()).validate()
+        self._template_bgr = None
+        self._matchers = {}
+
+    @staticmethod
+    def video_info(cap):
+        """ 读取已打开视频的分辨率、帧率(异常时按 30)与总帧数 """
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30
+        return VideoInfo(int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                         int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)), fps,
+                         int(cap.get(cv2.CAP_PROP_FRAME_COUNT)))
+
+    @staticmethod
+    def scan_range(cap, start=None, end=None):
+        """ 扫描范围 [start, end] 对应的首尾帧号(从 1 开始)；end 未指定时为视频总帧数 """
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30
+        first = parse_position(start, fps) or 1
+        last = parse_position(end, fps)
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        if frame_count > 0:
+            last = frame_count if last is None else min(last, frame_count)
+        return first, last
+
+    def resolve_scale(self, width, height, cap=None, start=None, end=None,
+                      persist=False):
+        """
+        配置中指定了 scale_factor 则直接使用，否则查询/预测；都没有时抛出 ValueError。
+        只有预测值且给出 cap 时，先在扫描范围 [start, end] 内的采样帧上验证(见 lib.verify_scale_on_frames)，
+        通过则使用验证后的值；都未通过(如采样帧中没有图标)时仍使用预测值。
+        默认不写 scale_factors.json，persist=True 时才把验证后的值写入。
+        """
+        if self.config.scale_factor is not None:
+            return self.config.scale_factor
+        scale, basis = lookup_scale_factor(width, height)
+        if scale is None:
+            raise ValueError(f"没有 {width}x{height} 的 scale_factor，请先标定")
+        if basis != "stored" and cap is not None:
+            verified = verify_scale_on_frames(sample_frames(cap, start, end),
+                                              self.template_bgr(), scale)
+            if verified is not None:
+                if persist:
+                    get_scale_store().update(f"{width}x{height}",
+                                             verified[0],
+                                             score=verified[1],
+                                             source=f"predicted:{basis}+verified")
+                return verified[0]
+        return scale
+
+    def template_bgr(self):
+        """ 未缩放的模板(BGR)，首次调用时读取 """
+        if self._template_bgr is None:
+            self._template_bgr = load_template(self.config.template_path)
+            if self._template_bgr is None:
+                raise ValueError(f"无法读取模板图像: {self.config.template_path}")
+        return self._template_bgr
+
+    def matcher_for(self, scale_factor):
+        """ 返回某 scale_factor 下的 TemplateMatcher(按 scale_factor 缓存) """
+        if scale_factor not in self._matchers:
+            downscale = self.config.downscale
+            self._matchers[scale_factor] = TemplateMatcher(
+                scale_template(self.template_bgr(), scale_factor * downscale),
+                mode=self.config.match_mode,
+                downscale=downscale)
+        return self._matchers[scale_factor]
+
+    def _open(self, video):
+        if isinstance(video, (cv2.VideoCapture, FrameCache)):
+            return video, False
+        cap = cv2.VideoCapture(video)
+        if not cap.isOpened():
+            raise IOError(f"无法打开视频: {video}")
+        return cap, True
+
+    def iter_scored(self, video, start=None, end=None, scale_factor=None):
+        """
+        产出每个采样帧的 (frame_idx, frame, score, loc)，不论是否超过阈值。
+        video 可为路径、已打开的 cv2.VideoCapture 或 frame_cache.FrameCache(后两者不会被关闭)。
+        """
+        cap, owned = self._open(video)
+        try:
+            info = self.video_info(cap)
+            if scale_factor is None:
+                scale_factor = self.resolve_scale(info.width, info.height, cap,
+                                                  start, end)
+            matcher = self.matcher_for(scale_factor)
+            yield from scan_capture(cap,
+                                    matcher,
+                                    start,
+                                    end,
+                                    stride=self.config.stride,
+                                    roi=self.config.roi,
+                                    batch_size=self.config.batch_size,
+                                    verbose=False,
+                                    threshold=self.config.threshold,
+                                    track_margin=self.config.track_margin)
+        finally:
+            if owned:
+                cap.release()
+
+    def iter_matches(self, video, start=None, end=None, scale_factor=None):
+        """
+        生成器：逐个产出匹配值 >= threshold 的 Match(frame_idx, timestamp, score, loc)。
+        start/end 可为帧号或时间戳，见 lib.parse_position。
+        """
+        cap, owned = self._open(video)
+        try:
+            fps = self.video_info(cap).fps
+            for frame_idx, _, score, loc in self.iter_scored(
+                    cap, start, end, scale_factor):
+                if score >= self.config.threshold:
+                    yield Match(frame_idx, (frame_idx - 1) / fps, score, loc)
+        finally:
+            if owned:
+                cap.release()
@@ -0,0 +1,156 @@
+# feature_scale.py
+"""
+基于特征点的一次性 scale_factor 估计：在模板与含图标的画面上提取 ORB/AKAZE 特征点并匹配，
+用 RANSAC 拟合相似变换(缩放 + 旋转 + 平移)，直接读出缩放比例与图标位置，
+再在该比例下做一次 matchTemplate 验证。
+标定新分辨率只需一次特征匹配和一次验证，不再需要几十次整帧的模板匹配。
+"""
+from collections import namedtuple
+import cv2
+import numpy as np
+from lib import create_red_mask
+from matcher import TemplateMatcher, scale_template
+
+# scale: 模板缩放比例；loc: 模板左上角在画面中的位置 (x, y)；
+# inliers / matches: RANSAC 内点数 / 参与拟合的匹配数；angle: 旋转角度(度)
+FeatureEstimate = namedtuple("FeatureEstimate",
+                             ["scale", "loc", "inliers", "matches", "angle"])
+
+FEATURE_METHODS = ("orb", "akaze")
+
+
+def _create_detector(method, nfeatures=5000):
+    """ 创建特征检测器；部分 OpenCV 版本(如 5.x 主包)不含 AKAZE，此时抛出 ValueError """
+    if method == "orb":
+        return cv2.ORB_create(nfeatures=nfeatures)
+    if method == "akaze":
+        if not hasattr(cv2, "AKAZE_create"):
+            raise ValueError("当前 OpenCV 不含 AKAZE")
+        return cv2.AKAZE_create()
+    raise ValueError(f"未知的特征方法: {method}，可选: {FEATURE_METHODS}")
+
+
+def estimate_scale_by_features(frame_bgr,
+                               template_bgr,
+                               method="orb",
+                               ratio=0.75,
+                               min_inliers=8):
+    """
+    估计 template_bgr 在 frame_bgr 中的缩放比例与位置，返回 FeatureEstimate；
+    特征点或内点不足时返回 None。
+    模板上只使用红色文字附近的特征点(红色 mask 膨胀后)，避免背景干扰。
+    frame_bgr 也可以是灰度帧(如 frame_cache 中的帧)；模板为灰度图时无法取红色 mask，使用全部特征点。
+    """
+    if template_bgr.ndim == 3:
+        template_gray = cv2.cvtColor(template_bgr, cv2.COLOR_BGR2GRAY)
+        mask = cv2.dilate(create_red_mask(template_bgr),
+                          np.ones((15, 15), np.uint8))
+    else:
+        template_gray, mask = template_bgr, None
+    if frame_bgr.ndim == 3:
+        frame_gray = cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2GRAY)
+    else:
+        frame_gray = frame_bgr
+
+    kp_t, des_t = _create_detector(method).detectAndCompute(template_gray, mask)
+    # 画面中特征点很多，ORB 的数量上限按面积放宽，否则图标上的点会被挤掉
+    frame_detector = _create_detector(method,
+                                      max(5000, frame_gray.size // 100))
+    kp_f, des_f = frame_detector.detectAndCompute(frame_gray, None)
+    if des_t is None or des_f is None or len(kp_t) < 2 or len(kp_f) < 2:
+        return None
+
+    # 两种方法的描述子都是二进制的，用汉明距离；Lowe 比值检验去掉模糊匹配
+    pairs = cv2.BFMatcher(cv2.NORM_HAMMING).knnMatch(des_t, des_f, k=2)
+    good = [p[0] for p in pairs
+            if len(p) == 2 and p[0].distance < ratio * p[1].distance]
+    if len(good) < min_inliers:
+        return None
+
+    src = np.float32([kp_t[m.queryIdx].pt for m in good])
+    dst = np.float32([kp_f[m.trainIdx].pt for m in good])
+    transform, inlier_mask = cv2.estimateAffinePartial2D(
+        src, dst, method=cv2.RANSAC, ransacReprojThreshold=3.0)
+    if transform is None:
+        return None
+    inliers = int(inlier_mask.sum())
+    if inliers < min_inliers:
+        return None
+
+    a, b = transform[0, 0], transform[1, 0]
+    scale = float(np.hypot(a, b))
+    if not 0.05 <= scale <= 5.0:  # 退化解(如内点都落在同一处)
+        return None
+    angle = float(np.degrees(np.arctan2(b, a)))
+    # 模板原点 (0, 0) 映射到画面中的位置即左上角
+    loc = (int(round(transform[0, 2])), int(round(transform[1, 2])))
+    return FeatureEstimate(scale, loc, inliers, len(good), angle)
+
+
+def verify_scale(frame_bgr,
+                 template_bgr,
+                 scale_factor,
+                 loc=None,
+                 margin=16,
+                 match_mode="masked_gray"):
+    """
+    在 scale_factor 下做一次模板匹配，返回 (max_val, max_loc)。
+    给出 loc 时只在其周围 margin 像素内匹配，否则在整帧上匹配。
+    """
+    matcher = TemplateMatcher(scale_template(template_bgr, scale_factor),
+                              mode=match_mode)
+    height, width = frame_bgr.shape[:2]
+    if loc is not None:
+        x0 = min(max(0, loc[0] - margin), width)
+        y0 = min(max(0, loc[1] - margin), height)
+        x1 = min(width, loc[0] + matcher.t_w + margin)
+        y1 = min(height, loc[1] + matcher.t_h + margin)
+        if x1 - x0 >= matcher.t_w and y1 - y0 >= matcher.t_h:
+            max_val, max_loc = matcher.match(frame_bgr[y0:y1, x0:x1])
+            return max_val, (max_loc[0] + x0, max_loc[1] + y0)
+    if width < matcher.t_w or height < matcher.t_h:
+        return -1.0, (0, 0)
+    return matcher.match(frame_bgr)
+
+
+def calibrate_by_features(frame_bgr,
+                          template_bgr,
+                          threshold=0.7,
+                          method="orb",
+                          match_mode="masked_gray",
+                          refine_span=0.01,
+                          refine_steps=5):
+    """
+    特征估计 + 一次验证。返回 (scale_factor, max_val, max_loc, estimate)；
+    估计失败返回 None。max_val < threshold 时调用方应退回网格搜索。
+    method 失败(或当前 OpenCV 不支持)时再试另一种方法。
+    refine_steps > 1 时在估计值 ±refine_span 内再取几个比例，只在图标附近的小窗口内匹配，
+    修正特征点定位带来的微小误差，代价远小于一次整帧匹配。
+    """
+    estimate = None
+    for m in (method, ) + tuple(x for x in FEATURE_METHODS if x != method):
+        try:
+            estimate = estimate_scale_by_features(frame_bgr, template_bgr, method=m)
+        except ValueError:
+            continue
+        if estimate is not None:
+            break
+    if estimate is None:
+        return None
+    best = (estimate.scale, -1.0, estimate.loc)
+    scales = [estimate.scale]
+    if refine_steps > 1:
+        scales = np.linspace(estimate.scale * (1 - refine_span),
+                             estimate.scale * (1 + refine_span), refine_steps)
+    for scale_factor in scales:
+        max_val, max_loc = verify_scale(frame_bgr,
+                                        template_bgr,
+                                        float(scale_factor),
+                                        loc=estimate.loc,
+                                        match_mode=match_mode)
+        if max_val > best[1]:
+            best = (float(scale_factor), max_val, max_loc)
+    print(f"[INFO] 特征估计: scale={estimate.scale:.5f}, loc={estimate.loc}, "
+          f"内点 {estimate.inliers}/{estimate.matches}, 旋转 {estimate.angle:.1f}°")
+    print(f"[INFO] 验证: scale_factor={best[0]:.5f}, val={best[1]:.5f}")
+    return best[0], best[1], best[2], estimate
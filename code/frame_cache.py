@@ -0,0 +1,177 @@
+# frame_cache.py
+"""
+磁盘上的解码帧缓存：把视频(某个范围、可选裁剪到 ROI)解码一次，灰度帧按顺序写成一个
+原始 uint8 文件，之后用 np.memmap 映射读取。标定、阈值实验、模板调整反复使用同一段测试录像时，
+第二次起不再解码，只是内存映射的读取。
+
+缓存按内容哈希(lib.partial_hash)+ 裁剪区域 + 范围命名，位于 cache_dir 下：
+    <key>.frames   (count, h, w) uint8 灰度帧
+    <key>.ts.npy   每帧的时间戳(秒)
+    <key>.json     头信息：源视频、fps、原始分辨率、crop、首帧号、帧数
+头信息最后写入，存在即表示缓存完整。
+FrameCache 提供 get()/isOpened()/release() 与 iter_frames()，可以代替 cv2.VideoCapture
+传给 Detector、matcher.scan_capture、lib.iter_video_frames；产出的帧是 memmap 上的只读视图，不复制。
+缓存只保存灰度图，因此只适用于 masked_gray 模式(open_frame_cache 会拒绝其他模式)。
+"""
+import os
+import json
+from datetime import datetime
+import cv2
+import numpy as np
+from lib import iter_video_frames, parse_position, partial_hash
+from matcher import clip_roi
+
+FRAME_CACHE_DIR = "./frame_cache"
+_CACHE_VERSION = 1
+
+
+def cache_key(content_hash, crop=None, start=None, end=None):
+    """ 缓存文件名(不含扩展名)：内容哈希 + 裁剪区域 + 范围 """
+    key = content_hash[:16]
+    if crop is not None:
+        key += "_crop{}-{}-{}-{}".format(*(int(v) for v in crop))
+    if start is not None or end is not None:
+        span = f"{start or ''}-{end or ''}"
+        key += "_" + "".join(c if c.isalnum() or c in "-." else "." for c in span)
+    return key
+
+
+class FrameCache:
+    """ 已建好的帧缓存；接口与 cv2.VideoCapture 的常用部分一致 """
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        with open(prefix + ".json", "r", encoding="utf-8") as f:
+            self.header = json.load(f)
+        if self.header.get("version") != _CACHE_VERSION:
+            raise ValueError(f"帧缓存版本不符: {prefix}")
+        count, h, w = self.header["shape"]
+        self.frames = np.memmap(prefix + ".frames", dtype=np.uint8, mode="r",
+                                shape=(count, h, w))
+        self.timestamps = np.load(prefix + ".ts.npy", mmap_mode="r")
+        self.fps = self.header["fps"]
+        self.width = self.header["width"]
+        self.height = self.header["height"]
+        crop = self.header.get("crop")
+        self.crop = tuple(crop) if crop is not None else None
+        self.first_frame = self.header["first_frame"]
+
+    def __len__(self):
+        return len(self.frames)
+
+    @property
+    def last_frame(self):
+        return self.first_frame + len(self.frames) - 1
+
+    @property
+    def frame_indices(self):
+        """ 每帧的帧号(从 1 开始；缓存内连续) """
+        return np.arange(self.first_frame, self.last_frame + 1)
+
+    def get(self, prop):
+        """ 同 cv2.VideoCapture.get；宽高为原视频分辨率(用于查询 scale_factor)，不是裁剪后的尺寸 """
+        if prop == cv2.CAP_PROP_FPS:
+            return self.fps
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return self.width
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return self.height
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            return self.last_frame
+        return 0
+
+    def isOpened(self):
+        return True
+
+    def release(self):
+        pass
+
+    def iter_frames(self, start=None, end=None, stride=1):
+        """
+        与 lib.iter_video_frames 相同的语义：[start, end] 范围内 frame_idx % stride == 0 的帧，
+        产出 (frame_idx, frame)，frame 为 memmap 上的视图。超出缓存范围的部分直接略过。
+        """
+        first = max(parse_position(start, self.fps) or 1, self.first_frame)
+        last = parse_position(end, self.fps)
+        last = self.last_frame if last is None else min(last, self.last_frame)
+        first += -first % stride
+        for frame_idx in range(first, last + 1, stride):
+            yield frame_idx, self.frames[frame_idx - self.first_frame]
+
+
+def build_frame_cache(video_path, prefix, crop=None, start=None, end=None,
+                      content_hash=None):
+    """ 解码 video_path 的 [start, end] 范围，写出 prefix.* 缓存文件，返回 FrameCache """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise IOError(f"无法打开视频: {video_path}")
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    if crop is not None:
+        crop = clip_roi(crop, width, height)
+    x, y, w, h = crop if crop is not None else (0, 0, width, height)
+
+    tmp = prefix + ".frames.tmp"
+    first_frame = None
+    timestamps = []
+    try:
+        with open(tmp, "wb") as f:
+            for frame_idx, frame in iter_video_frames(cap, start, end):
+                if first_frame is None:
+                    first_frame = frame_idx
+                msec = cap.get(cv2.CAP_PROP_POS_MSEC)
+                timestamps.append(msec / 1000 if msec > 0 else (frame_idx - 1) / fps)
+                gray = cv2.cvtColor(frame[y:y + h, x:x + w], cv2.COLOR_BGR2GRAY)
+                f.write(gray.tobytes())
+    finally:
+        cap.release()
+    if first_frame is None:
+        os.remove(tmp)
+        raise ValueError(f"{video_path} 在范围 [{start}, {end}] 内没有可解码的帧")
+
+    os.replace(tmp, prefix + ".frames")
+    with open(prefix + ".ts.tmp", "wb") as f:
+        np.save(f, np.asarray(timestamps, dtype=np.float64))
+    os.replace(prefix + ".ts.tmp", prefix + ".ts.npy")
+    header = {
+        "version": _CACHE_VERSION,
+        "video": os.path.abspath(video_path),
+        "content_hash": content_hash,
+        "fps": fps,
+        "width": width,
+        "height": height,
+        "crop": list(crop) if crop is not None else None,
+        "first_frame": first_frame,
+        "shape": [len(timestamps), h, w],
+        "created": datetime.now().isoformat(timespec="seconds"),
+    }
+    with open(prefix + ".json.tmp", "w", encoding="utf-8") as f:
+        json.dump(header, f, indent=4, ensure_ascii=False)
+    os.replace(prefix + ".json.tmp", prefix + ".json")
+    return FrameCache(prefix)
+
+
+def open_frame_cache(video_path, cache_dir=FRAME_CACHE_DIR, crop=None, start=None,
+                     end=None, rebuild=False, match_mode="masked_gray"):
+    """
+    返回 video_path 的帧缓存(FrameCache)；还没有(或 rebuild=True)时先解码建立。
+    crop=(x, y, w, h) 时只缓存该区域，检测结果仍换算为整帧坐标(见 matcher.scan_capture)。
+    match_mode 为之后扫描使用的匹配模式：缓存只有灰度帧，不是 masked_gray 时在解码前抛出 ValueError。
+    """
+    if match_mode != "masked_gray":
+        raise ValueError(f"帧缓存只保存灰度帧，只能用于 masked_gray 模式，不能用于 {match_mode}")
+    os.makedirs(cache_dir, exist_ok=True)
+    content_hash = partial_hash(video_path)
+    prefix = os.path.join(cache_dir, cache_key(content_hash, crop, start, end))
+    if not rebuild and os.path.exists(prefix + ".json"):
+        try:
+            return FrameCache(prefix)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"⚠️ 帧缓存损坏，重新建立: {prefix} ({e})")
+    print(f"[INFO] 建立帧缓存: {video_path} -> {prefix}")
+    cache = build_frame_cache(video_path, prefix, crop=crop, start=start, end=end,
+                              content_hash=content_hash)
+    print(f"[INFO] 帧缓存完成: {len(cache)} 帧 (第 {cache.first_frame}-{cache.last_frame} 帧), "
+          f"{cache.frames.nbytes / 2**20:.1f} MB")
+    return cache
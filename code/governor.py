@@ -0,0 +1,276 @@
+# governor.py
+"""
+CPU 资源调度：统一分配本机的核心预算，避免多路扫描与 FFmpeg 同时运行时线程数成倍超额。
+
+- 预算分成扫描核心(scan_cores)与导出核心(export_cores，供 FFmpeg 使用)
+- 扫描核心平分给 scan_workers 个扫描进程，每个进程 cv2.setNumThreads(cv_threads)
+- FFmpeg 以 -threads ffmpeg_threads、较低优先级(nice)运行，同时最多 export_slots 个，
+  在后台线程中排队执行，扫描不必等待导出完成，导出也抢不走扫描的 CPU
+- benchmark() 在当前机器上实测不同预算划分下的总吞吐量
+
+进程内共享一个实例(get_governor)，CLI 的 --cores / --export-cores / --export-slots 会重新配置它。
+"""
+import os
+import sys
+import time
+import subprocess
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from metrics import METRICS
+
+# 导出进程的 nice 增量：扫描与导出争用 CPU 时优先保证扫描
+EXPORT_NICE = 10
+
+
+def available_cores():
+    """ 当前进程可用的 CPU 核数(考虑 CPU 亲和性) """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def _lower_priority(pid):
+    """
+    调低已启动子进程的优先级。不用 preexec_fn：有其他线程(扫描、指标、导出队列)时
+    它可能在 fork 与 exec 之间死锁
+    """
+    if not hasattr(os, "setpriority"):
+        return
+    try:
+        os.setpriority(os.PRIO_PROCESS, pid,
+                       os.getpriority(os.PRIO_PROCESS, 0) + EXPORT_NICE)
+    except OSError:
+        pass
+
+
+class ResourceGovernor:
+    """
+    核心预算。export_cores 为 None 时取总数的 1/4(不足 4 核时为 0：导出与扫描共用核心，只靠优先级让路)。
+    """
+
+    def __init__(self, cores=None, export_cores=None, scan_workers=1, export_slots=1):
+        self.cores = max(1, int(cores or available_cores()))
+        if export_cores is None:
+            export_cores = self.cores // 4
+        self.export_cores = max(0, min(int(export_cores), self.cores - 1))
+        self.scan_cores = self.cores - self.export_cores
+        self.scan_workers = max(1, min(int(scan_workers), self.scan_cores))
+        self.export_slots = max(1, int(export_slots))
+        self._pool = None
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return (f"ResourceGovernor(cores={self.cores}, scan={self.scan_workers}x"
+                f"{self.cv_threads}, export={self.export_slots}x{self.ffmpeg_threads})")
+
+    @property
+    def cv_threads(self):
+        """ 每个扫描进程的 OpenCV 线程数 """
+        return max(1, self.scan_cores // self.scan_workers)
+
+    @property
+    def ffmpeg_threads(self):
+        """ 每个 FFmpeg 进程的线程数 """
+        return max(1, self.export_cores // self.export_slots)
+
+    def budget(self):
+        """ 可在进程间传递的预算参数 """
+        return {
+            "cores": self.cores,
+            "export_cores": self.export_cores,
+            "scan_workers": self.scan_workers,
+            "export_slots": self.export_slots,
+        }
+
+    def share(self, workers):
+        """
+        把预算平分给 workers 个独立的进程(如 spool 的本机 worker)，返回其中一份；
+        每份各自扫描、各自导出
+        """
+        workers = max(1, int(workers))
+        return ResourceGovernor(cores=max(1, self.cores // workers),
+                                export_cores=self.export_cores // workers,
+                                export_slots=self.export_slots)
+
+    def apply(self):
+        """ 在当前进程按预算设置 OpenCV 线程数 """
+        import cv2
+        cv2.setNumThreads(self.cv_threads)
+        return self
+
+    def ffmpeg_args(self):
+        """ FFmpeg 的线程数参数(放在 -i 前限制解码，放在输出文件前限制编码) """
+        return ["-threads", str(self.ffmpeg_threads)]
+
+    def start_ffmpeg(self, cmd):
+        """ 以较低优先级启动一次 FFmpeg，立即返回 Popen """
+        proc = subprocess.Popen(cmd,
+                                stdout=subprocess.DEVNULL,
+                                stderr=subprocess.DEVNULL)
+        _lower_priority(proc.pid)
+        return proc
+
+    def run_ffmpeg(self, cmd, check=False, started=None):
+        """
+        以较低优先级同步运行一次 FFmpeg，返回 CompletedProcess；
+        started 为可调用对象时，启动后先以 Popen 调用它(便于外部中途终止)
+        """
+        with METRICS.ffmpeg_job():
+            with self.start_ffmpeg(cmd) as proc:
+                if started is not None:
+                    started(proc)
+                returncode = proc.wait()
+        if check and returncode != 0:
+            raise subprocess.CalledProcessError(returncode, cmd)
+        return subprocess.CompletedProcess(cmd, returncode)
+
+    def submit_export(self, cmd):
+        """ 把一次 FFmpeg 导出放进后台队列(最多 export_slots 个同时运行)，立即返回 Future """
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.export_slots,
+                                                thread_name_prefix="export")
+            future = self._pool.submit(self.run_ffmpeg, cmd)
+            self._pending.append(future)
+        return future
+
+    def wait_exports(self):
+        """ 等待已提交的导出全部完成，返回失败(非零退出)的次数 """
+        with self._lock:
+            pending, self._pending = self._pending, []
+        failed = 0
+        for future in pending:
+            if future.result().returncode != 0:
+                failed += 1
+        return failed
+
+
+_governor = None
+
+
+def get_governor():
+    """ 进程内共享的 ResourceGovernor(首次调用时按本机核数创建) """
+    global _governor
+    if _governor is None:
+        _governor = ResourceGovernor()
+    return _governor
+
+
+def configure_governor(**budget):
+    """ 按给定预算(见 ResourceGovernor 参数)替换共享实例并返回 """
+    global _governor
+    _governor = ResourceGovernor(**budget)
+    return _governor
+
+
+def _bench_init(cv_threads, code_dir):
+    if code_dir not in sys.path:
+        sys.path.insert(0, code_dir)
+    import cv2
+    cv2.setNumThreads(cv_threads)
+
+
+def _bench_scan(video_path, config, start, frames):
+    """ 基准测试的单个扫描任务：扫描 [start, start + frames) 并返回推进的帧数 """
+    from config import DetectorConfig
+    from detector import Detector
+    detector = Detector(DetectorConfig.from_dict(config))
+    last = start - 1
+    for frame_idx, _, _, _ in detector.iter_scored(video_path, start,
+                                                   start + frames - 1):
+        last = frame_idx
+    return max(0, last - start + 1)
+
+
+def default_splits(cores):
+    """ 基准测试的默认划分：(扫描进程数, 每进程 OpenCV 线程数)，进程数取 1, 2, 4, ... 与 cores """
+    workers = []
+    w = 1
+    while w < cores:
+        workers.append(w)
+        w *= 2
+    workers.append(cores)
+    return [(w, max(1, cores // w)) for w in workers]
+
+
+def benchmark(video_path, config, frames=300, cores=None, splits=None,
+              export_cmd=None, export_cores=0):
+    """
+    在当前机器上测量不同预算划分的总吞吐量：每种划分启动 workers 个进程，
+    各自扫描视频中不重叠的 frames 帧(stride 等取自 config)，总推进帧数 / 墙钟时间即总吞吐量。
+    给出 export_cmd(FFmpeg 命令)时，测量期间在后台以 export_cores 个线程、较低优先级反复运行它，
+    模拟扫描与导出同时进行。返回 [{"workers", "cv_threads", "fps", "frames", "seconds"}]
+    """
+    import cv2
+    cores = max(1, int(cores or available_cores()))
+    scan_cores = max(1, cores - export_cores)
+    splits = splits or default_splits(scan_cores)
+    cap = cv2.VideoCapture(video_path)
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+    if total_frames <= 0:
+        raise ValueError(f"无法读取视频帧数: {video_path}")
+    code_dir = os.path.dirname(os.path.abspath(__file__))
+    config = config.to_dict()
+
+    stop = threading.Event()
+    exporter = None
+    running = []
+    if export_cmd is not None:
+        governor = ResourceGovernor(cores=cores, export_cores=export_cores)
+
+        def started(proc):
+            running.append(proc)
+            # stop 之后才启动的进程不在 finally 终止的列表里，在这里终止
+            if stop.is_set():
+                proc.terminate()
+
+        def export_loop():
+            cmd = [export_cmd[0]] + governor.ffmpeg_args() + list(export_cmd[1:])
+            while not stop.is_set():
+                governor.run_ffmpeg(cmd, started=started)
+
+        exporter = threading.Thread(target=export_loop, daemon=True)
+        exporter.start()
+
+    results = []
+    try:
+        for workers, cv_threads in splits:
+            with ProcessPoolExecutor(max_workers=workers,
+                                     initializer=_bench_init,
+                                     initargs=(cv_threads, code_dir)) as pool:
+                # 预热：进程启动与模块导入不计入测量
+                list(pool.map(abs, range(workers)))
+                starts = [1 + (i * frames) % max(1, total_frames - frames)
+                          for i in range(workers)]
+                t0 = time.perf_counter()
+                done = sum(pool.map(_bench_scan, [video_path] * workers,
+                                    [config] * workers, starts,
+                                    [frames] * workers))
+                elapsed = time.perf_counter() - t0
+            fps = done / elapsed if elapsed > 0 else 0.0
+            results.append({
+                "workers": workers,
+                "cv_threads": cv_threads,
+                "fps": round(fps, 1),
+                "frames": done,
+                "seconds": round(elapsed, 2),
+            })
+            print(f"[BENCH] {workers} 进程 x {cv_threads} 线程: "
+                  f"{fps:.1f} 帧/s ({done} 帧, {elapsed:.1f}s)")
+            sys.stdout.flush()
+    finally:
+        # 导出命令会解码整个视频，不终止就要等它跑完
+        stop.set()
+        for proc in running:
+            if proc.poll() is None:
+                proc.terminate()
+                try:
+                    proc.wait(timeout=5)
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+        if exporter is not None:
+            exporter.join()
+    return results
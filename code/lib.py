@@ -1,21 +1,46 @@
 # lib.py
 import os
-import json
 import cv2
+import hashlib
 import numpy as np
 import sys
 from datetime import datetime
+from scale_store import ScaleFactorStore
 # 全局常量：记录scale_factor数据的JSON文件
 SCALE_FACTOR_FILE = "scale_factors.json"
-"""
-创建日志文件，返回文件名。
-"""
-current_time = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-log_filename = f"./log/output_{current_time}.log"
-os.makedirs("./log", exist_ok=True)
-f = open(log_filename, "w", encoding="utf-8")
-print("日志文件:", log_filename)
-sys.stdout = f
+
+# 当前日志文件(由 start_log 创建，end 关闭)；导入本模块不会产生任何副作用
+log_filename = None
+_log_file = None
+
+
+def start_log(log_dir="./log"):
+    """
+    创建日志文件并把 stdout 重定向到该文件，返回文件名。
+    仅由脚本入口/CLI 调用，作为库使用时不需要。
+    """
+    global log_filename, _log_file
+    current_time = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    os.makedirs(log_dir, exist_ok=True)
+    log_filename = os.path.join(log_dir, f"output_{current_time}.log")
+    _log_file = open(log_filename, "w", encoding="utf-8")
+    print("日志文件:", log_filename)
+    sys.stdout = _log_file
+    return log_filename
+
+
+_scale_store = None
+
+
+def get_scale_store():
+    """
+    返回进程内共享的 ScaleFactorStore(首次调用时创建)，
+    JSON 只读取一次并缓存在内存中。
+    """
+    global _scale_store
+    if _scale_store is None or _scale_store.path != SCALE_FACTOR_FILE:
+        _scale_store = ScaleFactorStore(SCALE_FACTOR_FILE)
+    return _scale_store
 
 
 def load_scale_factors():
@@ -23,56 +48,221 @@ def load_scale_factors():
     读取 scale_factors.json 以获取视频/图像分辨率与 scale_factor 的对应关系。
     若文件不存在，则返回空字典。
     """
-    if os.path.exists(SCALE_FACTOR_FILE):
-        with open(SCALE_FACTOR_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    return {}
+    return get_scale_store().as_dict()
 
 
 def save_scale_factors(scale_factors):
     """
     将传入的 scale_factors (dict) 写入 JSON 文件，保存分辨率 => scale_factor 的映射关系。
+    写入在文件锁内原子完成，未变化的记录保留其标定元数据。
+    """
+    get_scale_store().update_many(
+        {key: {
+            "scale": value
+        }
+         for key, value in scale_factors.items()},
+        replace=True)
+
+
+def lookup_scale_factor(video_width, video_height):
+    """
+    不打印、不提示输入地查询 scale_factor，返回 (scale, basis)：
+    已记录时 basis 为 "stored"；否则为预测依据(见 ScaleFactorStore.predict)；
+    无法得到时返回 (None, None)。供库调用方使用。
     """
-    with open(SCALE_FACTOR_FILE, "w", encoding="utf-8") as f:
-        json.dump(scale_factors, f, indent=4)
+    store = get_scale_store()
+    record = store.get(f"{video_width}x{video_height}")
+    if record is not None:
+        return record["scale"], "stored"
+    prediction = store.predict(video_width, video_height)
+    if prediction is not None:
+        return prediction
+    return None, None
 
 
-def get_scale_factor(video_width, video_height):
+def get_scale_factor(video_width,
+                     video_height,
+                     frame=None,
+                     template_bgr=None,
+                     threshold=0.7,
+                     frames=None,
+                     interactive=True):
     """
     根据视频或图片的分辨率 (video_width x video_height)，
     获取与之对应的 scale_factor。
     若 JSON 文件里已存在该分辨率的记录，则直接返回；
-    否则提示用户输入并写入 JSON。
+    否则根据已知分辨率预测一个值：若同时给出含图标的 frame(或多帧 frames，为 (frame_idx, frame))
+    与 template_bgr，则在这些帧上验证预测(见 verify_scale_on_frames)，验证通过才写入 JSON；
+    没有任何已知记录时，若给出了帧与 template_bgr 先用特征点估计(见 feature_scale)，
+    仍不成功则提示用户输入并写入 JSON；interactive=False 时不提示，直接返回 None。
     """
-    scale_factors = load_scale_factors()
+    store = get_scale_store()
     key = f"{video_width}x{video_height}"
+    if frames is None:
+        frames = [] if frame is None else [(None, frame)]
+
+    scale, basis = lookup_scale_factor(video_width, video_height)
+    if basis == "stored":
+        print(f"✅ 已找到 `{key}` 对应的 scale_factor: {scale}")
+        return scale
+
+    if scale is not None:
+        predicted = scale
+        print(f"⚠️ 未找到 `{key}` 的 scale_factor，按 {basis} 预测为 {predicted:.5f}")
+        if not frames or template_bgr is None:
+            return predicted
+        verified = verify_scale_on_frames(frames, template_bgr, predicted,
+                                          threshold=threshold)
+        if verified is not None:
+            best_scale, best_val, frame_idx = verified
+            store.update(key,
+                         best_scale,
+                         score=best_val,
+                         source=f"predicted:{basis}+verified")
+            at = "" if frame_idx is None else f"(第 {frame_idx} 帧)"
+            print(f"✅ 预测已验证{at}: scale_factor={best_scale:.5f}, "
+                  f"val={best_val:.5f}，已写入 JSON")
+            return best_scale
+        print(f"⚠️ 预测在 {len(frames)} 帧上均未通过验证，本次仍使用预测值，不写入 JSON")
+        return predicted
 
-    if key in scale_factors:
-        print(f"✅ 已找到 `{key}` 对应的 scale_factor: {scale_factors[key]}")
-        return scale_factors[key]
+    # 没有任何可参考的记录：有含图标的画面时先用特征点估计
+    if frames and template_bgr is not None:
+        from feature_scale import calibrate_by_features
+        for _, sample in frames:
+            result = calibrate_by_features(sample, template_bgr,
+                                           threshold=threshold)
+            if result is not None and result[1] >= threshold:
+                store.update(key, result[0], score=result[1], source="features")
+                print(f"✅ 特征估计已验证: scale_factor={result[0]:.5f}，已写入 JSON")
+                return result[0]
 
-    # 若未找到，提示用户手动输入
+    if not interactive:
+        print(f"❌ 未找到 `{key}` 的 scale_factor，且无法自动估计")
+        return None
+
+    # 若无任何记录，提示用户手动输入
     print(f"⚠️ 未找到 `{key}` 的 scale_factor，请手动输入:")
     user_input = input("请输入 scale_factor(非0): ").strip()
     if not user_input:
         return None
     scale_value = float(user_input)
     if scale_value != 0:
-        scale_factors[key] = scale_value
-        save_scale_factors(scale_factors)
+        store.update(key, scale_value, source="manual")
         return scale_value
     else:
         return None
 
 
-def add_scale_factors(key, scale_factor):
+def sample_frames(cap, start=None, end=None, count=8):
+    """
+    从 cap 的 [start, end] 范围内(end 为 None 时到视频结尾)均匀取 count 帧，第一帧即范围首帧，
+    返回 [(frame_idx, frame)]。读取后把 cap 重新定位到开头，不影响之后从头开始的扫描。
+    """
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30
+    first = parse_position(start, fps) or 1
+    last = parse_position(end, fps)
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    if frame_count > 0:
+        last = frame_count if last is None else min(last, frame_count)
+    if last is None or last <= first:
+        positions = [first]
+    else:
+        positions = sorted(
+            set(np.linspace(first, last, count).round().astype(int)))
+    samples = []
+    for idx in positions:
+        for frame_idx, frame in iter_video_frames(cap, int(idx), int(idx)):
+            samples.append((frame_idx, frame))
+    if not hasattr(cap, "iter_frames"):
+        cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+    return samples
+
+
+def verify_scale_on_frames(frames, template_bgr, predicted, threshold=0.7):
+    """
+    在 frames(若干 (frame_idx, frame)) 上验证预测的 scale_factor：逐帧在预测值附近(含预测值本身)
+    做一次 refine_scale_factor 小范围扫描，任一帧的最优匹配值 >= threshold 即通过，
+    返回 (该帧上的最优 scale_factor, 匹配值, frame_idx)；都未通过(如采样帧中没有图标)返回 None。
+    """
+    for frame_idx, frame in frames:
+        scale, val = refine_scale_factor(frame, template_bgr, predicted)
+        if val >= threshold:
+            return scale, val, frame_idx
+    return None
+
+
+def get_video_scale_factor(cap,
+                           template_bgr,
+                           start=None,
+                           end=None,
+                           threshold=0.7,
+                           samples=8,
+                           interactive=True):
+    """
+    视频扫描前使用的 get_scale_factor：分辨率已记录时直接返回；
+    否则从扫描范围 [start, end] 的首帧起均匀取 samples 帧(见 sample_frames)，
+    在这些帧上验证预测值(或用特征点估计)后再使用。cap 的读取位置会被重置到开头。
+    """
+    video_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    video_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    _, basis = lookup_scale_factor(video_width, video_height)
+    frames = None
+    if basis != "stored" and template_bgr is not None:
+        frames = sample_frames(cap, start, end, count=samples)
+    return get_scale_factor(video_width,
+                            video_height,
+                            template_bgr=template_bgr,
+                            threshold=threshold,
+                            frames=frames,
+                            interactive=interactive)
+
+
+def add_scale_factors(key, scale_factor, score=None, source=None):
     """
     手动添加或更新某个分辨率key对应的scale_factor，并写入JSON。
-    key 例: "1280x720"
+    key 例: "1280x720"；score/source 记录标定匹配值与来源(可选)。
     """
-    data = load_scale_factors()
-    data[key] = scale_factor
-    save_scale_factors(data)
+    get_scale_store().update(key, scale_factor, score=score, source=source)
+
+
+def refine_scale_factor(frame,
+                        template_bgr,
+                        center,
+                        span=0.02,
+                        steps=9):
+    """
+    在 center 附近 [center - span, center + span] 内均匀取 steps 个 scale_factor，
+    对 frame(BGR 或灰度) 做带红色 mask 的模板匹配，返回 (最优 scale_factor, 匹配值)。
+    用于快速验证预测值，代价远小于完整标定。
+    """
+    if frame.ndim == 3:
+        gray_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    else:
+        gray_frame = frame
+
+    best_scale, best_val = center, -1.0
+    for scale_factor in np.linspace(center - span, center + span, steps):
+        new_w = int(template_bgr.shape[1] * scale_factor)
+        new_h = int(template_bgr.shape[0] * scale_factor)
+        if new_w <= 1 or new_h <= 1:
+            continue
+        if new_w > gray_frame.shape[1] or new_h > gray_frame.shape[0]:
+            continue
+        template_scaled = cv2.resize(template_bgr, (new_w, new_h),
+                                     interpolation=cv2.INTER_AREA)
+        gray_template = cv2.cvtColor(template_scaled, cv2.COLOR_BGR2GRAY)
+        mask = create_red_mask(template_scaled)
+        result = cv2.matchTemplate(gray_frame,
+                                   gray_template,
+                                   cv2.TM_CCOEFF_NORMED,
+                                   mask=mask)
+        _, max_val, _, _ = cv2.minMaxLoc(result)
+        if np.isinf(max_val) or np.isnan(max_val):
+            continue
+        if max_val > best_val:
+            best_scale, best_val = float(scale_factor), max_val
+    return best_scale, best_val
 
 
 def create_red_mask(template_bgr):
@@ -91,11 +281,143 @@ def create_red_mask(template_bgr):
     return mask
 
 
+def _ramp_lut(x0, x1):
+    """ 生成 0..255 的线性斜坡查找表：x<=x0 为0，x>=x1 为255 """
+    x = np.arange(256, dtype=np.float32)
+    return np.clip((x - x0) / (x1 - x0) * 255, 0, 255).astype(np.uint8)
+
+
+# 红色似然的查找表，核心区间与 create_red_mask 一致(H<=10 或 H>=170，S/V>=70)，
+# 边缘做线性过渡，避免二值 mask 的硬边界
+_hue = np.arange(256)
+_hue_dist = np.minimum(_hue, np.abs(180 - _hue))
+_RED_HUE_LUT = np.clip((20 - _hue_dist) / 10 * 255, 0, 255).astype(np.uint8)
+_RED_SAT_LUT = _ramp_lut(40, 70)
+_RED_VAL_LUT = _ramp_lut(40, 70)
+
+
+def create_red_likelihood(image_bgr):
+    """
+    将BGR图像转换为单通道的"红色似然"图(uint8，0~255)。
+    判定依据与 create_red_mask 相同(HSV 红色区间)，但输出连续值，
+    帧和模板都转换后可直接做不带 mask 的 cv2.matchTemplate。
+    """
+    hsv = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2HSV)
+    h, s, v = cv2.split(hsv)
+    likelihood = cv2.multiply(cv2.LUT(h, _RED_HUE_LUT),
+                              cv2.LUT(s, _RED_SAT_LUT),
+                              scale=1 / 255)
+    return cv2.multiply(likelihood, cv2.LUT(v, _RED_VAL_LUT), scale=1 / 255)
+
+
+def parse_position(value, fps):
+    """
+    将起止位置解析为帧号(与各处理循环一致，从 1 开始计数)。
+    - int 或纯数字字符串: 视为帧号，例 10000 / "10000"
+    - float: 视为秒数，例 7170.5
+    - 时间戳字符串: "HH:MM:SS(.ms)"、"MM:SS" 或 "7170.5s"
+    None 原样返回，表示不限制。
+    """
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        raise ValueError(f"无效的位置参数: {value!r}")
+    if isinstance(value, int):
+        return max(1, value)
+    if isinstance(value, float):
+        seconds = value
+    else:
+        text = str(value).strip()
+        if text.isdigit():
+            return max(1, int(text))
+        if text.endswith("s"):
+            seconds = float(text[:-1])
+        elif ":" in text:
+            seconds = 0.0
+            for part in text.split(":"):
+                seconds = seconds * 60 + float(part)
+        else:
+            raise ValueError(f"无效的位置参数: {value!r}")
+    if seconds < 0:
+        raise ValueError(f"位置不能为负: {value!r}")
+    # 第 1 帧对应 0 秒
+    return int(round(seconds * fps)) + 1
+
+
+def seek_to_frame(cap, frame_idx):
+    """
+    将 cap 定位到第 frame_idx 帧之前(从 1 开始计数)，下一次 read() 即返回该帧。
+    先按关键帧快速跳转，再用 grab() 向前解码到精确位置，
+    避免逐帧解码并丢弃前面的全部画面。
+    返回已消耗的最后一帧帧号(即 frame_idx - 1)，可直接作为循环计数的初值。
+    """
+    target = max(0, frame_idx - 1)
+    if target == 0:
+        return 0
+
+    # 关键帧跳转；部分容器/后端会落在目标之后或不支持跳转，此时退回开头
+    cap.set(cv2.CAP_PROP_POS_FRAMES, target)
+    pos = int(cap.get(cv2.CAP_PROP_POS_FRAMES))
+    if pos < 0 or pos > target:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+        pos = 0
+
+    # 短距离向前解码到精确帧
+    while pos < target:
+        if not cap.grab():
+            break
+        pos += 1
+    return pos
+
+
+def iter_video_frames(cap, start=None, end=None, stride=1):
+    """
+    按 [start, end] 范围(含两端，帧号从 1 开始)迭代视频帧，产出 (frame_idx, frame)。
+    仅 frame_idx % stride == 0 的帧会被完整解码返回，其余帧只 grab() 不转换。
+    start/end 可为帧号或时间戳，见 parse_position。
+    cap 也可以是 frame_cache.FrameCache，此时直接从缓存读取。
+    """
+    if hasattr(cap, "iter_frames"):
+        yield from cap.iter_frames(start, end, stride)
+        return
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30
+    start_frame = parse_position(start, fps) or 1
+    end_frame = parse_position(end, fps)
+
+    frame_idx = seek_to_frame(cap, start_frame)
+    while end_frame is None or frame_idx < end_frame:
+        frame_idx += 1
+        if frame_idx % stride != 0:
+            if not cap.grab():
+                break
+            continue
+        ret, frame = cap.read()
+        if not ret:
+            break
+        yield frame_idx, frame
+
+
+def partial_hash(path, chunk_size=1 << 20):
+    """ 文件大小 + 开头/中间/结尾各 chunk_size 字节的 SHA-1，读取量与文件大小无关 """
+    size = os.path.getsize(path)
+    h = hashlib.sha1(str(size).encode())
+    with open(path, "rb") as f:
+        for offset in sorted({0, max(0, size // 2 - chunk_size // 2),
+                              max(0, size - chunk_size)}):
+            f.seek(offset)
+            h.update(f.read(chunk_size))
+    return h.hexdigest()
+
+
 def end():
     """
     结束时的清理工作：关闭日志文件。
     """
-    f.close()
+    global _log_file
+    if _log_file is not None:
+        _log_file.close()
+        _log_file = None
     sys.stdout = sys.__stdout__
     print("Done.")
-    print("处理完成，日志文件:", log_filename)
+    if log_filename:
+        print("处理完成，日志文件:", log_filename)
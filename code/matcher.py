@@ -0,0 +1,427 @@
+# matcher.py
+import time
+import cv2
+import numpy as np
+from lib import create_red_mask, create_red_likelihood, iter_video_frames
+from config import MATCH_MODES
+
+
+def load_template(template_path):
+    """ 读取模板图像并去掉 Alpha 通道，返回 BGR 图；读取失败返回 None """
+    template_rgba = cv2.imread(template_path, cv2.IMREAD_UNCHANGED)
+    if template_rgba is None:
+        return None
+    if template_rgba.ndim == 3 and template_rgba.shape[2] == 4:
+        b, g, r, a = cv2.split(template_rgba)
+        return cv2.merge([b, g, r])
+    return template_rgba
+
+
+def scale_template(template_bgr, scale_factor):
+    """ 按 scale_factor 缩放模板，1.0 时原样返回 """
+    if scale_factor == 1.0:
+        return template_bgr
+    new_w = int(template_bgr.shape[1] * scale_factor)
+    new_h = int(template_bgr.shape[0] * scale_factor)
+    return cv2.resize(template_bgr, (new_w, new_h),
+                      interpolation=cv2.INTER_AREA)
+
+
+class TemplateMatcher:
+    """
+    封装一种匹配模式下的模板预处理与单帧匹配。
+    模板(已缩放)只在构造时处理一次；match() 对每帧做同样的预处理后匹配。
+    downscale < 1 时每帧先缩小到 downscale 倍再匹配(template_bgr 应已按 scale_factor * downscale 缩放)，
+    返回的位置与 t_w/t_h 仍按原分辨率计，调用方无需换算。
+    """
+
+    def __init__(self, template_bgr, mode="masked_gray", downscale=1.0):
+        if mode not in MATCH_MODES:
+            raise ValueError(f"未知的匹配模式: {mode}，可选: {MATCH_MODES}")
+        self.mode = mode
+        if mode == "masked_gray":
+            self.template = cv2.cvtColor(template_bgr, cv2.COLOR_BGR2GRAY)
+            self.mask = create_red_mask(template_bgr)
+        else:
+            self.template = create_red_likelihood(template_bgr)
+            self.mask = None
+        self.downscale = downscale
+        self.t_h, self.t_w = self.template.shape[:2]
+        if downscale != 1.0:
+            self.t_w = int(np.ceil(self.t_w / downscale))
+            self.t_h = int(np.ceil(self.t_h / downscale))
+        self._batch = None
+
+    def _full_loc(self, loc):
+        """ 缩小后图像上的位置 -> 原分辨率位置 """
+        if self.downscale == 1.0:
+            return loc
+        return (int(round(loc[0] / self.downscale)),
+                int(round(loc[1] / self.downscale)))
+
+    def prepare(self, frame_bgr):
+        """ 将 BGR 帧转换为当前模式下参与匹配的单通道图；已是灰度图(如帧缓存)时原样返回 """
+        if self.downscale != 1.0:
+            h, w = frame_bgr.shape[:2]
+            frame_bgr = cv2.resize(frame_bgr,
+                                   (max(1, int(round(w * self.downscale))),
+                                    max(1, int(round(h * self.downscale)))),
+                                   interpolation=cv2.INTER_AREA)
+        if frame_bgr.ndim == 2:
+            if self.mode != "masked_gray":
+                raise ValueError(f"{self.mode} 模式需要彩色帧，灰度帧只能用于 masked_gray")
+            return frame_bgr
+        if self.mode == "masked_gray":
+            return cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2GRAY)
+        return create_red_likelihood(frame_bgr)
+
+    def _match_raw(self, image):
+        """ match_prepared 的匹配部分，位置为 image(可能已缩小)上的坐标 """
+        if (image.shape[0] < self.template.shape[0]
+                or image.shape[1] < self.template.shape[1]):
+            return -1.0, (0, 0)
+        if self.mask is not None:
+            result = cv2.matchTemplate(image,
+                                       self.template,
+                                       cv2.TM_CCOEFF_NORMED,
+                                       mask=self.mask)
+        else:
+            result = cv2.matchTemplate(image, self.template,
+                                       cv2.TM_CCOEFF_NORMED)
+        _, max_val, _, max_loc = cv2.minMaxLoc(result)
+        if np.isinf(max_val) or np.isnan(max_val):
+            return -1.0, max_loc
+        return max_val, max_loc
+
+    def match_prepared(self, image):
+        """
+        在已预处理的单通道图上匹配，返回 (max_val, max_loc)。
+        结果为 inf/nan(如 mask 区域方差为0)时返回 (-1.0, max_loc)，视为未匹配。
+        """
+        max_val, max_loc = self._match_raw(image)
+        return max_val, self._full_loc(max_loc)
+
+    def match_region(self, image, region):
+        """
+        只在已预处理的图 image 中 region=(x, y, w, h)(原分辨率坐标，相对 image 左上角)内匹配，
+        返回 (max_val, 相对 image 的原分辨率位置)。
+        downscale < 1 时区域向外对齐到缩小后的像素网格再截取，各位置的匹配值与在整幅 image 上
+        匹配时完全相同；不能先截取原分辨率区域再单独缩小，那样像素网格与整幅缩小时不一致。
+        """
+        x, y, w, h = region
+        d = self.downscale
+        x0, y0 = int(np.floor(x * d)), int(np.floor(y * d))
+        x1 = min(image.shape[1], int(np.ceil((x + w) * d)))
+        y1 = min(image.shape[0], int(np.ceil((y + h) * d)))
+        max_val, (lx, ly) = self._match_raw(image[y0:y1, x0:x1])
+        return max_val, self._full_loc((lx + x0, ly + y0))
+
+    def match(self, frame_bgr):
+        """ 对一帧 BGR 图做匹配，返回 (max_val, max_loc) """
+        return self.match_prepared(self.prepare(frame_bgr))
+
+    def batch_correlator(self):
+        """ 本模板的 BatchCorrelator(首次调用时创建) """
+        if self._batch is None:
+            self._batch = BatchCorrelator(self.template, self.mask)
+        return self._batch
+
+    def match_batch(self, images):
+        """ 对一批已预处理、同尺寸的单通道图 (K, H, W) 做向量化匹配，返回 [(max_val, max_loc)] """
+        return [(max_val, self._full_loc(loc))
+                for max_val, loc in self.batch_correlator().match(images)]
+
+
+def next_fast_len(n):
+    """ 不小于 n 的最小 2^a * 3^b * 5^c，作为 FFT 尺寸以加速 """
+    best = 1 << max(0, (n - 1).bit_length())
+    p5 = 1
+    while p5 < best:
+        p35 = p5
+        while p35 < best:
+            p = p35
+            while p < n:
+                p *= 2
+            best = min(best, p)
+            p35 *= 3
+        p5 *= 5
+    return best
+
+
+class BatchCorrelator:
+    """
+    对一批同尺寸的单通道 ROI (K, H, W) 一次性计算 TM_CCOEFF_NORMED，
+    结果与 cv2.matchTemplate 一致(含 mask 时按 OpenCV 的 mask 定义)。
+    模板相关的 FFT 只在首次遇到某个 ROI 尺寸时计算并缓存。
+    """
+
+    def __init__(self, template, mask=None):
+        t = template.astype(np.float64)
+        self.t_h, self.t_w = t.shape
+        if mask is None:
+            self.mask = None
+            weights = np.ones_like(t)
+        else:
+            self.mask = (mask > 0).astype(np.float64)
+            weights = self.mask
+        self.n = weights.sum()
+        mean_t = (weights * t).sum() / self.n
+        self.t_centered = weights * (t - mean_t)
+        self.t_norm2 = (self.t_centered**2).sum()
+        self._cache = {}
+
+    def warm(self, shape):
+        """ 预先计算某 ROI 尺寸 (H, W) 的模板 FFT，避免计入首次匹配的耗时 """
+        self._kernels(tuple(shape))
+
+    def _kernels(self, shape):
+        if shape not in self._cache:
+            fft_shape = (next_fast_len(shape[0]), next_fast_len(shape[1]))
+            k_t = np.conj(np.fft.rfft2(self.t_centered, s=fft_shape))
+            k_m = None
+            if self.mask is not None:
+                k_m = np.conj(np.fft.rfft2(self.mask, s=fft_shape))
+            self._cache[shape] = (fft_shape, k_t, k_m)
+        return self._cache[shape]
+
+    def _box_sum(self, stack):
+        """ 无 mask 时用积分图求每个窗口内的和 """
+        integral = np.pad(stack.cumsum(axis=1).cumsum(axis=2),
+                          ((0, 0), (1, 0), (1, 0)))
+        h, w = self.t_h, self.t_w
+        return (integral[:, h:, w:] - integral[:, :-h, w:] -
+                integral[:, h:, :-w] + integral[:, :-h, :-w])
+
+    def correlate(self, stack):
+        """ stack: (K, H, W)，返回 (K, H - t_h + 1, W - t_w + 1) 的相关系数图 """
+        stack = np.asarray(stack, dtype=np.float64)
+        _, height, width = stack.shape
+        out_h, out_w = height - self.t_h + 1, width - self.t_w + 1
+        if out_h <= 0 or out_w <= 0:
+            raise ValueError("ROI 尺寸小于模板尺寸")
+        fft_shape, k_t, k_m = self._kernels((height, width))
+
+        def corr(spectrum, kernel):
+            full = np.fft.irfft2(spectrum * kernel, s=fft_shape)
+            return full[:, :out_h, :out_w]
+
+        f_img = np.fft.rfft2(stack, s=fft_shape)
+        numerator = corr(f_img, k_t)
+        if k_m is None:
+            s1 = self._box_sum(stack)
+            s2 = self._box_sum(stack * stack)
+        else:
+            s1 = corr(f_img, k_m)
+            s2 = corr(np.fft.rfft2(stack * stack, s=fft_shape), k_m)
+        variance = np.maximum(s2 - s1 * s1 / self.n, 0.0)
+        denominator = np.sqrt(variance * self.t_norm2)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            result = np.where(denominator > 1e-6, numerator / denominator,
+                              0.0)
+        return result
+
+    def match(self, stack):
+        """ 返回每个 ROI 的 (max_val, max_loc)，max_loc 为 ROI 内坐标 (x, y) """
+        result = self.correlate(stack)
+        flat = result.reshape(result.shape[0], -1)
+        best = flat.argmax(axis=1)
+        out_w = result.shape[2]
+        return [(float(flat[k, idx]), (int(idx % out_w), int(idx // out_w)))
+                for k, idx in enumerate(best)]
+
+
+def clip_roi(roi, frame_width, frame_height):
+    """ 将 (x, y, w, h) 限制在画面范围内 """
+    x, y, w, h = (int(v) for v in roi)
+    x = min(max(0, x), frame_width - 1)
+    y = min(max(0, y), frame_height - 1)
+    w = min(w, frame_width - x)
+    h = min(h, frame_height - y)
+    return x, y, w, h
+
+
+def frame_region(cap):
+    """
+    cap 产出的帧在整帧中的区域 (x, y, w, h)：通常是整帧；
+    只缓存了裁剪区域的 frame_cache.FrameCache 为其 crop
+    """
+    crop = getattr(cap, "crop", None)
+    if crop is not None:
+        return tuple(crop)
+    return (0, 0, int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+
+
+def track_window(loc, template_w, template_h, margin, bounds):
+    """
+    上一次命中位置 loc 周围的搜索窗口 (x, y, w, h)：模板大小向四周各扩 margin 像素，
+    并限制在 bounds=(x, y, w, h) 之内
+    """
+    bx, by, bw, bh = bounds
+    x0 = max(bx, loc[0] - margin)
+    y0 = max(by, loc[1] - margin)
+    x1 = min(bx + bw, loc[0] + template_w + margin)
+    y1 = min(by + bh, loc[1] + template_h + margin)
+    return x0, y0, x1 - x0, y1 - y0
+
+
+def _scan_tracking(frames, matcher, bounds, threshold, track_margin):
+    """
+    跟踪模式：有上一次命中位置时先只在其附近的小窗口内匹配；
+    窗口内匹配值低于 threshold(或窗口放不下模板)时退回到 bounds(ROI 或整帧)内完整搜索。
+    窗口内某位置的匹配值只取决于该位置下的像素，与完整搜索时相同，
+    因此窗口内 >= threshold 即完整搜索也 >= threshold，命中帧集合与完整搜索一致。
+    downscale < 1 时先把整个 bounds 缩小一次，窗口在缩小后的图上截取(见 TemplateMatcher.match_region)，
+    保证窗口与完整搜索使用同一像素网格；完整搜索时直接复用这幅图。
+    """
+    bx, by, bw, bh = bounds
+    last_loc = None
+    for frame_idx, frame in frames:
+        region = frame[by:by + bh, bx:bx + bw]
+        prepared = None
+        if matcher.downscale != 1.0:
+            prepared = matcher.prepare(region)
+        if last_loc is not None:
+            x, y, w, h = track_window(last_loc, matcher.t_w, matcher.t_h,
+                                      track_margin, bounds)
+            if w >= matcher.t_w and h >= matcher.t_h:
+                if prepared is None:
+                    max_val, loc = matcher.match(frame[y:y + h, x:x + w])
+                    loc = (loc[0] + x, loc[1] + y)
+                else:
+                    max_val, loc = matcher.match_region(
+                        prepared, (x - bx, y - by, w, h))
+                    loc = (loc[0] + bx, loc[1] + by)
+                if max_val >= threshold:
+                    last_loc = loc
+                    yield frame_idx, frame, max_val, last_loc
+                    continue
+        if prepared is None:
+            max_val, loc = matcher.match(region)
+        else:
+            max_val, loc = matcher.match_prepared(prepared)
+        loc = (loc[0] + bx, loc[1] + by)
+        last_loc = loc if max_val >= threshold else None
+        yield frame_idx, frame, max_val, loc
+
+
+def scan_capture(cap,
+                 matcher,
+                 start=None,
+                 end=None,
+                 stride=1,
+                 roi=None,
+                 batch_size=16,
+                 batch_backend="auto",
+                 verbose=True,
+                 threshold=None,
+                 track_margin=None):
+    """
+    在 cap 的 [start, end] 范围内每 stride 帧匹配一次，产出 (frame_idx, frame, max_val, max_loc)，
+    max_loc 为整帧坐标。
+    roi=(x, y, w, h) 时只在该区域内搜索，并累积 batch_size 帧的 ROI 组成 (K, H, W) 数组批量匹配：
+    - batch_backend="numpy": 用 BatchCorrelator 一次向量化 FFT 计算整批
+    - batch_backend="opencv": 逐个 ROI 调用 cv2.matchTemplate
+    - batch_backend="auto": 第一批的前一半用 numpy、后一半用 OpenCV，按每帧耗时比较，之后固定使用较快者
+      (两半的结果直接作为该批的结果，每帧只匹配一次)
+      (小模板/小 ROI 时逐次调用开销占主导，批量更快；大模板时 OpenCV 的 DFT 实现更快)
+    verbose=False 时不打印 auto 的选择结果。
+    track_margin 与 threshold 都给定时使用跟踪模式(见 _scan_tracking)，逐帧匹配、不做批量：
+    命中后的后续帧只在上次位置附近 track_margin 像素内搜索，连续命中时每帧开销接近于零。
+    cap 可为 frame_cache.FrameCache；缓存只含裁剪区域时 roi 与 max_loc 仍是整帧坐标。
+    """
+    frames = iter_video_frames(cap, start, end, stride=stride)
+    ox, oy, frame_width, frame_height = frame_region(cap)
+    if (ox, oy) == (0, 0):
+        yield from scan_frames(frames, matcher, frame_width, frame_height, roi,
+                               batch_size, batch_backend, verbose, threshold,
+                               track_margin)
+        return
+    # 帧只是画面的一部分(裁剪过的帧缓存)：ROI 换算到帧内坐标，结果再换算回整帧坐标
+    if roi is not None:
+        x0, y0 = max(roi[0], ox), max(roi[1], oy)
+        x1 = min(roi[0] + roi[2], ox + frame_width)
+        y1 = min(roi[1] + roi[3], oy + frame_height)
+        if x1 <= x0 or y1 <= y0:
+            raise ValueError(f"ROI {roi} 不在帧缓存的裁剪区域 {(ox, oy, frame_width, frame_height)} 内")
+        roi = (x0 - ox, y0 - oy, x1 - x0, y1 - y0)
+    for frame_idx, frame, max_val, loc in scan_frames(
+            frames, matcher, frame_width, frame_height, roi, batch_size,
+            batch_backend, verbose, threshold, track_margin):
+        yield frame_idx, frame, max_val, (loc[0] + ox, loc[1] + oy)
+
+
+def scan_frames(frames,
+                matcher,
+                frame_width,
+                frame_height,
+                roi=None,
+                batch_size=16,
+                batch_backend="auto",
+                verbose=True,
+                threshold=None,
+                track_margin=None):
+    """
+    scan_capture 的匹配部分，参数含义相同：frames 为任意 (frame_idx, frame) 序列，
+    帧尺寸 frame_width x frame_height。不经过 OpenCV 读帧的调用方(如 stream_cut)直接使用。
+    ROI 批量模式下结果最多比输入晚 batch_size 帧产出。
+    """
+    if track_margin is not None and threshold is not None:
+        bounds = (0, 0, frame_width, frame_height)
+        if roi is not None:
+            bounds = clip_roi(roi, frame_width, frame_height)
+        yield from _scan_tracking(frames, matcher, bounds, threshold,
+                                  track_margin)
+        return
+    if roi is None:
+        for frame_idx, frame in frames:
+            max_val, max_loc = matcher.match(frame)
+            yield frame_idx, frame, max_val, max_loc
+        return
+
+    x, y, w, h = clip_roi(roi, frame_width, frame_height)
+    if w < matcher.t_w or h < matcher.t_h:
+        raise ValueError(f"ROI {roi} 小于模板尺寸 {matcher.t_w}x{matcher.t_h}")
+
+    backend = batch_backend
+
+    def match_stack(stack):
+        nonlocal backend
+        if backend == "numpy":
+            return matcher.match_batch(stack)
+        if backend == "opencv":
+            return [matcher.match_prepared(img) for img in stack]
+        # auto: 不足两帧时无法比较，先用 OpenCV，留到下一批再比较
+        if len(stack) < 2:
+            return [matcher.match_prepared(img) for img in stack]
+        # 前一半 numpy、后一半 OpenCV，各自计时；结果直接拼成该批的结果
+        half = len(stack) // 2
+        matcher.batch_correlator().warm(stack.shape[1:])  # 模板 FFT 不计入计时
+        t0 = time.perf_counter()
+        results = matcher.match_batch(stack[:half])
+        t1 = time.perf_counter()
+        results += [matcher.match_prepared(img) for img in stack[half:]]
+        t2 = time.perf_counter()
+        numpy_ms = (t1 - t0) / half * 1000
+        opencv_ms = (t2 - t1) / (len(stack) - half) * 1000
+        backend = "numpy" if numpy_ms < opencv_ms else "opencv"
+        if verbose:
+            print(f"[INFO] ROI 批量匹配: numpy {numpy_ms:.2f}ms/帧 ({half} 帧一批), "
+                  f"opencv {opencv_ms:.2f}ms/帧，使用 {backend}")
+        return results
+
+    def flush(batch):
+        stack = np.stack(
+            [matcher.prepare(frame[y:y + h, x:x + w]) for _, frame in batch])
+        for (frame_idx, frame), (max_val, loc) in zip(batch,
+                                                      match_stack(stack)):
+            yield frame_idx, frame, max_val, (loc[0] + x, loc[1] + y)
+
+    batch = []
+    for frame_idx, frame in frames:
+        batch.append((frame_idx, frame))
+        if len(batch) >= max(1, batch_size):
+            yield from flush(batch)
+            batch = []
+    if batch:
+        yield from flush(batch)
@@ -0,0 +1,194 @@
+# metrics.py
+"""
+长时间扫描的实时进度与指标。
+处理循环只更新 METRICS 上的几个数值(每帧一次赋值，每秒最多一次计算速度)，开销可忽略；
+start_metrics_server() 在后台线程里提供本机 HTTP 接口：
+    GET /metrics       Prometheus 文本格式
+    GET /metrics.json  JSON
+"""
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def current_rss():
+    """ 当前进程常驻内存(字节)；无法获取时返回 None """
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        # Linux 下 ru_maxrss 单位为 KB(峰值，近似值)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    except ImportError:
+        return None
+
+
+class Metrics:
+    """
+    进度指标。帧号均为视频内的位置(从 1 开始)，已处理帧数按位置计算，
+    因此与 stride 无关；fps 为每秒推进的视频帧数。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.video = None
+        self.first_frame = 1
+        self.last_frame = None
+        self.position = 0
+        self.hits = 0
+        self.videos_done = 0
+        self.ffmpeg_jobs = 0
+        self.queue_depths = {}
+        self.fps = 0.0
+        self.started = time.monotonic()
+        self._rate_t = self.started
+        self._rate_pos = 0
+
+    def start_video(self, video, first_frame=1, last_frame=None):
+        """ 开始扫描一个视频的 [first_frame, last_frame] 范围 """
+        self.video = video
+        self.first_frame = first_frame or 1
+        self.last_frame = last_frame
+        self.position = self.first_frame - 1
+        self.fps = 0.0
+        self._rate_t = time.monotonic()
+        self._rate_pos = self.position
+
+    def frame(self, frame_idx):
+        """ 处理到第 frame_idx 帧；每秒最多更新一次 fps """
+        self.position = frame_idx
+        now = time.monotonic()
+        elapsed = now - self._rate_t
+        if elapsed >= 1.0:
+            rate = (frame_idx - self._rate_pos) / elapsed
+            # 指数平滑，避免 fps/ETA 剧烈跳动
+            self.fps = rate if self.fps == 0 else 0.7 * self.fps + 0.3 * rate
+            self._rate_t, self._rate_pos = now, frame_idx
+
+    def hit(self):
+        self.hits += 1
+
+    def finish_video(self):
+        self.videos_done += 1
+
+    @contextmanager
+    def ffmpeg_job(self):
+        """ 包住一次 FFmpeg 调用，统计正在运行的任务数 """
+        with self._lock:
+            self.ffmpeg_jobs += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.ffmpeg_jobs -= 1
+
+    def set_queue_depths(self, depths):
+        """ depths: {"pending": n, "running": n, ...} """
+        self.queue_depths = dict(depths)
+
+    def snapshot(self):
+        processed = max(0, self.position - self.first_frame + 1)
+        total = None
+        if self.last_frame is not None:
+            total = max(0, self.last_frame - self.first_frame + 1)
+        eta = None
+        if total is not None and self.fps > 0:
+            eta = max(0, total - processed) / self.fps
+        return {
+            "video": self.video,
+            "frame": self.position,
+            "frames_processed": processed,
+            "frames_total": total,
+            "progress": processed / total if total else None,
+            "fps": round(self.fps, 2),
+            "eta_seconds": round(eta, 1) if eta is not None else None,
+            "hits": self.hits,
+            "videos_done": self.videos_done,
+            "ffmpeg_jobs_in_flight": self.ffmpeg_jobs,
+            "queue_depths": dict(self.queue_depths),
+            "rss_bytes": current_rss(),
+            "uptime_seconds": round(time.monotonic() - self.started, 1),
+        }
+
+    def prometheus(self):
+        """ Prometheus 文本格式 """
+        snap = self.snapshot()
+        lines = []
+
+        def metric(name, kind, value, help_text, labels=None):
+            if value is None:
+                return
+            lines.append(f"# HELP id5clips_{name} {help_text}")
+            lines.append(f"# TYPE id5clips_{name} {kind}")
+            if labels is None:
+                lines.append(f"id5clips_{name} {value}")
+            else:
+                for label, v in labels:
+                    lines.append(f"id5clips_{name}{{{label}}} {v}")
+
+        metric("frames_processed", "gauge", snap["frames_processed"],
+               "Frames scanned in the current video")
+        metric("frames_total", "gauge", snap["frames_total"],
+               "Frames in the current scan range")
+        metric("fps", "gauge", snap["fps"], "Video frames scanned per second")
+        metric("eta_seconds", "gauge", snap["eta_seconds"],
+               "Estimated seconds until the current video is done")
+        metric("hits_total", "counter", snap["hits"], "Frames above threshold")
+        metric("videos_done_total", "counter", snap["videos_done"],
+               "Videos finished")
+        metric("ffmpeg_jobs_in_flight", "gauge", snap["ffmpeg_jobs_in_flight"],
+               "FFmpeg processes currently running")
+        if snap["queue_depths"]:
+            metric("queue_jobs", "gauge", 0, "Spool queue jobs by state",
+                   labels=[(f'state="{k}"', v)
+                           for k, v in sorted(snap["queue_depths"].items())])
+        metric("rss_bytes", "gauge", snap["rss_bytes"], "Resident set size")
+        metric("uptime_seconds", "gauge", snap["uptime_seconds"],
+               "Seconds since the process started")
+        return "\n".join(lines) + "\n"
+
+
+# 进程内共享的指标实例，各处理循环直接更新它
+METRICS = Metrics()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        if path == "/metrics":
+            body = METRICS.prometheus().encode("utf-8")
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        elif path in ("/metrics.json", "/json"):
+            body = json.dumps(METRICS.snapshot(), ensure_ascii=False).encode("utf-8")
+            content_type = "application/json; charset=utf-8"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # 不把每次抓取写进 stdout(stdout 可能已重定向到日志文件)
+        pass
+
+
+def start_metrics_server(port=9108, host="127.0.0.1"):
+    """ 在后台守护线程中启动指标 HTTP 服务，返回 server(可调用 shutdown())；port=0 时自动选端口 """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
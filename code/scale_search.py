@@ -0,0 +1,239 @@
+# scale_search.py
+"""
+在一段视频帧上搜索最优 scale_factor(视频标定)：
+
+- exhaustive_scale_search: 全部候选 scale_factor × 全部帧，即 find_scale.process_video 的做法
+- halving_scale_search: 逐次减半(successive halving)剪枝，结果与穷举一致，
+  matchTemplate 调用次数只是其一小部分
+
+两者的选优规则相同：取"各帧最大匹配值"最大的 scale_factor，相同时取候选列表中靠前者；
+出现帧取最早达到该值的一帧。帧只保存灰度图，内存占用为 BGR 的 1/3。
+"""
+import cv2
+import numpy as np
+from collections import namedtuple
+from lib import create_red_mask, iter_video_frames
+
+# scale_factor/score/frame_idx: 网格上的最优值；refined_*: 在其相邻网格之间细分后的结果；
+# calls: matchTemplate 调用次数；hits: 最优 scale_factor 下 >= threshold 的 [(帧号, 匹配值)]
+ScaleSearchResult = namedtuple("ScaleSearchResult", [
+    "scale_factor", "score", "frame_idx", "refined_scale_factor",
+    "refined_score", "calls", "hits"
+])
+
+
+def load_gray_frames(video_path, start=None, end=None, frame_cache=None):
+    """
+    读取 [start, end] 内全部帧的灰度图(帧号从 1 开始，end 为 None 时读到结尾)，
+    返回 (首帧帧号, 帧列表)。frame_cache 为目录时改用该目录下的解码帧缓存
+    (首次使用时建立，帧为内存映射的灰度图)。失败时抛出 IOError/ValueError。
+    """
+    if frame_cache is not None:
+        from frame_cache import open_frame_cache
+        cache = open_frame_cache(video_path, frame_cache, start=start, end=end)
+        return cache.first_frame, cache.frames
+
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise IOError(f"无法打开视频: {video_path}")
+    first_frame = None
+    frames = []
+    try:
+        for frame_idx, frame in iter_video_frames(cap, start, end):
+            if first_frame is None:
+                first_frame = frame_idx
+            frames.append(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY))
+    finally:
+        cap.release()
+    if first_frame is None:
+        raise ValueError(f"范围 [{start}, {end}] 内没有可读取的帧: {video_path}")
+    return first_frame, frames
+
+
+class _Scorer:
+    """ 缓存 (scale_factor, 帧位置) -> 匹配值，已算过的不重复计算，并统计 matchTemplate 调用次数 """
+
+    def __init__(self, frames, template_bgr):
+        self.frames = frames
+        self.template_bgr = template_bgr
+        self.templates = {}
+        self.scores = {}
+        self.calls = 0
+
+    def score(self, scale_factor, positions):
+        if scale_factor not in self.templates:
+            new_w = int(self.template_bgr.shape[1] * scale_factor)
+            new_h = int(self.template_bgr.shape[0] * scale_factor)
+            template_scaled = cv2.resize(self.template_bgr, (new_w, new_h),
+                                         interpolation=cv2.INTER_AREA)
+            self.templates[scale_factor] = (cv2.cvtColor(
+                template_scaled,
+                cv2.COLOR_BGR2GRAY), create_red_mask(template_scaled))
+            self.scores[scale_factor] = {}
+        gray_template, mask = self.templates[scale_factor]
+        done = self.scores[scale_factor]
+        for pos in positions:
+            if pos in done:
+                continue
+            result = cv2.matchTemplate(self.frames[pos],
+                                       gray_template,
+                                       cv2.TM_CCOEFF_NORMED,
+                                       mask=mask)
+            _, max_val, _, _ = cv2.minMaxLoc(result)
+            # 纯色区域上带 mask 的相关系数可能为 inf/NaN，视为不匹配
+            done[pos] = max_val if np.isfinite(max_val) else -1.0
+            self.calls += 1
+
+    def frame_max(self, scale_factor, positions):
+        """ 与穷举相同的规则：返回 (最大匹配值, 最早达到它的帧位置)，都不超过 0 时为 (0.0, -1) """
+        maxmax = 0.0
+        max_pos = -1
+        done = self.scores[scale_factor]
+        for pos in positions:
+            if done[pos] > maxmax:
+                maxmax = done[pos]
+                max_pos = pos
+        return maxmax, max_pos
+
+    def select(self, candidates, positions):
+        """ 按候选顺序返回 (scale_factor, 匹配值, 帧位置)，相同匹配值取靠前者 """
+        best = (None, -1.0, -1)
+        for scale_factor in candidates:
+            maxmax, max_pos = self.frame_max(scale_factor, positions)
+            if maxmax > best[1]:
+                best = (scale_factor, maxmax, max_pos)
+        return best
+
+    def refine(self, grid, best_scale_factor, best_val, best_pos, steps):
+        """ 在最优值与其网格相邻值之间细分，只在最优帧上评估 """
+        if best_pos < 0 or len(grid) < 2 or steps <= 0:
+            return best_scale_factor, best_val
+        idx = grid.index(best_scale_factor)
+        low = grid[max(0, idx - 1)]
+        high = grid[min(len(grid) - 1, idx + 1)]
+        refined = (best_scale_factor, best_val)
+        for scale_factor in np.linspace(low, high, 2 * steps + 1):
+            scale_factor = float(scale_factor)
+            self.score(scale_factor, [best_pos])
+            if self.scores[scale_factor][best_pos] > refined[1]:
+                refined = (scale_factor, self.scores[scale_factor][best_pos])
+        return refined
+
+    def peak_positions(self, count):
+        """ 按已算过的任一 scale_factor 的最高匹配值排序，返回前 count 个帧位置 """
+        peak = {}
+        for done in self.scores.values():
+            for pos, val in done.items():
+                if val > peak.get(pos, -1.0):
+                    peak[pos] = val
+        return sorted(peak, key=peak.get, reverse=True)[:count]
+
+    def hits(self, scale_factor, first_frame, threshold):
+        done = self.scores[scale_factor]
+        return [(pos + first_frame, val) for pos, val in sorted(done.items())
+                if val >= threshold]
+
+
+def exhaustive_scale_search(frames,
+                            template_bgr,
+                            scale_factors,
+                            first_frame=1,
+                            threshold=0.7,
+                            refine_steps=0):
+    """ 全部 scale_factor × 全部帧；frames 为灰度帧序列，first_frame 为 frames[0] 的帧号 """
+    grid = [float(sf) for sf in scale_factors]
+    scorer = _Scorer(frames, template_bgr)
+    all_positions = range(len(frames))
+    for scale_factor in grid:
+        scorer.score(scale_factor, all_positions)
+    best_scale_factor, best_val, best_pos = scorer.select(grid, all_positions)
+    hits = scorer.hits(best_scale_factor, first_frame, threshold)
+    refined = scorer.refine(grid, best_scale_factor, best_val, best_pos,
+                            refine_steps)
+    return ScaleSearchResult(best_scale_factor, best_val,
+                             best_pos + first_frame if best_pos >= 0 else -1,
+                             refined[0], refined[1], scorer.calls, hits)
+
+
+def halving_scale_search(frames,
+                         template_bgr,
+                         scale_factors,
+                         first_frame=1,
+                         threshold=0.7,
+                         initial_frames=32,
+                         keep=3,
+                         top_frames=16,
+                         refine_steps=5,
+                         verbose=False):
+    """
+    逐次减半搜索：
+    1. 在少量均匀采样帧上给全部候选打分(取各自最大匹配值)，淘汰较弱的一半、采样帧数加倍，
+       直到只剩 keep 个(安全余量：最优值在某一轮因采样帧的偶然性排名靠后时仍有机会保留)
+    2. 在全部帧上评估幸存者及其网格左右相邻值
+    3. 复查：取已算过的匹配值最高的 top_frames 帧(即图标出现的帧)，给已淘汰的候选在这些帧上打分；
+       若某个候选在这些帧上就不低于当前最优，把它也在全部帧上评估，重复直到没有这样的候选
+    4. 在最优值与其网格相邻值之间细分(只在最优帧上)，给出更精细的 refined_scale_factor
+    前几轮淘汰掉的候选会在第 3 步复查，因此只要图标在逐次加密的采样中被采到过
+    (图标通常持续数十帧)，结果就与 exhaustive_scale_search 一致；
+    只出现一两帧、且从未落在采样帧上的图标可能找不到，此时请用穷举。
+    """
+    grid = [float(sf) for sf in scale_factors]
+    scorer = _Scorer(frames, template_bgr)
+    n_frames = len(frames)
+    all_positions = range(n_frames)
+
+    def sample_positions(count):
+        count = min(count, n_frames)
+        return sorted(
+            set(np.linspace(0, n_frames - 1, count).round().astype(int).tolist()))
+
+    survivors = list(grid)
+    count = initial_frames
+    while True:
+        positions = sample_positions(count)
+        for scale_factor in survivors:
+            scorer.score(scale_factor, positions)
+        if verbose:
+            print(f"[HALVING] 候选 {len(survivors)} 个，采样 {len(positions)} 帧，"
+                  f"累计 matchTemplate {scorer.calls} 次")
+        if len(survivors) <= keep:
+            break
+        ranked = sorted(survivors,
+                        key=lambda sf: scorer.frame_max(sf, positions)[0],
+                        reverse=True)
+        kept = set(ranked[:max(keep, (len(ranked) + 1) // 2)])
+        survivors = [sf for sf in grid if sf in kept]
+        count *= 2
+
+    finalists = set()
+    for scale_factor in survivors:
+        idx = grid.index(scale_factor)
+        finalists.update(grid[max(0, idx - 1):idx + 2])
+    pending = finalists
+    while pending:
+        for scale_factor in pending:
+            scorer.score(scale_factor, all_positions)
+        ordered = [sf for sf in grid if sf in finalists]
+        best_scale_factor, best_val, best_pos = scorer.select(
+            ordered, all_positions)
+        top = sorted(scorer.peak_positions(top_frames))
+        pending = set()
+        for scale_factor in grid:
+            if scale_factor in finalists:
+                continue
+            scorer.score(scale_factor, top)
+            if scorer.frame_max(scale_factor, top)[0] >= best_val:
+                pending.add(scale_factor)
+        finalists |= pending
+        if verbose and pending:
+            print(f"[HALVING] 复查发现 {len(pending)} 个候选需在全部帧上评估")
+
+    hits = scorer.hits(best_scale_factor, first_frame, threshold)
+    refined = scorer.refine(grid, best_scale_factor, best_val, best_pos,
+                            refine_steps)
+    if verbose:
+        print(f"[HALVING] matchTemplate 调用 {scorer.calls} 次，"
+              f"穷举需 {len(grid) * n_frames} 次")
+    return ScaleSearchResult(best_scale_factor, best_val,
+                             best_pos + first_frame if best_pos >= 0 else -1,
+                             refined[0], refined[1], scorer.calls, hits)
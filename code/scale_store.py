@@ -0,0 +1,224 @@
+# scale_store.py
+import os
+import json
+import time
+import tempfile
+from datetime import datetime
+from statistics import median
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# 元数据保存在同一 JSON 的保留键下，顶层仍是 "WxH": scale 的扁平映射，
+# 旧脚本按原方式读写不受影响
+META_KEY = "_meta"
+
+
+def parse_resolution_key(key):
+    """ "1280x720" -> (1280, 720)；无效 key 返回 None """
+    try:
+        w, h = key.lower().split("x")
+        return int(w), int(h)
+    except (ValueError, AttributeError):
+        return None
+
+
+class FileLock:
+    """
+    基于操作系统文件锁(POSIX 为 fcntl.flock，Windows 为 msvcrt.locking)的跨平台进程锁，
+    用于串行化对 JSON 的读-改-写。
+    锁文件本身一直保留、从不删除：锁归属于打开它的进程，持有者退出(包括异常退出)时由系统释放，
+    因此没有需要清理的失效锁，也不会误删别人刚拿到的锁。
+    """
+
+    def __init__(self, path, timeout=10.0, poll=0.05):
+        self.path = path
+        self.timeout = timeout
+        self.poll = poll
+        self._fd = None
+
+    @staticmethod
+    def _lock(fd):
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+
+    @staticmethod
+    def _unlock(fd):
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        else:
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+    def acquire(self):
+        deadline = time.monotonic() + self.timeout
+        fd = os.open(self.path, os.O_CREAT | os.O_RDWR)
+        while True:
+            try:
+                self._lock(fd)
+                self._fd = fd
+                return
+            except OSError:
+                if time.monotonic() > deadline:
+                    os.close(fd)
+                    raise TimeoutError(f"等待锁超时: {self.path}")
+                time.sleep(self.poll)
+
+    def release(self):
+        if self._fd is not None:
+            try:
+                self._unlock(self._fd)
+            finally:
+                os.close(self._fd)
+                self._fd = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+
+class ScaleFactorStore:
+    """
+    分辨率 => scale_factor 的持久化存储。
+    - 读取一次后缓存在内存中，仅当文件被其他进程修改(mtime/size 变化)时重新加载
+    - 写入在文件锁内完成：先重读磁盘最新内容再合并修改，写临时文件后 os.replace 原子替换
+    - 每条记录附带标定匹配值(score)、来源(source)与更新时间
+    - 对未记录的分辨率，可按已知分辨率的高度/宽高比预测 scale_factor
+    """
+
+    def __init__(self, path, lock_timeout=10.0):
+        self.path = path
+        self.lock_path = path + ".lock"
+        self.lock_timeout = lock_timeout
+        self._data = None
+        self._stamp = None
+
+    def _file_stamp(self):
+        try:
+            st = os.stat(self.path)
+            return st.st_mtime_ns, st.st_size
+        except FileNotFoundError:
+            return None
+
+    def _read_disk(self):
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        else:
+            data = {}
+        data.setdefault(META_KEY, {})
+        return data
+
+    def _load(self):
+        stamp = self._file_stamp()
+        if self._data is None or stamp != self._stamp:
+            self._data = self._read_disk()
+            self._stamp = stamp
+        return self._data
+
+    def _write_disk(self, data):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(prefix=".scale_factors.",
+                                        suffix=".tmp",
+                                        dir=directory)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(data, f, indent=4, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._data = data
+        self._stamp = self._file_stamp()
+
+    def as_dict(self):
+        """ 返回 {"WxH": scale_factor} 的扁平映射(不含元数据) """
+        data = self._load()
+        return {k: v for k, v in data.items() if k != META_KEY}
+
+    def get(self, key):
+        """ 返回某分辨率的完整记录 {"scale", "score", "source", "updated"}，无记录返回 None """
+        data = self._load()
+        if key not in data or key == META_KEY:
+            return None
+        record = {"scale": data[key]}
+        record.update(data[META_KEY].get(key, {}))
+        return record
+
+    def update_many(self, records, replace=False):
+        """
+        一次原子写入多条记录。records: {key: {"scale": ..., "score": ..., "source": ...}}
+        replace=True 时以 records 替换全部已有记录。
+        """
+        stamp = datetime.now().isoformat(timespec="seconds")
+        with FileLock(self.lock_path, timeout=self.lock_timeout):
+            data = self._read_disk()
+            if replace:
+                for key in [k for k in data if k != META_KEY]:
+                    if key not in records:
+                        del data[key]
+                        data[META_KEY].pop(key, None)
+            for key, record in records.items():
+                scale = float(record["scale"])
+                meta = {
+                    k: v
+                    for k, v in record.items() if k != "scale" and v is not None
+                }
+                # 数值未变且没有新的元数据时保留原记录
+                if not meta and data.get(key) == scale:
+                    continue
+                data[key] = scale
+                meta["updated"] = stamp
+                data[META_KEY][key] = meta
+            self._write_disk(data)
+
+    def update(self, key, scale, score=None, source=None):
+        """ 原子写入单条记录 """
+        self.update_many(
+            {key: {
+                "scale": scale,
+                "score": score,
+                "source": source
+            }})
+
+    def predict(self, width, height):
+        """
+        根据已知分辨率预测 (width x height) 的 scale_factor。
+        游戏 UI 随画面高度等比缩放(如 2340x1080 与 1920x1080 共用同一值)，因此：
+        1) 有相同高度的记录 -> 直接取其中位数
+        2) 有相同宽高比的记录 -> 按高度比例换算
+        3) 否则使用全部记录的 scale/height 中位数换算
+        返回 (scale, basis)，无任何记录时返回 None。
+        """
+        known = []
+        for key, scale in self.as_dict().items():
+            res = parse_resolution_key(key)
+            if res is None or not scale:
+                continue
+            known.append((res[0], res[1], float(scale)))
+        if not known:
+            return None
+
+        same_height = [s for w, h, s in known if h == height]
+        if same_height:
+            return median(same_height), "height"
+
+        aspect = width / height
+        same_aspect = [
+            s / h for w, h, s in known if abs(w / h - aspect) / aspect < 0.01
+        ]
+        if same_aspect:
+            return median(same_aspect) * height, "aspect"
+
+        return median(s / h for w, h, s in known) * height, "height-ratio"
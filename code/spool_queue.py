@@ -0,0 +1,342 @@
+# spool_queue.py
+"""
+基于共享目录的分布式任务队列：协调端把“视频 + 检测配置”写成任务文件，
+多台机器上的 worker 通过原子 rename 认领任务，以 find_template_and_extract_clips 为工作单元，
+结果(区间、片段、匹配值)写回任务旁边。
+
+目录结构(spool 可以是 NFS/SMB 共享目录，也可以是本机目录)：
+    spool/pending/<job_id>.json                  待处理
+    spool/running/<job_id>@<worker>.json         已认领；worker 定期更新其 mtime 作为心跳
+    spool/done/<job_id>.json + <job_id>.result.json
+    spool/failed/<job_id>.json + <job_id>.result.json
+
+- 认领：rename pending/x.json -> running/x@worker.json，同一时刻只有一个 worker 能成功
+- 心跳超过 stale_after 秒未更新的任务视为 worker 已死，重新放回 pending(超过 max_attempts 次则移入 failed)
+- 时间统一以 spool 所在文件系统的时钟为准(见 _spool_now)，不要求各机器时钟同步
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import socket
+import threading
+import traceback
+from datetime import datetime
+from metrics import METRICS
+
+QUEUE_DIRS = ("pending", "running", "done", "failed")
+
+
+def _write_json_atomic(path, data):
+    # 临时文件名在多台机器、多个进程之间唯一(pid 在不同机器上可能相同)
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=4, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _read_json(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def init_spool(spool):
+    for name in QUEUE_DIRS:
+        os.makedirs(os.path.join(spool, name), exist_ok=True)
+
+
+def _spool_now(spool):
+    """ 以 spool 文件系统的时钟为准的当前时间：touch 一个文件后读取其 mtime """
+    clock = os.path.join(spool, ".clock")
+    with open(clock, "a"):
+        pass
+    os.utime(clock)
+    return os.path.getmtime(clock)
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def submit_job(spool, video_path, config, output_dir, start=None, end=None):
+    """
+    提交一个任务，返回 job_id。
+    config 为 DetectorConfig；video_path / output_dir 必须是所有 worker 都能访问的路径。
+    """
+    init_spool(spool)
+    job_id = f"{datetime.now():%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:8]}"
+    job = {
+        "id": job_id,
+        "video": os.path.abspath(video_path),
+        "output_dir": os.path.abspath(output_dir),
+        "config": config.to_dict(),
+        "start": start,
+        "end": end,
+        "submitted_at": datetime.now().isoformat(timespec="seconds"),
+        "attempts": 0
+    }
+    # 先写成隐藏临时文件，rename 之后才会被 worker 看到
+    tmp = os.path.join(spool, "pending", f".{job_id}.json")
+    _write_json_atomic(tmp, job)
+    os.replace(tmp, os.path.join(spool, "pending", f"{job_id}.json"))
+    return job_id
+
+
+def claim_job(spool, worker_id):
+    """ 认领最早的待处理任务，返回 (running 中的路径, job)；没有任务时返回 (None, None) """
+    pending = os.path.join(spool, "pending")
+    for name in sorted(os.listdir(pending)):
+        if name.startswith(".") or not name.endswith(".json"):
+            continue
+        job_id = name[:-len(".json")]
+        running_path = os.path.join(spool, "running", f"{job_id}@{worker_id}.json")
+        try:
+            os.rename(os.path.join(pending, name), running_path)
+        except FileNotFoundError:
+            continue  # 被其他 worker 抢先认领
+        os.utime(running_path)  # rename 不更新 mtime，认领时先记一次心跳
+        return running_path, _read_json(running_path)
+    return None, None
+
+
+def requeue_stale(spool, stale_after=60, max_attempts=3):
+    """
+    把心跳超时的任务放回 pending；已尝试 max_attempts 次的移入 failed。
+    返回被处理的 job_id 列表。任何 worker 或协调端都可以调用。
+    """
+    now = _spool_now(spool)
+    running = os.path.join(spool, "running")
+    requeued = []
+    for name in os.listdir(running):
+        if not name.endswith(".json") or "@" not in name:
+            continue
+        path = os.path.join(running, name)
+        try:
+            if now - os.path.getmtime(path) < stale_after:
+                continue
+            # 先原子地移走，避免多个调用者重复处理；原 worker 之后的心跳/提交都会失败
+            job_id, worker_id = name[:-len(".json")].split("@", 1)
+            tmp = os.path.join(spool, "pending", f".{job_id}.json")
+            os.rename(path, tmp)
+        except FileNotFoundError:
+            continue
+        job = _read_json(tmp)
+        job["attempts"] = job.get("attempts", 0) + 1
+        job.setdefault("lost_by", []).append(worker_id)
+        if job["attempts"] >= max_attempts:
+            _write_json_atomic(os.path.join(spool, "failed", f"{job_id}.result.json"),
+                               {"error": f"worker 心跳超时 {job['attempts']} 次",
+                                "workers": job["lost_by"]})
+            _write_json_atomic(tmp, job)
+            os.replace(tmp, os.path.join(spool, "failed", f"{job_id}.json"))
+            print(f"❌ 任务 {job_id} 多次丢失，移入 failed")
+        else:
+            _write_json_atomic(tmp, job)
+            os.replace(tmp, os.path.join(spool, "pending", f"{job_id}.json"))
+            print(f"⚠️ 任务 {job_id} 的 worker {worker_id} 心跳超时，已重新排队")
+        requeued.append(job_id)
+    return requeued
+
+
+class Heartbeat(threading.Thread):
+    """ 后台线程，定期更新 running 任务文件的 mtime；文件被移走说明任务已被重新分配 """
+
+    def __init__(self, path, interval=10, on_beat=None):
+        super().__init__(daemon=True)
+        self.path = path
+        self.interval = interval
+        self.on_beat = on_beat
+        self.lost = False
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                os.utime(self.path)
+            except FileNotFoundError:
+                self.lost = True
+                return
+            if self.on_beat is not None:
+                self.on_beat()
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def run_job(job):
+    """
+    执行一个任务：按任务中的配置调用 find_template_and_extract_clips，返回片段清单。
+    worker 无人值守：scale_factor 无法自动确定时不提示输入，任务直接失败。
+    """
+    from creat_video_cut import find_template_and_extract_clips
+    config = dict(job["config"])
+    template_path = config.pop("template_path")
+    return find_template_and_extract_clips(job["video"],
+                                           template_path,
+                                           job["output_dir"],
+                                           start=job.get("start"),
+                                           end=job.get("end"),
+                                           interactive=False,
+                                           **config)
+
+
+def _finish(spool, running_path, job, state, result):
+    """
+    先把任务文件从 running 原子地 rename 到目标目录下的唯一临时名(只有仍持有任务的 worker 能成功)，
+    再写结果，最后 os.replace 为正式文件名；任务已被重新分配时返回 False，不写任何结果。
+    """
+    folder = os.path.join(spool, state)
+    staged = os.path.join(folder, f".{job['id']}.{uuid.uuid4().hex}.json")
+    try:
+        os.rename(running_path, staged)
+    except FileNotFoundError:
+        return False
+    _write_json_atomic(os.path.join(folder, f"{job['id']}.result.json"), result)
+    os.replace(staged, os.path.join(folder, f"{job['id']}.json"))
+    return True
+
+
+def run_worker(spool,
+               worker_id=None,
+               poll=2.0,
+               heartbeat=10,
+               stale_after=60,
+               max_attempts=3,
+               exit_when_empty=False,
+               max_jobs=None):
+    """
+    worker 主循环：回收超时任务 -> 认领 -> 心跳 -> 执行 -> 写结果。
+    exit_when_empty=True 时队列(pending 与 running)都空后退出，便于本机测试与批处理。
+    返回本 worker 完成的任务数。
+    """
+    init_spool(spool)
+    worker_id = worker_id or default_worker_id()
+    print(f"[INFO] worker {worker_id} 启动, spool={spool}")
+    finished = 0
+
+    def update_depths():
+        METRICS.set_queue_depths(queue_status(spool))
+
+    while max_jobs is None or finished < max_jobs:
+        requeue_stale(spool, stale_after=stale_after, max_attempts=max_attempts)
+        update_depths()
+        running_path, job = claim_job(spool, worker_id)
+        if job is None:
+            if exit_when_empty and not queue_status(spool)["running"]:
+                break
+            time.sleep(poll)
+            continue
+
+        print(f"[INFO] worker {worker_id} 认领任务 {job['id']}: {job['video']}")
+        beat = Heartbeat(running_path, interval=heartbeat, on_beat=update_depths)
+        beat.start()
+        started = time.time()
+        try:
+            manifest = run_job(job)
+            state = "done" if manifest is not None else "failed"
+            result = {"manifest": manifest}
+            if manifest is None:
+                result["error"] = "find_template_and_extract_clips 返回 None"
+        except Exception:
+            state = "failed"
+            result = {"error": traceback.format_exc()}
+        finally:
+            beat.stop()
+        result.update({
+            "worker": worker_id,
+            "elapsed": round(time.time() - started, 3),
+            "finished_at": datetime.now().isoformat(timespec="seconds")
+        })
+
+        if beat.lost or not _finish(spool, running_path, job, state, result):
+            print(f"⚠️ 任务 {job['id']} 已被重新分配，丢弃本次结果")
+            continue
+        finished += 1
+        mark = "✅" if state == "done" else "❌"
+        print(f"{mark} 任务 {job['id']} -> {state} ({result['elapsed']:.1f}s)")
+        sys.stdout.flush()
+    return finished
+
+
+def _local_worker(spool, index, kwargs, budget):
+    from lib import start_log, end
+    from governor import configure_governor
+    # 每个 worker 只使用分给它的那份核心预算
+    configure_governor(**budget).apply()
+    worker_id = f"{default_worker_id()}-{index}"
+    start_log(os.path.join(spool, "log", worker_id))
+    try:
+        run_worker(spool, worker_id=worker_id, **kwargs)
+    finally:
+        end()
+
+
+def run_local_workers(spool, workers=None, **kwargs):
+    """
+    在本机启动 workers 个 worker 进程处理 spool，直到队列清空；各进程的日志写入 spool/log/<worker_id>。
+    核心预算(governor)平分给各进程；workers 为 None 时按预算决定进程数(每进程约 2 个扫描核心)。
+    """
+    import multiprocessing
+    from governor import get_governor
+    governor = get_governor()
+    if workers is None:
+        workers = max(1, governor.scan_cores // 2)
+    budget = governor.share(workers).budget()
+    print(f"[INFO] 启动 {workers} 个 worker，每个: {governor.share(workers)}")
+    kwargs.setdefault("exit_when_empty", True)
+    procs = [
+        multiprocessing.Process(target=_local_worker,
+                                args=(spool, i, kwargs, budget))
+        for i in range(workers)
+    ]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    return queue_status(spool)
+
+
+def queue_status(spool):
+    """ 各状态的任务数 """
+    status = {}
+    for name in QUEUE_DIRS:
+        path = os.path.join(spool, name)
+        entries = os.listdir(path) if os.path.isdir(path) else []
+        status[name] = sum(1 for n in entries
+                           if n.endswith(".json") and not n.startswith(".")
+                           and not n.endswith(".result.json"))
+    return status
+
+
+def job_result(spool, job_id):
+    """
+    已结束任务的 (状态, 结果, 结果文件路径)，状态为 "done" 或 "failed"；
+    仍在排队或运行时返回 (None, None, None)。任务文件最后才出现在 done/failed 中，此时结果已写好。
+    """
+    for state in ("done", "failed"):
+        folder = os.path.join(spool, state)
+        if not os.path.exists(os.path.join(folder, f"{job_id}.json")):
+            continue
+        result_path = os.path.join(folder, f"{job_id}.result.json")
+        result = _read_json(result_path) if os.path.exists(result_path) else None
+        return state, result, result_path
+    return None, None, None
+
+
+def collect_results(spool, state="done"):
+    """ 读取 done(或 failed) 中的全部 (job, result) """
+    results = []
+    folder = os.path.join(spool, state)
+    for name in sorted(os.listdir(folder)):
+        if (name.startswith(".") or name.endswith(".result.json")
+                or not name.endswith(".json")):
+            continue
+        job = _read_json(os.path.join(folder, name))
+        result_path = os.path.join(folder, f"{job['id']}.result.json")
+        result = _read_json(result_path) if os.path.exists(result_path) else None
+        results.append((job, result))
+    return results
@@ -0,0 +1,341 @@
+# stream_cut.py
+"""
+单遍扫描并剪辑：用 PyAV 解复用源视频，一边解码匹配，一边把压缩包(packet)放进
+预录环形缓冲；命中时立即把缓冲中的前 PRE_ROLL_FRAMES 帧(回退到关键帧)写入新片段，
+并继续直接复制后续的包直到 POST_ROLL_FRAMES 帧之后。整个过程只读取一次源文件，
+不再为每个区间用 FFmpeg 重新打开源视频。
+
+检测与 creat_video_cut 共用 matcher.scan_frames(ROI 批量匹配、跟踪模式都一样)。
+命中帧 f 对应 [f - PRE_ROLL_FRAMES, f + POST_ROLL_FRAMES]，片段内的命中延长当前片段；
+片段在 post-roll 结束时立即写完关闭。之后的命中另起片段，起点不早于上一片段终点之后一帧，
+因此 creat_video_cut 中会合并的两个区间在这里是首尾相接的两个片段。需要 PyAV(pip install av)。
+"""
+import os
+import sys
+from collections import deque
+from datetime import datetime
+from lib import get_video_scale_factor, parse_position
+from config import DetectorConfig
+from detector import Detector
+from matcher import scan_frames
+from metrics import METRICS
+from creat_video_cut import PRE_ROLL_FRAMES, POST_ROLL_FRAMES, write_clip_manifest
+
+try:
+    import av
+except ImportError:  # 可选依赖，只有单遍模式需要
+    av = None
+
+
+def _packet_time(packet, start_time):
+    """ 包的解码时间(秒，相对流起点)；dts 缺失时退回 pts，都缺失返回 None """
+    ts = packet.dts if packet.dts is not None else packet.pts
+    if ts is None:
+        return None
+    return float((ts - start_time) * packet.time_base)
+
+
+class PrerollBuffer:
+    """
+    最近若干秒压缩包的环形缓冲。
+    总是保留到“解码位置 - preroll 秒”之前最近的一个视频关键帧，
+    保证从缓冲头部开始复制时能够独立解码；占用的内存上限约为 preroll + 一个 GOP。
+    每个条目为 (seq, t, packet, is_video_key)，seq 单调递增，用于记录片段已写到哪里。
+    """
+
+    def __init__(self, preroll_sec):
+        self.preroll_sec = preroll_sec
+        self.entries = deque()
+        self.keyframe_times = deque()
+        self._seq = 0
+
+    def append(self, packet, t, is_video_key):
+        self._seq += 1
+        entry = (self._seq, t, packet, is_video_key)
+        self.entries.append(entry)
+        if is_video_key:
+            self.keyframe_times.append(t)
+        return entry
+
+    def trim(self, now):
+        """ 丢弃比 now - preroll 之前最近关键帧更早的包 """
+        cutoff = now - self.preroll_sec
+        while len(self.keyframe_times) >= 2 and self.keyframe_times[1] <= cutoff:
+            self.keyframe_times.popleft()
+            while self.entries and not (self.entries[0][3] and
+                                        self.entries[0][1] == self.keyframe_times[0]):
+                self.entries.popleft()
+
+    def since_keyframe(self, t):
+        """ 返回从 t 之前(含)最近的视频关键帧开始的全部条目；没有则从缓冲头部开始 """
+        start = 0
+        for i, (_, pt, _, key) in enumerate(self.entries):
+            if key and pt <= t:
+                start = i
+            elif pt > t:
+                break
+        return list(self.entries)[start:]
+
+
+class ClipWriter:
+    """
+    把输入包按流复制写入一个片段文件，时间戳以片段首个关键帧为零点。
+    只写入 [start_t, end_t] 内的包；end_t 可随合并的命中用 extend() 延长。
+    """
+
+    def __init__(self, path, in_streams, start_t, end_t):
+        self.path = path
+        self.container = av.open(path, "w")
+        self.streams = {}
+        self.offsets = {}
+        for s in in_streams:
+            if hasattr(self.container, "add_stream_from_template"):
+                out = self.container.add_stream_from_template(s)
+            else:
+                out = self.container.add_stream(template=s)
+            self.streams[s.index] = out
+            self.offsets[s.index] = (s.start_time or 0) + int(start_t / s.time_base)
+        self.start_t = start_t
+        self.end_t = end_t
+
+    def write(self, entry):
+        _, t, packet, _ = entry
+        if t < self.start_t or t > self.end_t:  # 关键帧之前的音频包 / 片段终点之后的包
+            return
+        offset = self.offsets[packet.stream.index]
+        # 复制一份再写，缓冲中的原包可能还要写入下一个片段
+        out = av.Packet(bytes(packet))
+        out.pts = None if packet.pts is None else packet.pts - offset
+        out.dts = None if packet.dts is None else packet.dts - offset
+        out.duration = packet.duration
+        out.time_base = packet.time_base
+        out.is_keyframe = packet.is_keyframe
+        out.stream = self.streams[packet.stream.index]
+        self.container.mux(out)
+
+    def extend(self, end_t, entries):
+        """ 终点延长到 end_t，并补写 entries 中落在 (原终点, end_t] 内的包 """
+        if end_t <= self.end_t:
+            return
+        old_end = self.end_t
+        self.end_t = end_t
+        for entry in entries:
+            if entry[1] > old_end:
+                self.write(entry)
+
+    def close(self):
+        self.container.close()
+
+
+def single_pass_extract_clips(video_path,
+                              template_path,
+                              output_dir,
+                              threshold=0.6,
+                              start=None,
+                              end=None,
+                              match_mode="masked_gray",
+                              roi=None,
+                              stride=13,
+                              scale_factor=None,
+                              downscale=1.0,
+                              batch_size=16,
+                              track_margin=None):
+    """
+    与 creat_video_cut.find_template_and_extract_clips 相同的检测参数，
+    但只读取一次源视频：片段在检测过程中直接由缓冲的压缩包复制生成。
+    返回片段清单(同 clips.json)；缺少 PyAV 或无法打开视频时返回 None。
+    """
+    if av is None:
+        print("❌ 单遍模式需要 PyAV：pip install av")
+        return None
+
+    print(
+        f"[INFO] Video: {video_path}, Template: {template_path}, Threshold={threshold}, "
+        f"Start={start}, End={end}, 单遍模式")
+
+    try:
+        container = av.open(video_path)
+    except (OSError, av.FFmpegError) as e:
+        print(f"❌ 无法打开视频: {video_path} ({e})")
+        return None
+    if not container.streams.video:
+        print(f"❌ 没有视频流: {video_path}")
+        container.close()
+        return None
+
+    video = container.streams.video[0]
+    in_streams = [video] + list(container.streams.audio)
+    fps = float(video.average_rate or 0) or 30  # 默认值防止异常
+    video_start = video.start_time or 0
+    video_width = video.codec_context.width
+    video_height = video.codec_context.height
+    if scale_factor is None:
+        # 采样验证预测值只读几帧，用 OpenCV 单独打开即可
+        import cv2
+        from matcher import load_template
+        cap = cv2.VideoCapture(video_path)
+        scale_factor = get_video_scale_factor(cap, load_template(template_path),
+                                              start, end)
+        cap.release()
+        if scale_factor is None:
+            print("❌ 没有可用的 scale_factor")
+            container.close()
+            return None
+    print(f"[INFO] 使用 scale_factor = {scale_factor:.5f}")
+
+    try:
+        config = DetectorConfig(template_path=template_path,
+                                threshold=threshold,
+                                stride=stride,
+                                match_mode=match_mode,
+                                roi=roi,
+                                scale_factor=scale_factor,
+                                downscale=downscale,
+                                batch_size=batch_size,
+                                track_margin=track_margin).validate()
+        matcher = Detector(config).matcher_for(scale_factor)
+    except ValueError as e:
+        print(f"❌ {e}")
+        container.close()
+        return None
+
+    start_frame = parse_position(start, fps) or 1
+    end_frame = parse_position(end, fps)
+    if start_frame > PRE_ROLL_FRAMES + 1:
+        # 跳到起点前 PRE_ROLL_FRAMES 帧之前的关键帧，使起点附近的命中也有完整的预录
+        target = video_start + int(
+            (start_frame - 1 - PRE_ROLL_FRAMES) / fps / video.time_base)
+        container.seek(target, backward=True, stream=video)
+
+    video_name = os.path.splitext(os.path.basename(video_path))[0]
+    output_path = os.path.join(output_dir, f"{video_name}_scale{scale_factor:.5f}")
+    os.makedirs(output_path, exist_ok=True)
+    manifest = {
+        "video": os.path.abspath(video_path),
+        "recorded_at": datetime.fromtimestamp(
+            os.path.getmtime(video_path)).isoformat(timespec="seconds"),
+        "fps": fps,
+        "scale_factor": scale_factor,
+        "threshold": threshold,
+        "clips": []
+    }
+
+    last_frame = end_frame
+    if video.frames > 0:
+        last_frame = video.frames if end_frame is None else min(end_frame, video.frames)
+    METRICS.start_video(video_path, start_frame, last_frame)
+
+    # ROI 批量匹配时命中最多晚 batch_size 个采样帧才产出，缓冲需额外保留这段时间的包
+    tracking = config.track_margin is not None
+    lag_frames = stride * (1 if tracking or roi is None else max(1, config.batch_size))
+    buffer = PrerollBuffer((PRE_ROLL_FRAMES + lag_frames + 1) / fps)
+    packets = container.demux(*in_streams)
+    writer = None
+    clip = None  # 当前片段的清单条目，end_frame 随片段内的命中延长
+    last_end = -1  # 上一个片段的终点帧，新片段从其后开始
+
+    def frame_time(idx):
+        return (idx - 1) / fps
+
+    def finish_clip():
+        nonlocal writer, clip, last_end
+        writer.close()
+        clip["duration"] = round((clip["end_frame"] - clip["start_frame"]) / fps, 3)
+        manifest["clips"].append(clip)
+        last_end = clip["end_frame"]
+        print(f"[CLIP] {clip['file']}: {clip['start_frame']}-{clip['end_frame']} "
+              f"score={clip['score']:.3f}")
+        writer, clip = None, None
+
+    def on_hit(frame_idx, max_val):
+        nonlocal writer, clip
+        end_f = frame_idx + POST_ROLL_FRAMES
+        if clip is not None:
+            # 片段内的命中：延长终点，补写缓冲中已读到的包
+            clip["end_frame"] = max(clip["end_frame"], end_f)
+            clip["score"] = max(clip["score"], max_val)
+            clip["hits"].append(frame_idx)
+            writer.extend(frame_time(clip["end_frame"]), buffer.entries)
+            return
+        start_f = max(0, frame_idx - PRE_ROLL_FRAMES, last_end + 1)
+        entries = buffer.since_keyframe(frame_time(start_f))
+        out_file = os.path.join(output_path,
+                                f"clip_{len(manifest['clips']) + 1:03d}.mp4")
+        writer = ClipWriter(out_file, in_streams,
+                            entries[0][1] if entries else 0.0, frame_time(end_f))
+        clip = {
+            "file": os.path.basename(out_file),
+            "start_frame": start_f,
+            "end_frame": end_f,
+            "start_sec": round(start_f / fps, 3),
+            "duration": 0.0,
+            "score": max_val,
+            "hits": [frame_idx]
+        }
+        for entry in entries:
+            writer.write(entry)
+
+    def read_packet(packet):
+        """ 缓冲并(在片段内时)直接写出一个包；返回包时间，结尾的空包返回 None """
+        t = _packet_time(packet, packet.stream.start_time or 0)
+        if t is None:
+            return None
+        entry = buffer.append(packet, t, packet.stream.index == video.index and
+                              packet.is_keyframe)
+        if writer is not None:
+            writer.write(entry)
+        return t
+
+    def decoded_frames():
+        """ 边解复用边解码，产出范围内 frame_idx % stride == 0 的 (frame_idx, BGR 图) """
+        frame_count = 0
+        for packet in packets:
+            if read_packet(packet) is None or packet.stream.index != video.index:
+                continue
+            for frame in packet.decode():
+                frame_count += 1
+                if frame.pts is not None:
+                    frame_idx = int(round(float((frame.pts - video_start) * video.time_base) * fps)) + 1
+                else:
+                    frame_idx = frame_count
+                buffer.trim(frame_time(frame_idx))
+                if end_frame is not None and frame_idx > end_frame:
+                    return
+                if frame_idx < start_frame or frame_idx % stride != 0:
+                    continue
+                yield frame_idx, frame.to_ndarray(format="bgr24")
+
+    scanned = scan_frames(decoded_frames(),
+                          matcher,
+                          video_width,
+                          video_height,
+                          roi=config.roi,
+                          batch_size=config.batch_size,
+                          threshold=threshold,
+                          track_margin=config.track_margin)
+    for frame_idx, _, max_val, _ in scanned:
+        METRICS.frame(frame_idx)
+        print(f"[INFO] 正在处理第 {frame_idx} 帧...")
+        if frame_idx % 100 == 0:
+            sys.stdout.flush()
+        if max_val >= threshold:
+            print(f"[MATCH] Frame={frame_idx}, val={max_val:.3f}")
+            METRICS.hit()
+            on_hit(frame_idx, float(max_val))
+        # post-roll 结束即关闭片段(解复用总是领先于匹配结果，终点之前的包都已写出)
+        if clip is not None and frame_idx >= clip["end_frame"]:
+            finish_clip()
+
+    if clip is not None:
+        # 扫描范围已结束：继续读到片段终点(多读 1 秒，包括交错在后面的音频包)再关闭
+        for packet in packets:
+            t = read_packet(packet)
+            if t is not None and t > writer.end_t + 1.0:
+                break
+        finish_clip()
+    container.close()
+
+    write_clip_manifest(output_path, manifest)
+    METRICS.finish_video()
+    print("\n✅ 所有区间已保存至:", output_dir)
+    return manifest
@@ -0,0 +1,281 @@
+# watch_folder.py
+"""
+监视录像目录，只处理新的(或检测设置变化了的)视频。
+
+SQLite 目录(catalog)记录：
+- files:  路径 -> (大小, mtime, 内容哈希)，文件未变化时只需 stat，不再读取内容
+- videos: 内容哈希 -> 分辨率
+- runs:   (内容哈希, 模板哈希, scale_factor, threshold) -> 处理状态与结果
+内容哈希只读取文件头、中、尾各一小段加上文件大小(lib.partial_hash)，多 GB 的录像也很快；
+重命名或复制出的副本哈希相同，不会被重复处理。稳态下每轮只有一次目录扫描和若干 stat。
+"""
+import os
+import sys
+import json
+import time
+import sqlite3
+import hashlib
+from dataclasses import replace
+from datetime import datetime
+from lib import partial_hash
+
+VIDEO_EXTENSIONS = (".mp4", ".mkv", ".mov", ".flv", ".avi", ".ts")
+CATALOG_FILE = "catalog.sqlite"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    content_hash TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS videos (
+    content_hash TEXT PRIMARY KEY,
+    width INTEGER,
+    height INTEGER
+);
+CREATE TABLE IF NOT EXISTS runs (
+    content_hash TEXT NOT NULL,
+    template_hash TEXT NOT NULL,
+    scale_factor REAL NOT NULL,
+    threshold REAL NOT NULL,
+    status TEXT NOT NULL,
+    video TEXT,
+    result TEXT,
+    updated TEXT,
+    PRIMARY KEY (content_hash, template_hash, scale_factor, threshold)
+);
+"""
+
+
+def file_hash(path):
+    """ 整个文件的 SHA-1，用于模板这类小文件 """
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+class VideoCatalog:
+    """ 已处理视频的 SQLite 目录 """
+
+    def __init__(self, path=CATALOG_FILE):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(_SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def content_hash(self, path):
+        """ 返回 path 的内容哈希；大小与 mtime 都未变时直接用记录，不读文件 """
+        st = os.stat(path)
+        row = self.conn.execute(
+            "SELECT size, mtime, content_hash FROM files WHERE path = ?",
+            (path, )).fetchone()
+        if row is not None and row[0] == st.st_size and row[1] == st.st_mtime:
+            return row[2]
+        digest = partial_hash(path)
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                (path, st.st_size, st.st_mtime, digest))
+        return digest
+
+    def resolution(self, content_hash, path):
+        """ 返回视频分辨率 (w, h)；首次遇到该内容时打开视频读取并记录 """
+        row = self.conn.execute(
+            "SELECT width, height FROM videos WHERE content_hash = ?",
+            (content_hash, )).fetchone()
+        if row is not None:
+            return row
+        import cv2
+        cap = cv2.VideoCapture(path)
+        size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        cap.release()
+        if size[0] <= 0 or size[1] <= 0:
+            return None
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO videos VALUES (?, ?, ?)",
+                              (content_hash, ) + size)
+        return size
+
+    def run_status(self, key):
+        row = self.conn.execute(
+            "SELECT status FROM runs WHERE content_hash = ? AND template_hash = ? "
+            "AND scale_factor = ? AND threshold = ?", key).fetchone()
+        return row[0] if row else None
+
+    def queued_runs(self):
+        """ 已提交到 spool 尚未回写结果的记录：[(key, video, job_id)] """
+        rows = self.conn.execute(
+            "SELECT content_hash, template_hash, scale_factor, threshold, video, result "
+            "FROM runs WHERE status = 'queued'").fetchall()
+        return [(tuple(row[:4]), row[4], json.loads(row[5] or "{}").get("job_id"))
+                for row in rows]
+
+    def record_run(self, key, status, video, result=None):
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                key + (status, video, json.dumps(result, ensure_ascii=False),
+                       datetime.now().isoformat(timespec="seconds")))
+
+    def forget_missing(self):
+        """ 删除已不存在的文件记录(内容与处理记录保留，文件再出现时仍会跳过) """
+        paths = [row[0] for row in self.conn.execute("SELECT path FROM files")]
+        missing = [(p, ) for p in paths if not os.path.exists(p)]
+        if missing:
+            with self.conn:
+                self.conn.executemany("DELETE FROM files WHERE path = ?", missing)
+        return len(missing)
+
+
+def list_videos(watch_dir, settle=30.0, now=None):
+    """
+    列出 watch_dir 下(递归)的视频文件；mtime 距今不足 settle 秒的视为仍在录制/拷贝，暂不处理
+    """
+    now = time.time() if now is None else now
+    videos = []
+    for root, _, names in os.walk(watch_dir):
+        for name in sorted(names):
+            if not name.lower().endswith(VIDEO_EXTENSIONS):
+                continue
+            path = os.path.abspath(os.path.join(root, name))
+            try:
+                if now - os.path.getmtime(path) < settle:
+                    continue
+            except FileNotFoundError:
+                continue
+            videos.append(path)
+    return videos
+
+
+def sync_spool_results(catalog, spool):
+    """
+    把已提交(queued)任务在 spool 中的结果写回目录：done/failed 及结果文件路径。
+    返回更新的记录数。
+    """
+    from spool_queue import job_result
+    updated = 0
+    for key, video, job_id in catalog.queued_runs():
+        if job_id is None:
+            continue
+        state, result, result_path = job_result(spool, job_id)
+        if state is None:
+            continue
+        record = {"job_id": job_id, "result_path": result_path}
+        manifest = (result or {}).get("manifest")
+        if state == "done" and manifest is not None:
+            record["clips"] = len(manifest["clips"])
+        else:
+            record["error"] = (result or {}).get("error")
+        catalog.record_run(key, state, video, record)
+        mark = "✅" if state == "done" else "❌"
+        print(f"{mark} 任务 {job_id} -> {state}: {video}")
+        updated += 1
+    return updated
+
+
+def scan_once(catalog, watch_dir, config, output_dir, spool=None, settle=30.0,
+              retry_failed=False):
+    """
+    扫描一轮：对每个视频算出 (内容哈希, 模板哈希, scale_factor, threshold)，
+    目录中没有成功记录的组合才交给 find_template_and_extract_clips 处理
+    (给出 spool 时改为提交到 spool_queue，由 worker 处理；提交前先用 sync_spool_results
+    回写已结束任务的结果，失败的任务与本地处理失败一样，retry_failed=True 时重新提交)。
+    返回本轮处理/提交的视频数。
+    """
+    from lib import lookup_scale_factor
+    if spool is not None:
+        sync_spool_results(catalog, spool)
+    template_hash = file_hash(config.template_path)
+    handled = 0
+    seen = set()
+    for path in list_videos(watch_dir, settle=settle):
+        try:
+            content_hash = catalog.content_hash(path)
+        except FileNotFoundError:
+            continue
+        if content_hash in seen:
+            continue  # 同一轮内的重复副本
+        seen.add(content_hash)
+
+        scale_factor = config.scale_factor
+        if scale_factor is None:
+            size = catalog.resolution(content_hash, path)
+            if size is None:
+                continue
+            scale_factor, _ = lookup_scale_factor(*size)
+            if scale_factor is None:
+                print(f"⚠️ 没有 {size[0]}x{size[1]} 的 scale_factor，跳过 {path}")
+                continue
+        key = (content_hash, template_hash, round(float(scale_factor), 6),
+               float(config.threshold))
+        status = catalog.run_status(key)
+        if status in ("done", "queued") or (status == "failed" and not retry_failed):
+            continue
+
+        handled += 1
+        if spool is not None:
+            from spool_queue import submit_job
+            job_id = submit_job(spool, path,
+                                replace(config, scale_factor=scale_factor),
+                                output_dir)
+            catalog.record_run(key, "queued", path, {"job_id": job_id})
+            print(f"[INFO] 新视频已提交: {path} (job {job_id})")
+            continue
+
+        print(f"[INFO] 新视频: {path}")
+        from creat_video_cut import find_template_and_extract_clips
+        catalog.record_run(key, "running", path)
+        try:
+            manifest = find_template_and_extract_clips(
+                path,
+                config.template_path,
+                output_dir,
+                threshold=config.threshold,
+                match_mode=config.match_mode,
+                roi=config.roi,
+                batch_size=config.batch_size,
+                stride=config.stride,
+                scale_factor=scale_factor,
+                track_margin=config.track_margin,
+                downscale=config.downscale)
+        except Exception as e:
+            catalog.record_run(key, "failed", path, {"error": repr(e)})
+            print(f"❌ 处理失败: {path}: {e!r}")
+            continue
+        if manifest is None:
+            catalog.record_run(key, "failed", path)
+        else:
+            catalog.record_run(key, "done", path, {
+                "clips": len(manifest["clips"]),
+                "output_dir": os.path.abspath(output_dir)
+            })
+        sys.stdout.flush()
+    return handled
+
+
+def watch_folder(watch_dir,
+                 config,
+                 output_dir,
+                 catalog_path=CATALOG_FILE,
+                 poll=60.0,
+                 settle=30.0,
+                 spool=None,
+                 once=False):
+    """ 守护循环：每 poll 秒扫描一次 watch_dir；once=True 时只扫描一轮 """
+    catalog = VideoCatalog(catalog_path)
+    print(f"[INFO] 监视 {watch_dir}，目录文件 {catalog_path}，每 {poll}s 扫描一次")
+    try:
+        while True:
+            handled = scan_once(catalog, watch_dir, config, output_dir,
+                                spool=spool, settle=settle)
+            catalog.forget_missing()
+            if handled:
+                print(f"✅ 本轮处理 {handled} 个视频")
+            if once:
+                return handled
+            time.sleep(poll)
+    finally:
+        catalog.close()
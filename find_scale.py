@@ -4,6 +4,11 @@ import numpy as np
 import sys
 from datetime import datetime
 
+# 与 code/ 共用帧定位/迭代等实现
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "code"))
+from lib import iter_video_frames
+
 # 生成当前时间字符串
 current_time = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
 log_filename = f"./log/output_{current_time}.log"
@@ -25,12 +30,50 @@ def create_red_mask(template_bgr):
     return mask
 
 
+def read_frames(video_path, start_frame, end_frame=None, frame_cache=None):
+    """
+    读取 [start_frame, end_frame] 范围内的全部帧(帧号从 1 开始，end_frame 为 None 时读到结尾)，
+    返回 (首帧帧号, 帧列表)；打不开视频时返回 (None, None)。
+    frame_cache 为目录时改用该目录下的解码帧缓存(首次使用时建立，见 code/frame_cache.py)，
+    帧为 (count, h, w) 的内存映射灰度图。
+    """
+    if frame_cache is not None:
+        from frame_cache import open_frame_cache
+        try:
+            cache = open_frame_cache(video_path,
+                                     frame_cache,
+                                     start=start_frame or None,
+                                     end=end_frame)
+        except (IOError, ValueError) as e:
+            print(f"无法建立帧缓存: {e}")
+            return None, None
+        return cache.first_frame, cache.frames
+
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        print(f"无法打开视频: {video_path}")
+        return None, None
+    # 直接跳转到 start_frame 而非逐帧解码丢弃(见 lib.iter_video_frames)
+    first_frame = None
+    frames = []
+    for frame_idx, frame in iter_video_frames(cap, start_frame, end_frame):
+        if first_frame is None:
+            first_frame = frame_idx
+        frames.append(frame)
+    cap.release()
+    if first_frame is None:
+        print(f"范围 [{start_frame}, {end_frame}] 内没有可读取的帧: {video_path}")
+        return None, None
+    return first_frame, frames
+
+
 def process_video(video_path, template_path, output_dir, threshold,
-                  scale_factors, start_frame):
+                  scale_factors, start_frame, end_frame=None, frame_cache=None):
     """
     **优化版本**
-    - 只遍历视频一次，缓存所有帧，避免重复读取
+    - 只遍历视频一次，缓存 [start_frame, end_frame] 内的所有帧，避免重复读取
     - 在 **缓存帧** 上执行不同 `scale_factor` 的模板匹配
+    - frame_cache 为目录时使用磁盘上的灰度帧缓存(内存映射)，重复实验不再解码
     """
 
     # 创建输出目录
@@ -51,24 +94,11 @@ def process_video(video_path, template_path, output_dir, threshold,
     else:
         template_bgr = template_rgba
 
-    # 打开视频
-    cap = cv2.VideoCapture(video_path)
-    if not cap.isOpened():
-        print(f"无法打开视频: {video_path}")
-        return
-
     # 缓存视频帧（避免多次遍历）
-    frames = []
-    frame_count = 0
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
-        frame_count += 1
-        if frame_count >= start_frame:
-            frames.append(frame)
-
-    cap.release()
+    first_frame, frames = read_frames(video_path, start_frame, end_frame,
+                                      frame_cache)
+    if frames is None:
+        return
     print(f"视频缓存完成，共 {len(frames)} 帧")
 
     # **多缩放匹配**
@@ -90,8 +120,9 @@ def process_video(video_path, template_path, output_dir, threshold,
         max_frame_idx = -1
 
         # 遍历缓存的帧
-        for i, frame in enumerate(frames, start=start_frame):
-            gray_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        for i, frame in enumerate(frames, start=first_frame):
+            gray_frame = frame if frame.ndim == 2 else cv2.cvtColor(
+                frame, cv2.COLOR_BGR2GRAY)
 
             result = cv2.matchTemplate(gray_frame,
                                        gray_template,
@@ -125,10 +156,143 @@ def process_video(video_path, template_path, output_dir, threshold,
     print(f"最优 scale_factor = {best_scale_factor:.5f}")
     print(f"匹配值 = {best_max_val:.5f}")
     print(f"出现帧 = {best_frame_idx}")
+    return best_scale_factor, best_max_val, best_frame_idx
 
-    sys.stdout.close()
-    sys.stdout = sys.__stdout__
-    print("处理完成，日志文件:", log_filename)
+
+def process_video_halving(video_path,
+                          template_path,
+                          output_dir,
+                          threshold,
+                          scale_factors,
+                          start_frame,
+                          end_frame=None,
+                          initial_frames=32,
+                          refine_steps=5,
+                          frame_cache=None):
+    """
+    **逐次减半(successive halving)版本**，实现见 code/scale_search.py
+    (命令行: python code/cli.py calibrate-video VIDEO --search halving)
+    - 结果与 process_video 的穷举一致，但 matchTemplate 调用次数只是其一小部分
+    - 只缓存灰度帧；命中帧以灰度图保存
+    frame_cache 为目录时使用磁盘上的灰度帧缓存(内存映射)，重复实验不再解码。
+    """
+    from scale_search import load_gray_frames, halving_scale_search
+
+    video_name = os.path.splitext(os.path.basename(video_path))[0]
+    output_path = os.path.join(output_dir, video_name)
+    os.makedirs(output_path, exist_ok=True)
+
+    template_rgba = cv2.imread(template_path, cv2.IMREAD_UNCHANGED)
+    if template_rgba is None:
+        print(f"无法读取模板图像: {template_path}")
+        return
+
+    if template_rgba.shape[2] == 4:
+        b, g, r, a = cv2.split(template_rgba)
+        template_bgr = cv2.merge([b, g, r])
+    else:
+        template_bgr = template_rgba
+
+    try:
+        first_frame, frames = load_gray_frames(video_path, start_frame or None,
+                                               end_frame, frame_cache)
+    except (IOError, ValueError) as e:
+        print(e)
+        return
+    print(f"视频缓存完成，共 {len(frames)} 帧")
+
+    result = halving_scale_search(frames,
+                                  template_bgr,
+                                  scale_factors,
+                                  first_frame=first_frame,
+                                  threshold=threshold,
+                                  initial_frames=initial_frames,
+                                  refine_steps=refine_steps,
+                                  verbose=True)
+
+    # 保存最优 scale_factor 下超过阈值的帧
+    for i, max_val in result.hits:
+        save_path = os.path.join(
+            output_path, f"scale_{result.scale_factor:.5f}_frame_{i}.jpg")
+        cv2.imwrite(save_path, frames[i - first_frame])
+        print(
+            f"[MATCH] scale_factor={result.scale_factor:.5f}, 帧 {i}, 匹配值: {max_val:.5f}, 保存至 {save_path}"
+        )
+
+    print("\n=== 最优匹配结果 (successive halving) ===")
+    print(f"最优 scale_factor = {result.scale_factor:.5f}")
+    print(f"匹配值 = {result.score:.5f}")
+    print(f"出现帧 = {result.frame_idx}")
+    print(f"细化 scale_factor = {result.refined_scale_factor:.5f} "
+          f"(匹配值 {result.refined_score:.5f})")
+    return result.scale_factor, result.score, result.frame_idx
+
+
+def process_video_features(video_path,
+                           template_path,
+                           output_dir,
+                           threshold,
+                           start_frame,
+                           end_frame=None,
+                           stride=10,
+                           max_frames=300):
+    """
+    **特征点版本**
+    - 在 [start_frame, end_frame] 内每 stride 帧取一帧，用 ORB 特征匹配直接估计缩放比例与位置
+    - 在估计的比例下只做一次(图标附近的)模板匹配验证，>= threshold 即返回
+    - 不需要预先给出 scale_factor 范围；失败时返回 None，可改用 halving/exhaustive
+    """
+    from feature_scale import calibrate_by_features
+
+    video_name = os.path.splitext(os.path.basename(video_path))[0]
+    output_path = os.path.join(output_dir, video_name)
+    os.makedirs(output_path, exist_ok=True)
+
+    template_rgba = cv2.imread(template_path, cv2.IMREAD_UNCHANGED)
+    if template_rgba is None:
+        print(f"无法读取模板图像: {template_path}")
+        return
+
+    if template_rgba.shape[2] == 4:
+        b, g, r, a = cv2.split(template_rgba)
+        template_bgr = cv2.merge([b, g, r])
+    else:
+        template_bgr = template_rgba
+
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        print(f"无法打开视频: {video_path}")
+        return
+
+    tried = 0
+    for frame_idx, frame in iter_video_frames(cap, start_frame, end_frame,
+                                              stride=stride):
+        if tried >= max_frames:
+            break
+        tried += 1
+        result = calibrate_by_features(frame, template_bgr, threshold=threshold)
+        if result is None or result[1] < threshold:
+            continue
+
+        scale_factor, max_val, max_loc, _ = result
+        new_w = int(template_bgr.shape[1] * scale_factor)
+        new_h = int(template_bgr.shape[0] * scale_factor)
+        cv2.rectangle(frame, max_loc, (max_loc[0] + new_w, max_loc[1] + new_h),
+                      (0, 0, 255), 2)
+        save_path = os.path.join(
+            output_path, f"frame_{frame_idx}_scale_{scale_factor:.5f}.jpg")
+        cv2.imwrite(save_path, frame)
+        cap.release()
+        print("\n=== 最优匹配结果 (features) ===")
+        print(f"scale_factor = {scale_factor:.5f}")
+        print(f"匹配值 = {max_val:.5f}")
+        print(f"出现帧 = {frame_idx}")
+        print(f"尝试了 {tried} 帧，每帧一次特征匹配 + 少量窗口内验证")
+        return scale_factor, max_val, frame_idx
+
+    cap.release()
+    print(f"❌ {tried} 帧内特征估计均未通过验证")
+    return None
 
 
 if __name__ == "__main__":
@@ -140,13 +304,43 @@ if __name__ == "__main__":
     # **缩放因子范围**
     scale_factors = np.linspace(0.4, 0.6, 20)
 
-    # **优化后的一次遍历**
-    process_video(video_path,
-                  template_path,
-                  output_dir,
-                  threshold_value,
-                  scale_factors,
-                  start_frame=990)
+    # "exhaustive"(默认): 全部 scale_factor × 全部帧；
+    # 可选 "halving": 逐次减半剪枝(结果与穷举一致)；"features": 特征点一次估计 + 验证
+    search_mode = "exhaustive"
+    # 起止帧号(从 1 开始)，end_frame 为 None 时处理到视频结尾
+    start_frame = 990
+    end_frame = None
+    # halving/exhaustive 使用的解码帧缓存目录(如 "./frame_cache")；None(默认)时每次重新解码，不写缓存
+    frame_cache_dir = None
+
+    if search_mode == "features":
+        process_video_features(video_path,
+                               template_path,
+                               output_dir,
+                               threshold_value,
+                               start_frame=start_frame,
+                               end_frame=end_frame)
+    elif search_mode == "halving":
+        process_video_halving(video_path,
+                              template_path,
+                              output_dir,
+                              threshold_value,
+                              scale_factors,
+                              start_frame=start_frame,
+                              end_frame=end_frame,
+                              frame_cache=frame_cache_dir)
+    else:
+        # **优化后的一次遍历**
+        process_video(video_path,
+                      template_path,
+                      output_dir,
+                      threshold_value,
+                      scale_factors,
+                      start_frame=start_frame,
+                      end_frame=end_frame,
+                      frame_cache=frame_cache_dir)
+
+    sys.stdout.close()
 
 f.close
 sys.stdout = sys.__stdout__
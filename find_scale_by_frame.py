@@ -4,44 +4,17 @@ import numpy as np
 import sys
 from datetime import datetime
 
-import json
+# 与 code/ 共用 scale_factors.json 的读写(带文件锁、原子写入，保留标定元数据)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "code"))
+from lib import get_scale_factor, get_scale_store
+
 # 生成当前时间字符串
 current_time = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
 log_filename = f"./log/output_{current_time}.log"
 f = open(log_filename, "w", encoding="utf-8")
 print(log_filename)
 sys.stdout = f
-SCALE_FACTOR_FILE = "scale_factors.json"
-
-
-def save_scale_factors(scale_factors):
-    """ 保存 scale_factors.json """
-    with open(SCALE_FACTOR_FILE, "w", encoding="utf-8") as f:
-        json.dump(scale_factors, f, indent=4)
-
-
-def get_scale_factor(video_width, video_height):
-    """ 
-    获取 `scale_factor`：
-    - 如果 `scale_factors.json` 里有该分辨率，直接返回
-    - 否则，提示用户手动输入，并记录到 JSON 
-    """
-    scale_factors = load_scale_factors()
-    key = f"{video_width}x{video_height}"
-
-    if key in scale_factors:
-        print(f"✅ 已找到 `{key}` 对应的 scale_factor: {scale_factors[key]}")
-        return scale_factors[key]
-
-    print(f"⚠️ 未找到 `{key}` 对应的 scale_factor，请手动输入:")
-    scale_factor = float(input("请输入 scale_factor: "))
-    if scale_factor != 0:
-        # 记录新值
-        scale_factors[key] = scale_factor
-        save_scale_factors(scale_factors)
-    else:
-        scale_factor = None
-    return scale_factor
 
 
 def create_red_mask(template_bgr):
@@ -57,21 +30,59 @@ def create_red_mask(template_bgr):
     return mask
 
 
-def load_scale_factors():
-    """ 读取 scale_factors.json，如果文件不存在则返回空字典 """
-    if os.path.exists(SCALE_FACTOR_FILE):
-        with open(SCALE_FACTOR_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    return {}
+def read_template(template_path):
+    """ 读取模板并去除 Alpha 通道，失败时返回 None """
+    template_rgba = cv2.imread(template_path, cv2.IMREAD_UNCHANGED)
+    if template_rgba is None:
+        print(f"无法读取模板图像: {template_path}")
+        return None
+    if template_rgba.shape[2] == 4:
+        b, g, r, a = cv2.split(template_rgba)
+        return cv2.merge([b, g, r])
+    return template_rgba
+
 
+def process_frame_features(frame_path, template_path, output_dir, threshold):
+    """
+    **特征点版本**
+    - 用 ORB 特征匹配直接估计缩放比例与位置，只在估计的比例下做一次(图标附近的)模板匹配验证
+    - 不需要已有记录或 scale_factor 范围；>= threshold 时保存并返回 (scale_factor, 匹配值)，
+      否则返回 None，可改用 process_video 的网格搜索
+    """
+    from feature_scale import calibrate_by_features
 
-def add_scale_factors(key, scale_factor):
-    """ 添加新的 scale_factor """
-    """ 保存 scale_factors.json """
-    scale_factors = load_scale_factors()
-    scale_factors[key] = scale_factor
-    with open(SCALE_FACTOR_FILE, "w", encoding="utf-8") as f:
-        json.dump(scale_factors, f, indent=4)
+    frame_name = os.path.splitext(os.path.basename(frame_path))[0]
+    output_path = os.path.join(output_dir, frame_name)
+    os.makedirs(output_path, exist_ok=True)
+    template_bgr = read_template(template_path)
+    if template_bgr is None:
+        return None
+    frame = cv2.imread(frame_path)
+    if frame is None:
+        print(f"无法读取图像: {frame_path}")
+        return None
+
+    result = calibrate_by_features(frame, template_bgr, threshold=threshold)
+    if result is None or result[1] < threshold:
+        print("❌ 特征估计未通过验证")
+        return None
+
+    scale_factor, max_val, max_loc, _ = result
+    new_w = int(template_bgr.shape[1] * scale_factor)
+    new_h = int(template_bgr.shape[0] * scale_factor)
+    cv2.rectangle(frame, max_loc, (max_loc[0] + new_w, max_loc[1] + new_h),
+                  (0, 0, 255), 2)
+    save_path = os.path.join(output_path, f"features_{scale_factor:.5f}.jpg")
+    cv2.imwrite(save_path, frame)
+    print(f"[MATCH] scale_factor={scale_factor:.5f}, 匹配值: {max_val:.5f}, 保存至 {save_path}")
+
+    key = f"{frame.shape[1]}x{frame.shape[0]}"
+    get_scale_store().update(key,
+                             scale_factor,
+                             score=max_val,
+                             source=f"features:{frame_path}")
+    print(f"✅ 已保存 scale_factor: {scale_factor:.5f}")
+    return scale_factor, max_val
 
 
 def process_video(frame_path, template_path, output_dir, threshold):
@@ -85,18 +96,10 @@ def process_video(frame_path, template_path, output_dir, threshold):
     if not os.path.exists(output_path):
         os.makedirs(output_path)
     # 读取模板
-    template_rgba = cv2.imread(template_path, cv2.IMREAD_UNCHANGED)
-    if template_rgba is None:
-        print(f"无法读取模板图像: {template_path}")
+    template_bgr = read_template(template_path)
+    if template_bgr is None:
         return
 
-    # 处理模板：去除 Alpha 通道，生成 mask
-    if template_rgba.shape[2] == 4:
-        b, g, r, a = cv2.split(template_rgba)
-        template_bgr = cv2.merge([b, g, r])
-    else:
-        template_bgr = template_rgba
-
     # **多缩放匹配**
     best_scale_factor = None
     best_max_val = -1.0
@@ -109,8 +112,8 @@ def process_video(frame_path, template_path, output_dir, threshold):
     video_width = int(frame.shape[1])
     video_height = int(frame.shape[0])
 
-    tmp_scale_factors = get_scale_factor(video_width,
-                                         video_height)  # 从 JSON 读取或手动输入
+    # 从 JSON 读取、按已知分辨率预测或手动输入
+    tmp_scale_factors = get_scale_factor(video_width, video_height)
     # **缩放因子范围**
     scale_factors = np.linspace(
         tmp_scale_factors - 0.01, tmp_scale_factors +
@@ -167,7 +170,10 @@ def process_video(frame_path, template_path, output_dir, threshold):
         print(f"❌ 未找到匹配结果，最大匹配值: {best_max_val:.5f}")  # 未找到匹配结果
     else:
         key = f"{video_width}x{video_height}"
-        add_scale_factors(key, best_scale_factor)
+        get_scale_store().update(key,
+                                 float(best_scale_factor),
+                                 score=best_max_val,
+                                 source=f"sweep:{frame_path}")
         print(f"✅ 已保存 scale_factor: {best_scale_factor:.5f}")
 
 
@@ -177,8 +183,16 @@ if __name__ == "__main__":
     output_dir = "./matched_frames"
     threshold_value = 0.7
 
-    # **优化后的一次遍历**
-    process_video(frame_path, template_path, output_dir, threshold_value)
+    # "features"(默认): 特征点一次估计 + 验证，未通过时退回网格搜索；"sweep": 只用网格搜索
+    search_mode = "features"
+
+    result = None
+    if search_mode == "features":
+        result = process_frame_features(frame_path, template_path, output_dir,
+                                        threshold_value)
+    if result is None:
+        # **优化后的一次遍历**
+        process_video(frame_path, template_path, output_dir, threshold_value)
 
 f.close
 sys.stdout = sys.__stdout__
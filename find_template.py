@@ -5,6 +5,11 @@ import sys
 from datetime import datetime
 import json
 
+# 与 code/ 共用帧定位/迭代的实现
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "code"))
+from lib import iter_video_frames
+
 # 生成当前时间字符串
 current_time = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
 log_filename = f"./log/output_{current_time}.log"
@@ -89,7 +94,8 @@ def find_template_in_video(video_path,
                            output_dir,
                            threshold=0.6,
                            scale_factor=1,
-                           start_frame=0):
+                           start_frame=0,
+                           end_frame=None):
     """
     从 video_path 所指向的视频逐帧匹配 template_path 的图样，
     当匹配值大于 threshold 时，保存对应帧到 output_dir。
@@ -100,9 +106,10 @@ def find_template_in_video(video_path,
     :param threshold: 匹配阈值，越接近1表示匹配度越严格
     :param scale_factor: 对模板进行缩放的因子，1.0 表示不缩放
     :param start_frame: 从视频的第几帧开始分析，默认为0
+    :param end_frame: 分析到第几帧为止(含)，默认为 None 即到视频结尾
     """
     print(
-        f"video_path: {video_path}, template_path: {template_path}, output_dir: {output_dir}, threshold: {threshold}, scale_factor: {scale_factor}, start_frame: {start_frame}"
+        f"video_path: {video_path}, template_path: {template_path}, output_dir: {output_dir}, threshold: {threshold}, scale_factor: {scale_factor}, start_frame: {start_frame}, end_frame: {end_frame}"
     )
     # 3) 打开视频
     cap = cv2.VideoCapture(video_path)
@@ -157,23 +164,14 @@ def find_template_in_video(video_path,
     maxmax = 0.0
     max_frame_idx = -1
 
-    frame_count = 0
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            # 视频读取完毕或发生错误
-            break
-        frame_count += 1
-        if frame_count % 10 == 0:
-            print(f"正在处理第 {frame_count} 帧...")
-        else:
-            continue
+    # 如果需要从指定帧开始：关键帧跳转，不再逐帧解码、打印被跳过的帧；
+    # 每 10 帧采样一次，非采样帧只解码不转换
+    for frame_count, frame in iter_video_frames(cap, start_frame, end_frame,
+                                                stride=10):
+        print(f"正在处理第 {frame_count} 帧...")
 
         if frame_count % 100 == 0:
             sys.stdout.flush()  # 手动刷新缓冲区
-        # 如果需要从指定帧开始
-        if frame_count < start_frame:
-            continue
         # cv2.imshow("11", frame)
         # # 按下“q”键退出
         # if cv2.waitKey(1) & 0xFF == ord('q'):
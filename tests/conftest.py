@@ -0,0 +1,64 @@
+"""
+测试公共部分：把 code/ 加入 sys.path(与 code/cli.py 一样平铺导入)，并生成合成画面/录像。
+合成画面以仓库中的截图为背景，在指定帧贴上按 ICON_SCALE 缩放的图标，每帧写上帧号使画面各不相同。
+"""
+import os
+import sys
+
+import cv2
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "code"))
+
+from matcher import load_template, scale_template  # noqa: E402
+
+TEMPLATE_PATH = os.path.join(ROOT, "terror_shock.png")
+BACKGROUND_PATH = os.path.join(ROOT, "20250322-134043.mp4_002154.400.jpg")
+FRAME_SIZE = (640, 296)
+ICON_SCALE = 0.21
+ICON_POS = (200, 25)
+
+
+def make_frames(count, icon_frames, scale=ICON_SCALE, pos=ICON_POS):
+    """
+    生成 count 帧 BGR 画面(帧号从 1 开始)，icon_frames 中的帧在 pos 处贴上图标；
+    pos 也可以是 frame_idx -> (x, y) 的函数，用于移动的图标
+    """
+    background = cv2.resize(cv2.imread(BACKGROUND_PATH), FRAME_SIZE)
+    icon = scale_template(load_template(TEMPLATE_PATH), scale)
+    frames = []
+    for frame_idx in range(1, count + 1):
+        frame = background.copy()
+        if frame_idx in icon_frames:
+            x, y = pos(frame_idx) if callable(pos) else pos
+            frame[y:y + icon.shape[0], x:x + icon.shape[1]] = icon
+        cv2.putText(frame, str(frame_idx), (10, FRAME_SIZE[1] - 10),
+                    cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
+        frames.append(frame)
+    return frames
+
+
+def write_video(path, frames, fps=30, gop=30):
+    """ 用 PyAV 把 BGR 帧编码为 H.264 mp4(含 B 帧)；没有 PyAV 时跳过调用它的测试 """
+    av = pytest.importorskip("av")
+    height, width = frames[0].shape[:2]
+    with av.open(path, "w") as output:
+        stream = output.add_stream("libx264", rate=fps)
+        stream.width = width
+        stream.height = height
+        stream.pix_fmt = "yuv420p"
+        stream.codec_context.gop_size = gop
+        stream.options = {"bf": "2", "preset": "ultrafast"}
+        for frame in frames:
+            for packet in stream.encode(
+                    av.VideoFrame.from_ndarray(frame, format="bgr24")):
+                output.mux(packet)
+        for packet in stream.encode(None):
+            output.mux(packet)
+    return path
+
+
+@pytest.fixture(scope="session")
+def template_bgr():
+    return load_template(TEMPLATE_PATH)
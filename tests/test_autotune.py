@@ -0,0 +1,38 @@
+import numpy as np
+
+from autotune import evaluate, pick_threshold
+
+
+def make_video(event_frames, peaks, n=3000):
+    """ 每个事件帧上的匹配值为 peaks 中对应的值，其余帧为 0.2 """
+    video = {"fps": 30.0, "event_frames": list(event_frames)}
+    scores = np.full(n, 0.2)
+    for frame, peak in zip(event_frames, peaks):
+        scores[frame] = peak
+    return video, scores
+
+
+def test_recall_is_cross_validated():
+    # 最弱的事件决定全量阈值；它被留出时，其余事件选出的阈值会把它漏掉
+    events = [300, 700, 1100, 1500, 1900]
+    video, scores = make_video(events, [0.9, 0.9, 0.9, 0.9, 0.6])
+
+    threshold, recall, false_positives = evaluate(
+        [video], [scores], stride=1, target_recall=1.0,
+        before=0.1, after=0.1, ignore=1.0)
+
+    assert threshold == pick_threshold([0.9, 0.9, 0.9, 0.9, 0.6], 0.2, 1.0)
+    assert all(scores[f] >= threshold for f in events)
+    assert recall == 0.8
+    assert false_positives == 0
+
+
+def test_single_event_reports_fitted_recall():
+    video, scores = make_video([300], [0.9])
+
+    threshold, recall, _ = evaluate([video], [scores], stride=1,
+                                    target_recall=1.0, before=0.1,
+                                    after=0.1, ignore=1.0)
+
+    assert threshold is not None
+    assert recall == 1.0
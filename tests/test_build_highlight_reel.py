@@ -0,0 +1,88 @@
+import json
+import os
+
+import build_highlight_reel as reel
+from build_highlight_reel import collect_clips, plan_segments
+
+H264 = ("h264", "High", 31, 1280, 592, "yuv420p", "30/1", "1/15360", "sps-a")
+AAC = ("aac", "48000", 2, "asc")
+
+
+def make_clip_dir(root, video, clips):
+    """ 按 find_template_and_extract_clips 的目录结构写出清单与(空)片段文件 """
+    clip_dir = root / f"{os.path.splitext(video)[0]}_scale0.42566"
+    clip_dir.mkdir(parents=True)
+    entries = []
+    for idx, (start_sec, score) in enumerate(clips, start=1):
+        name = f"clip_{idx:03d}.mp4"
+        (clip_dir / name).write_bytes(b"")
+        entries.append({"file": name, "start_sec": start_sec, "score": score})
+    (clip_dir / "clips.json").write_text(
+        json.dumps({"video": f"/rec/{video}", "clips": entries}))
+    return clip_dir
+
+
+def test_collect_clips_order_and_filters(tmp_path):
+    make_clip_dir(tmp_path / "a", "20250322-134043.mp4", [(10.0, 0.8), (5.0, 0.95)])
+    make_clip_dir(tmp_path / "b", "20250322-120000.mp4", [(30.0, 0.75)])
+    make_clip_dir(tmp_path / "b", "20250323-090000.mp4", [(1.0, 0.9)])
+    dirs = [str(tmp_path / "a"), str(tmp_path / "b")]
+
+    by_time = collect_clips(dirs)
+    assert [(os.path.basename(c["video"]), c["score"]) for c in by_time] == [
+        ("20250322-120000.mp4", 0.75),
+        ("20250322-134043.mp4", 0.95),
+        ("20250322-134043.mp4", 0.8),
+        ("20250323-090000.mp4", 0.9),
+    ]
+
+    by_score = collect_clips(dirs, order="score", min_score=0.8, day="2025-03-22")
+    assert [c["score"] for c in by_score] == [0.95, 0.8]
+
+
+def test_plan_segments_reencodes_only_incompatible_clips():
+    other_sps = H264[:-1] + ("sps-b", )
+    other_size = H264[:3] + (1920, 1080) + H264[5:]
+    signatures = [
+        (H264, AAC),
+        (H264, AAC),
+        (other_sps, AAC),  # 只有参数集不同：Annex B 重封装后流复制
+        (other_size, AAC),
+        (H264, None),  # 没有音轨：视频流复制，补静音音轨
+        (H264, AAC),
+    ]
+
+    reference, actions = plan_segments(signatures)
+
+    assert reference == (H264, AAC)
+    assert actions == [None, None, None, "video", "audio", None]
+
+
+def test_build_reel_mixes_copied_and_reencoded_segments(tmp_path, monkeypatch):
+    other_size = H264[:3] + (1920, 1080) + H264[5:]
+    signatures = {"1.mp4": (H264, AAC), "2.mp4": (other_size, AAC),
+                  "3.mp4": (H264, AAC)}
+    calls = []
+    monkeypatch.setattr(reel, "probe_stream_signature",
+                        lambda path: signatures[os.path.basename(path)])
+    monkeypatch.setattr(reel, "remux_annexb",
+                        lambda src, dst, codec: calls.append(("copy", src)))
+    monkeypatch.setattr(
+        reel, "reencode_to_signature",
+        lambda src, dst, sig, src_has_audio, copy_video: calls.append(
+            ("encode", src)))
+    concat = {}
+    monkeypatch.setattr(
+        reel, "concat_copy",
+        lambda paths, out, workdir, extra_args=(): concat.update(
+            paths=paths, extra_args=extra_args))
+
+    clips = [{"path": str(tmp_path / name)} for name in signatures]
+    count, reencoded = reel.build_highlight_reel(clips, str(tmp_path / "reel.mp4"))
+
+    assert (count, reencoded) == (3, 1)
+    assert [(kind, os.path.basename(src)) for kind, src in calls] == [
+        ("copy", "1.mp4"), ("encode", "2.mp4"), ("copy", "3.mp4")]
+    assert [os.path.splitext(p)[1] for p in concat["paths"]] == [".ts"] * 3
+    assert concat["extra_args"] == ["-bsf:a", "aac_adtstoasc",
+                                    "-video_track_timescale", "15360"]
@@ -0,0 +1,18 @@
+from creat_video_cut import clip_windows, merge_intervals
+
+
+def test_clip_windows_to_scan_range():
+    # 窗口为秒数，起止为帧号/时间戳；30 fps 时第 1 帧对应 0 秒
+    windows = [(0.0, 5.0), (10.0, 20.0), (30.0, 40.0), (100.0, 110.0)]
+
+    assert clip_windows(windows, 301, "0:35", 30) == [(301, 601), (901, 1051)]
+    assert clip_windows(windows, None, None, 30) == [(1, 151), (301, 601),
+                                                      (901, 1201),
+                                                      (3001, 3301)]
+    assert clip_windows(windows, "200s", None, 30) == []
+
+
+def test_merge_intervals():
+    assert merge_intervals([(10, 20), (0, 5), (21, 30), (40, 50)]) == [(0, 5),
+                                                                       (10, 30),
+                                                                       (40, 50)]
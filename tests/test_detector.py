@@ -0,0 +1,29 @@
+import json
+
+import cv2
+
+from conftest import FRAME_SIZE, ICON_SCALE, TEMPLATE_PATH, make_frames, write_video
+from config import DetectorConfig
+from detector import Detector
+
+
+def test_iter_matches_does_not_write_scale_store(tmp_path, monkeypatch):
+    import lib
+
+    # 只记录了同宽高比的 2 倍分辨率：640x296 的值按宽高比预测，采样帧上验证通过
+    store_path = tmp_path / "scales.json"
+    w, h = FRAME_SIZE
+    store_path.write_text(json.dumps({f"{2 * w}x{2 * h}": 2 * ICON_SCALE}))
+    monkeypatch.setattr(lib, "SCALE_FACTOR_FILE", str(store_path))
+    video = write_video(str(tmp_path / "rec.mp4"),
+                        make_frames(60, set(range(1, 61))))
+    before = store_path.read_text()
+
+    detector = Detector(DetectorConfig(template_path=TEMPLATE_PATH, stride=5))
+    matches = list(detector.iter_matches(video))
+
+    assert matches
+    assert store_path.read_text() == before
+
+    detector.resolve_scale(w, h, cv2.VideoCapture(video), persist=True)
+    assert f"{w}x{h}" in json.loads(store_path.read_text())
@@ -0,0 +1,22 @@
+import cv2
+import pytest
+
+from conftest import make_frames
+from feature_scale import calibrate_by_features
+
+# 特征估计需要足够大的图标：0.21 时模板上的特征点太少
+SCALE = 0.4
+
+
+@pytest.mark.parametrize("gray", [False, True])
+def test_calibrate_by_features(template_bgr, gray):
+    (frame, ) = make_frames(1, {1}, scale=SCALE, pos=(150, 20))
+    if gray:
+        # frame_cache 中的帧是灰度图
+        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+    scale_factor, max_val, max_loc, _ = calibrate_by_features(frame, template_bgr)
+
+    assert abs(scale_factor - SCALE) < 0.005
+    assert max_val >= 0.9
+    assert abs(max_loc[0] - 150) <= 2 and abs(max_loc[1] - 20) <= 2
@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+
+from conftest import make_frames, write_video
+from frame_cache import open_frame_cache
+from scale_search import load_gray_frames
+
+
+@pytest.fixture(scope="module")
+def video(tmp_path_factory):
+    path = tmp_path_factory.mktemp("video") / "rec.mp4"
+    return write_video(str(path), make_frames(30, set()))
+
+
+def test_cache_matches_decoded_frames(video, tmp_path):
+    cache = open_frame_cache(video, str(tmp_path), start=5, end=20)
+    first_frame, frames = load_gray_frames(video, start=5, end=20)
+
+    assert (cache.first_frame, len(cache)) == (first_frame, len(frames))
+    assert np.array_equal(cache.frames, np.stack(frames))
+    # 第二次打开直接读取缓存
+    again = open_frame_cache(video, str(tmp_path), start=5, end=20)
+    assert again.frames.shape == (16, ) + frames[0].shape
+
+
+def test_cache_rejects_color_match_mode_before_decoding(video, tmp_path):
+    with pytest.raises(ValueError, match="masked_gray"):
+        open_frame_cache(video, str(tmp_path), match_mode="red_likelihood")
+    assert list(tmp_path.iterdir()) == []
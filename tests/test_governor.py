@@ -0,0 +1,49 @@
+import os
+import sys
+import time
+
+import pytest
+
+from conftest import ICON_SCALE, TEMPLATE_PATH, make_frames, write_video
+from config import DetectorConfig
+from governor import EXPORT_NICE, ResourceGovernor, benchmark
+
+pytestmark = pytest.mark.skipif(not hasattr(os, "setpriority"),
+                                reason="需要 os.setpriority")
+
+
+def fake_ffmpeg(path, body):
+    """ 忽略全部参数、只执行 body 的假 FFmpeg 脚本 """
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(f"#!/bin/sh\n{body}\n")
+    os.chmod(path, 0o755)
+    return str(path)
+
+
+def test_export_runs_at_lower_priority(tmp_path):
+    out = tmp_path / "nice.txt"
+    script = fake_ffmpeg(
+        tmp_path / "ffmpeg",
+        f'sleep 0.5; "{sys.executable}" -c "import os; '
+        f'print(os.getpriority(os.PRIO_PROCESS, os.getppid()))" > "{out}"')
+
+    result = ResourceGovernor(cores=2).run_ffmpeg([script, "-i", "in.mp4"])
+
+    assert result.returncode == 0
+    base = os.getpriority(os.PRIO_PROCESS, 0)
+    assert int(out.read_text()) == min(19, base + EXPORT_NICE)
+
+
+def test_benchmark_stops_background_export(tmp_path):
+    video = write_video(str(tmp_path / "rec.mp4"), make_frames(60, set()))
+    script = fake_ffmpeg(tmp_path / "ffmpeg", "sleep 60")
+    config = DetectorConfig(template_path=TEMPLATE_PATH,
+                            scale_factor=ICON_SCALE,
+                            stride=5)
+
+    t0 = time.perf_counter()
+    results = benchmark(video, config, frames=20, cores=1, splits=[(1, 1)],
+                        export_cmd=[script, "-f", "null", "-"])
+
+    assert time.perf_counter() - t0 < 30
+    assert [r["workers"] for r in results] == [1]
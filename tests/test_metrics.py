@@ -0,0 +1,63 @@
+import json
+import types
+import urllib.error
+import urllib.request
+
+import pytest
+
+import metrics
+from metrics import METRICS, start_metrics_server
+
+
+@pytest.fixture
+def server(monkeypatch):
+    # 固定时钟：fps/ETA 只取决于记录的帧号
+    clock = types.SimpleNamespace(now=100.0)
+    monkeypatch.setattr(metrics, "time",
+                        types.SimpleNamespace(monotonic=lambda: clock.now))
+    METRICS.reset()
+    server = start_metrics_server(port=0)
+    yield server, clock
+    server.shutdown()
+    server.server_close()
+    METRICS.reset()
+
+
+def fetch(server, path):
+    url = f"http://127.0.0.1:{server.server_port}{path}"
+    with urllib.request.urlopen(url, timeout=5) as response:
+        return response.headers["Content-Type"], response.read().decode("utf-8")
+
+
+def test_metrics_endpoints(server):
+    server, clock = server
+    METRICS.start_video("rec.mp4", first_frame=101, last_frame=1100)
+    clock.now += 2.0
+    METRICS.frame(300)
+    for _ in range(3):
+        METRICS.hit()
+
+    content_type, text = fetch(server, "/metrics")
+    assert content_type.startswith("text/plain")
+    lines = text.splitlines()
+    assert "# TYPE id5clips_hits_total counter" in lines
+    assert "id5clips_frames_processed 200" in lines
+    assert "id5clips_frames_total 1000" in lines
+    assert "id5clips_hits_total 3" in lines
+    assert "id5clips_fps 100.0" in lines
+    assert "id5clips_eta_seconds 8.0" in lines
+
+    content_type, text = fetch(server, "/metrics.json")
+    assert content_type.startswith("application/json")
+    snap = json.loads(text)
+    assert snap["video"] == "rec.mp4"
+    assert snap["frames_processed"] == 200
+    assert snap["frames_total"] == 1000
+    assert snap["progress"] == 0.2
+    assert snap["hits"] == 3
+    assert snap["fps"] == 100.0
+    assert snap["eta_seconds"] == 8.0
+
+    with pytest.raises(urllib.error.HTTPError) as excinfo:
+        fetch(server, "/other")
+    assert excinfo.value.code == 404
@@ -0,0 +1,61 @@
+import cv2
+import numpy as np
+
+from conftest import ICON_SCALE, make_frames, write_video
+from scale_search import (exhaustive_scale_search, halving_scale_search,
+                          load_gray_frames)
+
+GRID = np.linspace(0.15, 0.27, 13)
+
+
+def gray(frames):
+    return [cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) for frame in frames]
+
+
+def assert_same_result(halving, exhaustive):
+    assert halving.scale_factor == exhaustive.scale_factor
+    assert halving.score == exhaustive.score
+    assert halving.frame_idx == exhaustive.frame_idx
+    assert halving.hits == exhaustive.hits
+
+
+def test_halving_matches_exhaustive(template_bgr):
+    frames = gray(make_frames(40, icon_frames={12, 13, 14, 30}))
+    exhaustive = exhaustive_scale_search(frames, template_bgr, GRID,
+                                         first_frame=101)
+    halving = halving_scale_search(frames,
+                                   template_bgr,
+                                   GRID,
+                                   first_frame=101,
+                                   initial_frames=8)
+
+    assert_same_result(halving, exhaustive)
+    assert abs(exhaustive.scale_factor - ICON_SCALE) <= GRID[1] - GRID[0]
+    assert [frame_idx for frame_idx, _ in exhaustive.hits] == [112, 113, 114, 130]
+    assert halving.calls < exhaustive.calls
+    assert abs(halving.refined_scale_factor - ICON_SCALE) < abs(
+        halving.scale_factor - ICON_SCALE) + 1e-9
+
+
+def test_halving_rechecks_scales_eliminated_on_samples(template_bgr):
+    # 第一轮的 8 个采样帧都不含图标，按噪声淘汰一半候选；之后的复查要把被误删的最优值找回来
+    frames = gray(make_frames(40, icon_frames={2, 3, 4, 5}))
+    exhaustive = exhaustive_scale_search(frames, template_bgr, GRID)
+    halving = halving_scale_search(frames,
+                                   template_bgr,
+                                   GRID,
+                                   initial_frames=8,
+                                   keep=1)
+
+    assert_same_result(halving, exhaustive)
+    assert exhaustive.frame_idx in (2, 3, 4, 5)
+
+
+def test_load_gray_frames_range(tmp_path):
+    path = write_video(str(tmp_path / "clip.mp4"),
+                       make_frames(30, icon_frames=set()))
+    first_frame, frames = load_gray_frames(path, start=5, end=20)
+
+    assert first_frame == 5
+    assert len(frames) == 16
+    assert all(frame.ndim == 2 for frame in frames)
@@ -0,0 +1,143 @@
+import multiprocessing
+import os
+import time
+
+import pytest
+
+from conftest import ICON_SCALE, TEMPLATE_PATH, make_frames, write_video
+from config import DetectorConfig
+from spool_queue import (Heartbeat, _finish, claim_job, collect_results,
+                         queue_status, requeue_stale, run_local_workers,
+                         submit_job)
+
+
+def _claim_all(spool, worker_id, out_path):
+    """ 子进程：不断认领直到 pending 为空，把认领到的 job_id 写到 out_path """
+    claimed = []
+    while True:
+        _, job = claim_job(spool, worker_id)
+        if job is None:
+            break
+        claimed.append(job["id"])
+    with open(out_path, "w", encoding="utf-8") as f:
+        f.write("\n".join(claimed))
+
+
+def _claim_and_crash(spool, worker_id):
+    """ 子进程：认领一个任务后不发心跳、不写结果直接退出，模拟 worker 崩溃 """
+    claim_job(spool, worker_id)
+    os._exit(0)
+
+
+@pytest.fixture
+def config():
+    return DetectorConfig(template_path=TEMPLATE_PATH,
+                          scale_factor=ICON_SCALE,
+                          stride=5)
+
+
+@pytest.fixture(scope="module")
+def video(tmp_path_factory):
+    # 不含图标：扫描得到空清单，不需要 FFmpeg
+    path = tmp_path_factory.mktemp("video") / "rec.mp4"
+    return write_video(str(path), make_frames(30, set()))
+
+
+def test_each_job_claimed_by_exactly_one_process(tmp_path, config):
+    spool = str(tmp_path / "spool")
+    job_ids = {
+        submit_job(spool, f"video_{i}.mp4", config, str(tmp_path))
+        for i in range(40)
+    }
+    procs = [
+        multiprocessing.Process(target=_claim_all,
+                                args=(spool, f"w{i}", str(tmp_path / f"w{i}.txt")))
+        for i in range(4)
+    ]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+
+    claimed = []
+    for i in range(4):
+        text = (tmp_path / f"w{i}.txt").read_text(encoding="utf-8")
+        claimed += [line for line in text.split("\n") if line]
+    assert sorted(claimed) == sorted(job_ids)
+    assert queue_status(spool) == {"pending": 0, "running": 40, "done": 0, "failed": 0}
+
+
+def test_heartbeat_prevents_requeue(tmp_path, config):
+    spool = str(tmp_path / "spool")
+    submit_job(spool, "video.mp4", config, str(tmp_path))
+    running_path, job = claim_job(spool, "w0")
+    beat = Heartbeat(running_path, interval=0.05)
+    beat.start()
+    time.sleep(1.0)
+    assert requeue_stale(spool, stale_after=0.5) == []
+    beat.stop()
+
+    time.sleep(0.6)
+    assert requeue_stale(spool, stale_after=0.5) == [job["id"]]
+    assert queue_status(spool)["pending"] == 1
+
+
+def test_finish_after_requeue_leaves_no_result(tmp_path, config):
+    spool = str(tmp_path / "spool")
+    submit_job(spool, "video.mp4", config, str(tmp_path))
+    running_path, job = claim_job(spool, "w0")
+    assert requeue_stale(spool, stale_after=0) == [job["id"]]
+
+    assert not _finish(spool, running_path, job, "done", {"manifest": None})
+    assert os.listdir(os.path.join(spool, "done")) == []
+
+    # 重新认领的 worker 正常提交
+    running_path, job = claim_job(spool, "w1")
+    assert job["attempts"] == 1
+    assert _finish(spool, running_path, job, "done", {"manifest": None})
+    assert [j["id"] for j, _ in collect_results(spool)] == [job["id"]]
+
+
+def test_local_workers_recover_job_of_crashed_worker(tmp_path, config, video):
+    spool = str(tmp_path / "spool")
+    job_ids = [
+        submit_job(spool, video, config, str(tmp_path / "clips"))
+        for _ in range(3)
+    ]
+    crashed = multiprocessing.Process(target=_claim_and_crash,
+                                      args=(spool, "crashed"))
+    crashed.start()
+    crashed.join()
+    assert queue_status(spool)["running"] == 1
+
+    status = run_local_workers(spool,
+                               workers=2,
+                               poll=0.1,
+                               heartbeat=0.1,
+                               stale_after=1.0)
+
+    assert status == {"pending": 0, "running": 0, "done": 3, "failed": 0}
+    results = collect_results(spool)
+    assert sorted(job["id"] for job, _ in results) == sorted(job_ids)
+    assert all(result["manifest"]["clips"] == [] for _, result in results)
+    lost = [job for job, _ in results if job.get("lost_by")]
+    assert [job["lost_by"] for job in lost] == [["crashed"]]
+
+
+def test_job_fails_instead_of_prompting_without_scale_factor(
+        tmp_path, video, monkeypatch):
+    import builtins
+    import lib
+    from spool_queue import run_job
+
+    def no_input(prompt=""):
+        raise AssertionError("worker 不应等待输入")
+
+    monkeypatch.setattr(lib, "SCALE_FACTOR_FILE", str(tmp_path / "scales.json"))
+    monkeypatch.setattr(builtins, "input", no_input)
+    spool = str(tmp_path / "spool")
+    submit_job(spool, video, DetectorConfig(template_path=TEMPLATE_PATH),
+               str(tmp_path / "clips"))
+    _, job = claim_job(spool, "w0")
+
+    assert run_job(job) is None
@@ -0,0 +1,48 @@
+import json
+import os
+
+import pytest
+
+from conftest import ICON_SCALE, TEMPLATE_PATH, make_frames, write_video
+
+av = pytest.importorskip("av")
+from stream_cut import single_pass_extract_clips  # noqa: E402
+
+# 两次图标出现：第 101-110 帧、第 241-245 帧；stride=5 时命中 105/110 与 245
+ICON_FRAMES = set(range(101, 111)) | set(range(241, 246))
+
+
+@pytest.fixture(scope="module")
+def video(tmp_path_factory):
+    path = tmp_path_factory.mktemp("video") / "rec.mp4"
+    return write_video(str(path), make_frames(400, ICON_FRAMES))
+
+
+@pytest.mark.parametrize("options", [
+    dict(roi=(180, 10, 170, 80)),
+    dict(roi=(180, 10, 170, 80), batch_size=4),
+    dict(roi=(180, 10, 170, 80), track_margin=16),
+    dict(),
+])
+def test_single_pass_clips(video, tmp_path, options):
+    manifest = single_pass_extract_clips(video,
+                                         TEMPLATE_PATH,
+                                         str(tmp_path),
+                                         threshold=0.7,
+                                         stride=5,
+                                         scale_factor=ICON_SCALE,
+                                         **options)
+
+    clips = [(c["start_frame"], c["end_frame"], c["hits"])
+             for c in manifest["clips"]]
+    # 片段在 post-roll(第 110 + 100 帧)结束时关闭，下一次命中从其后一帧开始
+    assert clips == [(0, 210, [105, 110]), (211, 345, [245])]
+
+    (output_path, ) = [p for p in tmp_path.iterdir() if p.is_dir()]
+    with open(output_path / "clips.json", encoding="utf-8") as f:
+        assert json.load(f)["clips"] == manifest["clips"]
+    with av.open(str(output_path / "clip_001.mp4")) as container:
+        decoded = sum(1 for _ in container.decode(video=0))
+    # 从第 1 帧复制到终点；解码顺序中终点之后可能多带一两个参考帧
+    assert 210 <= decoded <= 213
+    assert os.path.getsize(output_path / "clip_002.mp4") > 0
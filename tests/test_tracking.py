@@ -0,0 +1,51 @@
+import pytest
+
+from conftest import FRAME_SIZE, ICON_SCALE, TEMPLATE_PATH, make_frames
+from config import DetectorConfig
+from detector import Detector
+from matcher import scan_frames
+
+# 图标在第 6-25 帧出现，每帧移动 (3, 1) 像素，使跟踪窗口落在缩小网格的不同相位上
+ICON_FRAMES = set(range(6, 26))
+
+
+def icon_pos(frame_idx):
+    return 150 + 3 * frame_idx, 20 + frame_idx
+
+
+@pytest.fixture(scope="module")
+def frames():
+    return list(enumerate(make_frames(30, ICON_FRAMES, pos=icon_pos), start=1))
+
+
+def scan(frames, downscale, roi, track_margin):
+    config = DetectorConfig(template_path=TEMPLATE_PATH,
+                            scale_factor=ICON_SCALE,
+                            downscale=downscale)
+    matcher = Detector(config).matcher_for(ICON_SCALE)
+    return [(frame_idx, max_val, loc) for frame_idx, _, max_val, loc in
+            scan_frames(iter(frames),
+                        matcher,
+                        FRAME_SIZE[0],
+                        FRAME_SIZE[1],
+                        roi=roi,
+                        batch_backend="opencv",
+                        verbose=False,
+                        threshold=0.7,
+                        track_margin=track_margin)]
+
+
+@pytest.mark.parametrize("downscale", [1.0, 0.5, 0.75])
+@pytest.mark.parametrize("roi", [None, (101, 3, 300, 120)])
+def test_tracking_matches_full_search(frames, downscale, roi):
+    full = scan(frames, downscale, roi, track_margin=None)
+    tracked = scan(frames, downscale, roi, track_margin=8)
+
+    full_hits = [r for r in full if r[1] >= 0.7]
+    tracked_hits = [r for r in tracked if r[1] >= 0.7]
+    # 缩小后部分相位上的匹配值会低于阈值，这里只要求命中都在图标帧上
+    assert full_hits and {r[0] for r in full_hits} <= ICON_FRAMES
+    if downscale == 1.0:
+        assert [r[0] for r in full_hits] == sorted(ICON_FRAMES)
+    # 命中帧上的匹配值与位置都与完整搜索相同
+    assert tracked_hits == full_hits
@@ -0,0 +1,44 @@
+from conftest import ICON_SCALE, TEMPLATE_PATH
+from config import DetectorConfig
+from spool_queue import _finish, claim_job, queue_status
+from watch_folder import VideoCatalog, scan_once
+
+
+def finish_next(spool, state, result):
+    running_path, job = claim_job(spool, "w0")
+    assert _finish(spool, running_path, job, state, result)
+    return job["id"]
+
+
+def test_queued_runs_pick_up_spool_results(tmp_path):
+    watch_dir = tmp_path / "watch"
+    watch_dir.mkdir()
+    (watch_dir / "rec.mp4").write_bytes(b"not really a video")
+    spool = str(tmp_path / "spool")
+    config = DetectorConfig(template_path=TEMPLATE_PATH, scale_factor=ICON_SCALE)
+    catalog = VideoCatalog(str(tmp_path / "catalog.sqlite"))
+
+    def scan(**kwargs):
+        return scan_once(catalog, str(watch_dir), config, str(tmp_path / "clips"),
+                         spool=spool, settle=0, **kwargs)
+
+    def statuses():
+        return [row[0] for row in catalog.conn.execute("SELECT status FROM runs")]
+
+    assert scan() == 1
+    assert statuses() == ["queued"]
+    assert scan() == 0  # 仍在排队，不重复提交
+
+    finish_next(spool, "failed", {"error": "boom"})
+    assert scan() == 0
+    assert statuses() == ["failed"]
+    assert scan(retry_failed=True) == 1
+    assert statuses() == ["queued"]
+
+    job_id = finish_next(spool, "done", {"manifest": {"clips": [{}, {}]}})
+    assert scan() == 0
+    assert statuses() == ["done"]
+    (result, ) = catalog.conn.execute("SELECT result FROM runs").fetchone()
+    assert f'"job_id": "{job_id}"' in result and '"clips": 2' in result
+    assert queue_status(spool)["pending"] == 0
+    catalog.close()